@@ -1,31 +1,54 @@
 import random
-
-from PIL import Image
-import numpy as np
-from transformers import AutoModel
-import torch
+import threading
 import warnings
-from torch.nn.modules.module import Module
+
+MODEL_NAME = "ragavsachdeva/magiv2"
 
 
 class MagiModel:
-    def __init__(self):
-        warnings.filterwarnings("ignore",
-                                message="for .*: copying from a non-meta parameter in the checkpoint to a meta parameter.*")
-        self.model = AutoModel.from_pretrained("ragavsachdeva/magiv2", trust_remote_code=True).eval()
+    """Wrapper around the Magi checkpoint. The weights are only loaded on first use or by load()."""
+
+    def __init__(self, model_id=MODEL_NAME):
+        self.model_id = model_id
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load()
+        return self._model
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+    def load(self):
+        with self._load_lock:
+            if self._model is None:
+                from transformers import AutoModel
+
+                warnings.filterwarnings("ignore",
+                                        message="for .*: copying from a non-meta parameter in the checkpoint to a meta parameter.*")
+                self._model = AutoModel.from_pretrained(self.model_id, trust_remote_code=True).eval()
+        return self
+
+    def detect_objects(self, image, debug=False):
+        return self.detect_objects_batch([image], debug=debug)
+
+    def detect_objects_batch(self, images, debug=False):
+        """Runs one model call over a list of page images and returns one result dict per page."""
+        import torch
 
-    def detect_objects(self,image, debug=False):
-        images = [image]
         character_bank = {
             "images": [],
             "names": []
         }
         with torch.no_grad():
-            page_results = self.model.do_chapter_wide_prediction(images, character_bank, use_tqdm=True,
-                                                            do_ocr=False)
-            print(page_results)
+            page_results = self.model.do_chapter_wide_prediction(images, character_bank, use_tqdm=False,
+                                                                 do_ocr=False)
             if debug:
-                for i, (image, page_result) in enumerate(zip(image, page_results)):
+                for i, (image, page_result) in enumerate(zip(images, page_results)):
                     self.model.visualise_single_image_prediction(image, page_result, f"page_{random.randint(0, 10000)}.png")
 
         return page_results
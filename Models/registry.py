@@ -0,0 +1,50 @@
+import threading
+
+from Models import magi
+
+_factories = {
+    magi.MODEL_NAME: lambda: magi.MagiModel(magi.MODEL_NAME)
+}
+_models = {}
+_lock = threading.Lock()
+
+
+def register_model(name, factory):
+    """Makes factory() the constructor for name. Already created instances are kept."""
+    with _lock:
+        _factories[name] = factory
+
+
+def get_model(name=magi.MODEL_NAME):
+    """Returns the shared instance for name, creating it on first request.
+
+    Creating the instance does not load any weights; that happens on its first inference or warm_up().
+    """
+    with _lock:
+        model = _models.get(name)
+        if model is None:
+            if name not in _factories:
+                raise KeyError(f"No model registered under {name}")
+            model = _factories[name]()
+            _models[name] = model
+        return model
+
+
+def warm_up(name=magi.MODEL_NAME, sample_image=None):
+    """Loads the weights of name now and optionally runs one inference to initialise the kernels."""
+    model = get_model(name)
+    if hasattr(model, "load"):
+        model.load()
+    if sample_image is not None:
+        model.detect_objects_batch([sample_image])
+    return model
+
+
+def loaded_models():
+    with _lock:
+        return [name for name, model in _models.items() if getattr(model, "is_loaded", True)]
+
+
+def clear():
+    with _lock:
+        _models.clear()
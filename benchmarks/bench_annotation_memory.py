@@ -0,0 +1,98 @@
+"""Memory of loaded annotations: Panel/SpeechBubble/Entity objects vs. the columnar CompactPage.
+
+Loads the annotation XMLs under --comics with xml_stream.load_comic, repeating them until at
+least --boxes boxes (panels, speech bubbles and entities) are resident, and reports the traced
+allocations per 10k boxes for both layouts. Every comic is also written back from the compact
+layout and compared byte for byte with the object layout.
+
+    python -m benchmarks.bench_annotation_memory --boxes 50000
+"""
+import argparse
+import gc
+import glob
+import io
+import os
+import time
+import tracemalloc
+
+from src.Utils import xml_stream
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "Data")
+
+
+def count_boxes(comic):
+    boxes = 0
+    for pair in comic.page_pairs:
+        for page in pair:
+            if page is None:
+                continue
+            for panel in page.panels:
+                boxes += 1 + len(panel.speech_bubbles) + len(panel.entities)
+    return boxes
+
+
+def serialize(comic):
+    buffer = io.BytesIO()
+    xml_stream.write_comic(comic, buffer)
+    return buffer.getvalue()
+
+
+def measure(paths, copies, compact):
+    """(traced bytes, seconds) to load copies of every file at paths; the comics stay alive until measured."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    comics = [xml_stream.load_comic(path, compact=compact) for _ in range(copies) for path in paths]
+    seconds = time.perf_counter() - start
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del comics
+    return current, seconds
+
+
+def lookup_seconds(comics, repeats):
+    """Seconds for repeats passes of panel_at over a grid of points on every page."""
+    pages = [page for comic in comics for pair in comic.page_pairs for page in pair if page is not None]
+    points = [(x, y) for x in range(100, 1300, 400) for y in range(100, 1900, 400)]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for page in pages:
+            for x, y in points:
+                page.panel_at(x, y)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--comics", default=os.path.join(DATA_DIR, "comics"), help="folder with annotation XMLs")
+    parser.add_argument("--boxes", type=int, default=50000, help="minimum number of resident boxes")
+    parser.add_argument("--repeats", type=int, default=20, help="passes of the panel lookup timing")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.comics, "*.xml")))
+    if not paths:
+        raise SystemExit(f"no annotation XMLs under {args.comics}")
+
+    boxes_per_copy = 0
+    for path in paths:
+        comic = xml_stream.load_comic(path)
+        compact = xml_stream.load_comic(path, compact=True)
+        if serialize(comic) != serialize(compact):
+            raise SystemExit(f"compact layout does not round-trip {path}")
+        boxes_per_copy += count_boxes(comic)
+    copies = -(-args.boxes // boxes_per_copy)
+    boxes = copies * boxes_per_copy
+    print(f"{len(paths)} comics, {boxes_per_copy} boxes each copy, {copies} copies, {boxes} boxes; XML round-trip ok")
+
+    print(f"{'layout':>8} {'MB':>8} {'bytes/box':>10} {'MB/10k boxes':>13} {'load s':>8} {'lookup s':>9}")
+    for compact in (False, True):
+        traced, seconds = measure(paths, copies, compact)
+        comics = [xml_stream.load_comic(path, compact=compact) for path in paths]
+        lookup = lookup_seconds(comics, args.repeats)
+        print(f"{'compact' if compact else 'objects':>8} {traced / 1024 ** 2:>8.1f} {traced / boxes:>10.0f} "
+              f"{traced / boxes * 10000 / 1024 ** 2:>13.2f} {seconds:>8.2f} {lookup:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Pages/sec of ComicReader.read_comic against the detection batch size, using a stub model.
+
+The stub replaces MagiModel with a fixed per-call overhead plus a per-page cost, so the
+numbers show how much of a chapter's runtime is call overhead that batching removes.
+
+    python -m benchmarks.bench_batched_inference --pages 120 --batch-sizes 1 2 4 8 16
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.Components.comic_reader import ComicReader
+
+
+class StubMagiModel:
+    def __init__(self, call_overhead=0.05, page_cost=0.01, boxes_per_page=12, seed=0):
+        self.call_overhead = call_overhead
+        self.page_cost = page_cost
+        self.boxes_per_page = boxes_per_page
+        self.rng = np.random.default_rng(seed)
+        self.calls = 0
+
+    def _boxes(self, image, count):
+        height, width = image.shape[:2]
+        x1 = self.rng.uniform(0, width * 0.8, count)
+        y1 = self.rng.uniform(0, height * 0.8, count)
+        x2 = x1 + self.rng.uniform(10, width * 0.2, count)
+        y2 = y1 + self.rng.uniform(10, height * 0.2, count)
+        return np.stack([x1, y1, x2, y2], axis=1).tolist()
+
+    def _page_result(self, image):
+        count = self.boxes_per_page
+        return {
+            'panels': self._boxes(image, max(1, count // 3)),
+            'texts': self._boxes(image, count),
+            'characters': self._boxes(image, count),
+            'tails': [],
+            'text_character_associations': [],
+            'text_tail_associations': [],
+            'character_cluster_labels': list(range(count)),
+            'is_essential_text': [i % 2 == 0 for i in range(count)],
+            'character_names': ['Other'] * count,
+        }
+
+    def detect_objects_batch(self, images, debug=False):
+        self.calls += 1
+        time.sleep(self.call_overhead + self.page_cost * len(images))
+        return [self._page_result(image) for image in images]
+
+
+def run(pages, batch_sizes, call_overhead, page_cost, height, width):
+    images = [np.zeros((height, width, 3), dtype=np.uint8) for _ in range(pages)]
+    results = []
+
+    for batch_size in batch_sizes:
+        model = StubMagiModel(call_overhead=call_overhead, page_cost=page_cost)
+        reader = ComicReader(model=model, batch_size=batch_size)
+
+        start = time.perf_counter()
+        reader.read_comic("benchmark", images)
+        elapsed = time.perf_counter() - start
+
+        results.append((batch_size, model.calls, elapsed, pages / elapsed))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=120)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--call-overhead", type=float, default=0.05, help="seconds per model call")
+    parser.add_argument("--page-cost", type=float, default=0.01, help="seconds per page inside a call")
+    parser.add_argument("--height", type=int, default=1800)
+    parser.add_argument("--width", type=int, default=1280)
+    args = parser.parse_args()
+
+    results = run(args.pages, args.batch_sizes, args.call_overhead, args.page_cost, args.height, args.width)
+
+    print(f"{'batch':>6} {'calls':>6} {'seconds':>9} {'pages/sec':>10}")
+    for batch_size, calls, elapsed, throughput in results:
+        print(f"{batch_size:>6} {calls:>6} {elapsed:>9.2f} {throughput:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
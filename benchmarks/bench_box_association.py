@@ -0,0 +1,129 @@
+"""Panel/entity/speech bubble association: per-pair calculate_iou loops against the NumPy engine.
+
+Generates synthetic pages with a grid of panels and hundreds of entity and bubble boxes, checks that
+both paths assign the same boxes to the same panels and reports the time per page.
+
+    python -m benchmarks.bench_box_association --panels 12 48 --boxes 100 400 800
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.Classes.page import Page, PageType
+from src.Classes.panel import Panel
+from src.Components.comic_reader import ComicReader
+from src.Utils import image_utils as iu
+
+
+def legacy_associate(panel_list, entity_list, speechbubble_list, y_tolerance=50):
+    """The association as ComicReader did it before the box_association engine, without image crops."""
+    panels = []
+    for box in panel_list:
+        panels.append(Panel("", iu.x1y1x2y2_to_xywh(box)))
+        panels = sorted(panels, key=lambda p: (p.bounding_box['y'] // y_tolerance, p.bounding_box['x']))
+
+    for box in entity_list:
+        bbox = iu.x1y1x2y2_to_xywh(box)
+        for _ in panels:
+            best_panel = None
+            highest_iou = 0
+            for panel in panels:
+                iou_value = iu.calculate_iou(panel.bounding_box, bbox)
+                if iou_value > highest_iou:
+                    highest_iou = iou_value
+                    best_panel = panel
+            if best_panel is not None and highest_iou > 0:
+                if not any(iu.calculate_iou(existing, bbox) > 0.6 for existing in best_panel.entities):
+                    best_panel.entities.append(bbox)
+            for panel in panels:
+                panel.entities = sorted(panel.entities, key=lambda b: (b['y'] - b['height'], b['x'] - b['width']))
+
+    for box in speechbubble_list:
+        bbox = iu.x1y1x2y2_to_xywh(box)
+        max_overlap = 0
+        best_panel = None
+        for panel in panels:
+            overlap = iu.calculate_overlap_percentage(bbox, panel.bounding_box)
+            if overlap > max_overlap:
+                max_overlap = overlap
+                best_panel = panel
+        if best_panel:
+            best_panel.speech_bubbles.append(bbox)
+    for panel in panels:
+        panel.speech_bubbles = sorted(panel.speech_bubbles, key=lambda b: (b['y'] - b['height'], b['x'] - b['width']))
+
+    return panels
+
+
+def synthetic_page(panel_count, box_count, rng, height=2000, width=1400):
+    columns = max(1, int(np.sqrt(panel_count)))
+    rows = int(np.ceil(panel_count / columns))
+    cell_w, cell_h = width / columns, height / rows
+    panels = [
+        [c * cell_w + 5, r * cell_h + 5, (c + 1) * cell_w - 5, (r + 1) * cell_h - 5]
+        for r in range(rows) for c in range(columns)
+    ][:panel_count]
+
+    def boxes(count, max_size):
+        x1 = rng.uniform(0, width - max_size, count)
+        y1 = rng.uniform(0, height - max_size, count)
+        return np.stack([x1, y1, x1 + rng.uniform(10, max_size, count), y1 + rng.uniform(10, max_size, count)],
+                        axis=1).tolist()
+
+    return panels, boxes(box_count, 300), boxes(box_count, 150)
+
+
+def vectorized_associate(reader, panel_list, entity_list, speechbubble_list, height=2000, width=1400):
+    page = Page(page_index=1, page_type=PageType.SINGLE, page_image=np.zeros((height, width, 3), dtype=np.uint8))
+    reader.handle_panels(panel_list, page)
+    reader.handle_entities(entity_list, list(range(len(entity_list))), page)
+    reader.handle_speechbubbles(speechbubble_list, [False] * len(speechbubble_list), page)
+    return page.panels
+
+
+def same_result(legacy_panels, panels):
+    for legacy, panel in zip(legacy_panels, panels):
+        if legacy.bounding_box != panel.bounding_box:
+            return False
+        if legacy.entities != [entity.bounding_box for entity in panel.entities]:
+            return False
+        if legacy.speech_bubbles != [sb.bounding_box for sb in panel.speech_bubbles]:
+            return False
+    return len(legacy_panels) == len(panels)
+
+
+def timed(function, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, nargs="+", default=[6, 24, 60])
+    parser.add_argument("--boxes", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    reader = ComicReader(model=object())
+
+    print(f"{'panels':>6} {'boxes':>6} {'legacy ms':>10} {'numpy ms':>9} {'speedup':>8} {'equal':>6}")
+    for panel_count in args.panels:
+        for box_count in args.boxes:
+            panel_list, entity_list, speechbubble_list = synthetic_page(panel_count, box_count, rng)
+            legacy_time, legacy_panels = timed(
+                lambda: legacy_associate(panel_list, entity_list, speechbubble_list), args.repeats)
+            numpy_time, panels = timed(
+                lambda: vectorized_associate(reader, panel_list, entity_list, speechbubble_list), args.repeats)
+            print(f"{panel_count:>6} {box_count:>6} {legacy_time * 1000:>10.1f} {numpy_time * 1000:>9.1f} "
+                  f"{legacy_time / numpy_time:>7.1f}x {str(same_result(legacy_panels, panels)):>6}")
+
+
+if __name__ == "__main__":
+    main()
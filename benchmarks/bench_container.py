@@ -0,0 +1,92 @@
+"""Load/save time and size of the binary annotation container against the annotation XMLs.
+
+For every XML under --comics this converts to the container, checks that converting back
+writes the same bytes, and reports the median over --repeats of: loading the whole comic,
+saving it, and opening the file to read the middle page pair only (lazy XML scan vs. the
+container's page offset table).
+
+    python -m benchmarks.bench_container --repeats 5
+"""
+import argparse
+import glob
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.Utils import comic_container, xml_stream
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "Data")
+
+
+def median_seconds(function, repeats):
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return float(np.median(seconds))
+
+
+def xml_bytes(comic):
+    buffer = io.BytesIO()
+    xml_stream.write_comic(comic, buffer)
+    return buffer.getvalue()
+
+
+def container_bytes(comic):
+    buffer = io.BytesIO()
+    comic_container.write_container(comic, buffer)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--comics", default=os.path.join(DATA_DIR, "comics"), help="folder with annotation XMLs")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.comics, "*.xml")))
+    if not paths:
+        raise SystemExit(f"no annotation XMLs under {args.comics}")
+
+    print(f"{'comic':>10} {'format':>9} {'KB':>7} {'load ms':>8} {'save ms':>8} {'page ms':>8}")
+    totals = {"xml": np.zeros(4), "container": np.zeros(4)}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for path in paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            comic = xml_stream.load_comic(path)
+            container_path = os.path.join(temp_dir, name + comic_container.CONTAINER_SUFFIX)
+            comic_container.save_container(comic, container_path)
+            if xml_bytes(comic_container.load_container(container_path)) != xml_bytes(comic):
+                raise SystemExit(f"container does not round-trip {path}")
+            middle = len(comic.page_pairs) // 2
+
+            rows = {
+                "xml": (
+                    os.path.getsize(path),
+                    median_seconds(lambda: xml_stream.load_comic(path), args.repeats),
+                    median_seconds(lambda: xml_bytes(comic), args.repeats),
+                    median_seconds(lambda: xml_stream.load_comic(path, lazy=True).page_pairs[middle], args.repeats),
+                ),
+                "container": (
+                    os.path.getsize(container_path),
+                    median_seconds(lambda: comic_container.load_container(container_path), args.repeats),
+                    median_seconds(lambda: container_bytes(comic), args.repeats),
+                    median_seconds(lambda: comic_container.load_container(container_path, lazy=True)
+                                   .page_pairs[middle], args.repeats),
+                ),
+            }
+            for kind, (size, load, save, page) in rows.items():
+                totals[kind] += (size, load, save, page)
+                print(f"{name:>10} {kind:>9} {size / 1024:>7.1f} {load * 1000:>8.1f} {save * 1000:>8.1f} "
+                      f"{page * 1000:>8.2f}")
+
+    for kind, (size, load, save, page) in totals.items():
+        print(f"{'total':>10} {kind:>9} {size / 1024:>7.1f} {load * 1000:>8.1f} {save * 1000:>8.1f} {page * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Latency and box accuracy of the classical detectors at several working resolutions.
+
+Ground truth comes from the CVAT export via evaluation.CLASSICAL_LABELS (panel boxes, and text
+boxes standing in for speech bubbles). A page is evaluated when its image exists under --images;
+pages that are missing are skipped. If none of the ground truth pages are on disk, the full
+resolution output on the local comics is used as the reference, so the table then shows
+agreement with full resolution rather than accuracy.
+
+    python -m benchmarks.bench_cv_pyramid --sizes 0 1024 768 512 --refine
+"""
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from src.Components.cv_panel import find_panels, find_speech_bubbles
+from src.Utils import box_association as ba
+from src.Utils import evaluation
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "Data")
+LABELS = {"panels": evaluation.CLASSICAL_LABELS["panels"], "bubbles": evaluation.CLASSICAL_LABELS["speech_bubbles"]}
+
+
+def detect(image, gray, working_size, refine):
+    panels = find_panels(image, gray=gray, working_size=working_size, refine=refine)
+    bubbles = find_speech_bubbles(image, gray=gray, working_size=working_size, refine=refine)
+    return {"panels": ba.boxes_to_array(panels), "bubbles": ba.boxes_to_array(bubbles)}
+
+
+def ground_truth_pages(annotations, images_dir, limit):
+    pages, _ = evaluation.load_ground_truth(annotations, images_dir, labels=LABELS.values(), limit=limit)
+    return [(page["path"], {kind: page["boxes"][label] for kind, label in LABELS.items()}) for page in pages]
+
+
+def reference_pages(images_dir, limit):
+    paths = sorted(glob.glob(os.path.join(images_dir, "*", "*.jpg")))[:limit or None]
+    pages = []
+    for path in paths:
+        image = cv2.imread(path)
+        pages.append((path, detect(image, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), None, False)))
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--annotations", default=os.path.join(DATA_DIR, "c100-val.xml"))
+    parser.add_argument("--images", default=os.path.join(DATA_DIR, "comics"))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 1024, 768, 512],
+                        help="longest side of the working image, 0 for full resolution")
+    parser.add_argument("--refine", action="store_true", help="also run every size with full resolution refinement")
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--pages", type=int, default=0, help="limit the number of pages, 0 for all")
+    args = parser.parse_args()
+
+    pages = ground_truth_pages(args.annotations, args.images, args.pages)
+    if pages:
+        print(f"{len(pages)} ground truth pages found under {args.images}")
+    else:
+        pages = reference_pages(args.images, args.pages)
+        print(f"no ground truth pages under {args.images}; comparing {len(pages)} local pages with full resolution")
+
+    images = [cv2.imread(path) for path, _ in pages]
+    grays = [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) for image in images]
+
+    print(f"{'size':>5} {'refine':>6} {'ms/page':>8} {'panel P':>8} {'panel R':>8} {'panel F1':>9} "
+          f"{'bubble P':>9} {'bubble R':>9} {'bubble F1':>10}")
+    for size in args.sizes:
+        for refine in ([False, True] if args.refine and size else [False]):
+            counts = {kind: np.zeros(3) for kind in LABELS}
+            seconds = []
+            for image, gray, (_, truth) in zip(images, grays, pages):
+                start = time.perf_counter()
+                predicted = detect(image, gray, size or None, refine)
+                seconds.append(time.perf_counter() - start)
+                for kind in LABELS:
+                    matched, _ = ba.match_boxes(predicted[kind], truth[kind], args.iou)
+                    counts[kind] += (len(matched), len(predicted[kind]), len(truth[kind]))
+
+            row = f"{size or 'full':>5} {str(refine):>6} {np.median(seconds) * 1000:>8.1f}"
+            for kind, widths in (("panels", (8, 8, 9)), ("bubbles", (9, 9, 10))):
+                scores = evaluation.precision_recall_f1(*counts[kind])
+                row += "".join(f" {value:>{width}.3f}" for value, width in zip(scores, widths))
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Accuracy and throughput of the detectors against the Comics100 validation ground truth.
+
+Every detector runs in its own interpreter over the pages of the CVAT export that exist under
+--images, so its peak RSS is its own. Pages that are not on disk are skipped and listed in the
+results. Detector specs:
+  cv               cv_panel.detect_boxes (panels, and speech bubbles scored as text), --params overrides its defaults
+  model[:name]     a ComicReader model from Models.registry (panel, text and character boxes)
+  module:factory   any factory returning an object with detect_objects_batch, e.g.
+                   benchmarks.bench_batched_inference:StubMagiModel
+
+For each label and IoU threshold the table shows F1; the results file also holds precision,
+recall and the raw counts, next to pages/sec, p50/p95 latency and peak RSS.
+
+    python -m benchmarks.bench_detectors --detectors cv model --iou 0.5 0.75 --output detectors.json
+"""
+import argparse
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from src.Utils import evaluation
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_detector(spec, params):
+    if spec == "cv":
+        return evaluation.classical_detector(params), None
+    if spec == "model" or spec.startswith("model:"):
+        from Models import registry
+
+        name = spec.partition(":")[2]
+        model = registry.get_model(name) if name else registry.get_model()
+    else:
+        module_name, _, attribute = spec.partition(":")
+        model = getattr(importlib.import_module(module_name), attribute)()
+    return evaluation.model_detector(model), model
+
+
+def run_detector(spec, args):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pages, missing = evaluation.load_ground_truth(args.annotations, args.images, limit=args.pages)
+    detector, model = make_detector(spec, json.loads(args.params))
+
+    start = time.perf_counter()
+    if model is not None and hasattr(model, "load"):
+        model.load()
+    load_seconds = time.perf_counter() - start
+
+    score = evaluation.DetectionScore(detector.labels, args.iou)
+    latencies = []
+    for offset in range(0, len(pages), args.batch_size):
+        batch = pages[offset:offset + args.batch_size]
+        images = [np.array(Image.open(page["path"]).convert("RGB")) for page in batch]
+        start = time.perf_counter()
+        results = detector(images)
+        elapsed = time.perf_counter() - start
+        latencies += [elapsed / len(batch)] * len(batch)
+        for page, predicted in zip(batch, results):
+            score.add(predicted, page["boxes"])
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "detector": spec,
+        "pages": len(pages),
+        "missing": missing,
+        "load_seconds": load_seconds,
+        "detect_seconds": sum(latencies),
+        "pages_per_sec": len(latencies) / sum(latencies) if sum(latencies) else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000) if latencies else None,
+        "p95_ms": float(np.percentile(latencies, 95) * 1000) if latencies else None,
+        "peak_rss_mb": peak / 1024,
+        "added_rss_mb": (peak - baseline) / 1024,
+        "scores": score.as_dict()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--annotations", default=os.path.join(ROOT, "Data", "c100-val.xml"))
+    parser.add_argument("--images", default=os.path.join(ROOT, "Data", "comics"),
+                        help="directory the CVAT image names are relative to")
+    parser.add_argument("--detectors", nargs="+", default=["cv"])
+    parser.add_argument("--params", default="{}", help="JSON object of cv_panel.DETECTION_PARAMS overrides")
+    parser.add_argument("--iou", type=float, nargs="+", default=list(evaluation.DEFAULT_IOU_THRESHOLDS))
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=0, help="limit the number of evaluated pages, 0 for all")
+    parser.add_argument("--output", default="detector_benchmark.json", help="machine readable results file")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_detector(args.run, args)))
+        return
+
+    forwarded = ["--annotations", args.annotations, "--images", args.images, "--params", args.params,
+                 "--batch-size", str(args.batch_size), "--pages", str(args.pages),
+                 "--iou", *(str(threshold) for threshold in args.iou)]
+    results = []
+    for spec in args.detectors:
+        output = subprocess.run([sys.executable, "-m", "benchmarks.bench_detectors", "--run", spec, *forwarded],
+                                cwd=ROOT, capture_output=True, text=True)
+        if output.returncode != 0:
+            print(f"{spec} failed:\n{output.stderr.strip()}")
+            results.append({"detector": spec, "error": output.stderr.strip().splitlines()[-1:]})
+            continue
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    for result in results:
+        if "error" in result:
+            continue
+        if result["missing"]:
+            print(f"{result['detector']}: {len(result['missing'])} ground truth pages missing under {args.images}, "
+                  f"skipped")
+        print(f"{result['detector']}: {result['pages']} pages, {result['pages_per_sec']:.2f} pages/s, "
+              f"p50 {result['p50_ms'] or 0:.1f} ms, p95 {result['p95_ms'] or 0:.1f} ms, "
+              f"load {result['load_seconds']:.2f} s, peak RSS {result['peak_rss_mb']:.1f} MiB")
+        for label, by_threshold in result["scores"].items():
+            if all(score["truth"] == 0 for score in by_threshold.values()):
+                print(f"  {label:<10} no ground truth")
+                continue
+            cells = ", ".join(f"F1@{threshold} {score['f1']:.3f} (P {score['precision']:.3f} R {score['recall']:.3f})"
+                              for threshold, score in by_threshold.items())
+            print(f"  {label:<10} {cells}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"annotations": args.annotations, "images": args.images, "iou": args.iou,
+                   "params": json.loads(args.params), "detectors": results}, f, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Import time of the main modules and first-inference latency of the shared Magi model.
+
+Every import is timed in a fresh interpreter, so module caches of earlier runs do not count.
+
+    python -m benchmarks.bench_model_startup
+    python -m benchmarks.bench_model_startup --skip-inference
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+MODULES = [
+    "src.Utils.io_utils",
+    "src.Classes.comic",
+    "Models.registry",
+    "src.Components.comic_reader",
+]
+
+IMPORT_SNIPPET = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import {module}\n"
+    "print(time.perf_counter() - start, 'torch' in sys.modules)\n"
+)
+
+
+def time_import(module, repeats):
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    samples = []
+    torch_loaded = False
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+                                cwd=root, capture_output=True, text=True, check=True).stdout.split()
+        samples.append(float(output[0]))
+        torch_loaded = output[1] == "True"
+    return min(samples), torch_loaded
+
+
+def time_first_inference(height, width):
+    from Models import registry
+
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    start = time.perf_counter()
+    model = registry.get_model()
+    created = time.perf_counter() - start
+
+    start = time.perf_counter()
+    registry.warm_up()
+    loaded = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.detect_objects_batch([image])
+    first = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.detect_objects_batch([image])
+    second = time.perf_counter() - start
+
+    shared = registry.get_model() is model
+    return created, loaded, first, second, shared
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--skip-inference", action="store_true")
+    parser.add_argument("--height", type=int, default=1800)
+    parser.add_argument("--width", type=int, default=1280)
+    args = parser.parse_args()
+
+    print(f"{'module':<30} {'import ms':>10} {'torch':>6}")
+    for module in MODULES:
+        seconds, torch_loaded = time_import(module, args.repeats)
+        print(f"{module:<30} {seconds * 1000:>10.1f} {str(torch_loaded):>6}")
+
+    if args.skip_inference:
+        return
+
+    created, loaded, first, second, shared = time_first_inference(args.height, args.width)
+    print()
+    print(f"registry.get_model():      {created * 1000:.1f} ms")
+    print(f"registry.warm_up():        {loaded:.2f} s")
+    print(f"first inference:           {first:.2f} s")
+    print(f"second inference:          {second:.2f} s")
+    print(f"instance shared:           {shared}")
+
+
+if __name__ == "__main__":
+    main()
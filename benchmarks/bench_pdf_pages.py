@@ -0,0 +1,120 @@
+"""Peak RSS of binding a large PDF to its annotation: eager rasterization against PdfPageSource.
+
+Creates a synthetic PDF and a matching annotation, then in separate interpreters either renders
+every page up front (the former add_image_data) or binds the pages lazily and walks every panel,
+speech bubble and entity crop once.
+
+    python -m benchmarks.bench_pdf_pages --pages 200 --cache-size 8
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def build_inputs(pages, pdf_path):
+    import fitz
+
+    from src.Classes.comic import Comic
+    from src.Classes.entity import Entity
+    from src.Classes.page import Page, PageType
+    from src.Classes.panel import Panel
+    from src.Classes.speech_bubble import SpeechBubble
+
+    document = fitz.open()
+    for i in range(pages):
+        page = document.new_page(width=1280, height=1800)
+        page.draw_rect(fitz.Rect(20, 20, 1260, 880), color=(0, 0, 0), fill=(i % 7 / 7, 0.5, 0.5))
+        page.insert_text((60, 1000), f"page {i}", fontsize=48)
+    document.save(pdf_path)
+
+    comic_pages = []
+    for i in range(pages):
+        panels = []
+        for row in range(2):
+            panel = Panel("", {'x': 20, 'y': 20 + row * 880, 'width': 1240, 'height': 860})
+            panel.speech_bubbles.append(SpeechBubble('dialogue', '', {'x': 60, 'y': 60 + row * 880,
+                                                                      'width': 200, 'height': 120}))
+            panel.entities.append(Entity({'x': 400, 'y': 200 + row * 880, 'width': 300, 'height': 500}))
+            panels.append(panel)
+        comic_pages.append(Page(page_index=i + 1, page_type=PageType.SINGLE, panels=panels))
+    return Comic.from_pages("benchmark", comic_pages)
+
+
+def run_mode(mode, pages, cache_size, pdf_path):
+    from src.Utils import io_utils
+    from src.Utils.image_utils import image_from_bbox
+
+    comic = build_inputs(pages, pdf_path)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+
+    if mode == "eager":
+        images = io_utils.convert_pdf_to_image(pdf_path)
+        counter = 0
+        for pair in comic.page_pairs:
+            for page in pair:
+                if page is None:
+                    continue
+                page.page_image = images[counter]
+                for panel in page.panels:
+                    panel.image = image_from_bbox(page.page_image, panel.bounding_box)
+                    for speech_bubble in panel.speech_bubbles:
+                        speech_bubble.image = image_from_bbox(page.page_image, speech_bubble.bounding_box)
+                    for entity in panel.entities:
+                        entity.image = image_from_bbox(page.page_image, entity.bounding_box)
+                counter += 1
+    else:
+        io_utils.add_image_data(comic, pdf_path, cache_size=cache_size)
+
+    opened = time.perf_counter() - start
+    checksum = 0
+    for pair in comic.page_pairs:
+        for page in pair:
+            if page is None:
+                continue
+            for panel in page.panels:
+                checksum += int(panel.image[0, 0, 0])
+                for speech_bubble in panel.speech_bubbles:
+                    checksum += int(speech_bubble.image[0, 0, 0])
+                for entity in panel.entities:
+                    checksum += int(entity.image[0, 0, 0])
+
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"mode": mode, "open_seconds": opened, "walk_seconds": elapsed, "checksum": checksum,
+            "added_rss_mb": (peak - baseline) / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--cache-size", type=int, default=8)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.pages, args.cache_size, args.pdf)))
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdf_path = os.path.join(temp_dir, "comic.pdf")
+        print(f"{'mode':<6} {'open s':>7} {'open+walk s':>12} {'added RSS MiB':>14} {'checksum':>9}")
+        for mode in ("eager", "lazy"):
+            output = subprocess.run([sys.executable, "-m", "benchmarks.bench_pdf_pages", "--mode", mode,
+                                     "--pages", str(args.pages), "--cache-size", str(args.cache_size),
+                                     "--pdf", pdf_path], cwd=ROOT, capture_output=True, text=True, check=True)
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            print(f"{mode:<6} {result['open_seconds']:>7.2f} {result['walk_seconds']:>12.2f} "
+                  f"{result['added_rss_mb']:>14.1f} {result['checksum']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Candidate lookup on long vertical strips: dense IoU matrices against the GridIndex.
+
+Every strip has a fixed number of boxes per panel, so the local density stays constant while the
+total panel count grows. The grid lookup should stay roughly flat per box; the dense matrix grows
+with the panel count.
+
+    python -m benchmarks.bench_spatial_index --panels 10 100 1000 5000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.Utils import box_association as ba
+from src.Utils.spatial_index import GridIndex
+
+
+def vertical_strip(panel_count, boxes_per_panel, rng, width=800, panel_height=1000, gutter=40):
+    tops = np.arange(panel_count) * (panel_height + gutter)
+    panels = np.stack([np.full(panel_count, 20.0), tops, np.full(panel_count, width - 20.0), tops + panel_height],
+                      axis=1)
+
+    count = panel_count * boxes_per_panel
+    x1 = rng.uniform(0, width - 200, count)
+    y1 = np.repeat(tops, boxes_per_panel) + rng.uniform(-100, panel_height - 100, count)
+    boxes = np.stack([x1, y1, x1 + rng.uniform(20, 200, count), y1 + rng.uniform(20, 200, count)], axis=1)
+    return panels, boxes
+
+
+def timed(function, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--boxes-per-panel", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'panels':>6} {'boxes':>7} {'build ms':>9} {'dense us/box':>13} {'grid us/box':>12} "
+          f"{'hit us':>7} {'equal':>6}")
+    for panel_count in args.panels:
+        panels, boxes = vertical_strip(panel_count, args.boxes_per_panel, rng)
+
+        build_time, index = timed(lambda: GridIndex(panels), args.repeats)
+        dense_time, dense = timed(lambda: ba.assign_to_best(ba.iou_matrix(boxes, panels)), args.repeats)
+
+        def grid_assign():
+            rows, cols = index.query_pairs(boxes)
+            return ba.assign_pairs_to_best(rows, cols, ba.pair_iou(boxes, panels, rows, cols), len(boxes))
+
+        grid_time, grid = timed(grid_assign, args.repeats)
+
+        points = rng.uniform(panels[:, :2].min(axis=0), panels[:, 2:].max(axis=0), (1000, 2))
+        hit_time, _ = timed(lambda: [index.query_point(x, y) for x, y in points], args.repeats)
+
+        print(f"{panel_count:>6} {len(boxes):>7} {build_time * 1000:>9.2f} {dense_time / len(boxes) * 1e6:>13.2f} "
+              f"{grid_time / len(boxes) * 1e6:>12.2f} {hit_time / len(points) * 1e6:>7.2f} "
+              f"{str(np.array_equal(dense, grid)):>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""XML export: Comic.to_xml + minidom prettify against the streaming writer in src.Utils.xml_stream.
+
+Builds a large comic by repeating the pages of the annotated comics in Data/comics and reports
+wall time and peak traced Python memory for each export path, plus whether parse_comic reads the
+streamed file back to the same annotation.
+
+    python -m benchmarks.bench_xml_export --scale 20
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as eT
+
+from src.Classes.comic import Comic
+from src.Utils import io_utils, xml_stream
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data", "comics")
+
+
+def large_comic(scale):
+    page_pairs = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, "*.xml"))):
+        with open(path, encoding="utf-8") as f:
+            page_pairs += io_utils.parse_comic(f.read()).page_pairs
+    return Comic("benchmark", page_pairs * scale)
+
+
+def legacy_pretty(comic, path):
+    io_utils.save_xml_to_file(path, io_utils.prettify_xml(comic.to_xml()))
+
+
+def legacy_compact(comic, path):
+    xml_str = eT.tostring(comic.to_xml(), encoding='utf-8').decode('utf-8')
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(xml_str)
+
+
+def streaming_pretty(comic, path):
+    xml_stream.save_comic(comic, path, indent="  ", xml_declaration=True)
+
+
+def streaming_compact(comic, path):
+    xml_stream.save_comic(comic, path)
+
+
+def measure(export, comic, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    export(comic, path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=10, help="how often the corpus pages are repeated")
+    args = parser.parse_args()
+
+    comic = large_comic(args.scale)
+    pages = sum(page is not None for pair in comic.page_pairs for page in pair)
+    print(f"{pages} pages")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "comic.xml")
+        print(f"{'path':<20} {'seconds':>8} {'peak MiB':>9} {'file MiB':>9}")
+        for name, export in (("minidom pretty", legacy_pretty), ("stream pretty", streaming_pretty),
+                             ("to_xml compact", legacy_compact), ("stream compact", streaming_compact)):
+            elapsed, peak, size = measure(export, comic, path)
+            print(f"{name:<20} {elapsed:>8.2f} {peak / 2 ** 20:>9.1f} {size / 2 ** 20:>9.1f}")
+
+        streaming_compact(comic, path)
+        with open(path, encoding="utf-8") as f:
+            reparsed = io_utils.parse_comic(f.read())
+        same = eT.tostring(reparsed.to_xml()) == eT.tostring(comic.to_xml())
+        print(f"parse_comic round trip identical: {same}")
+
+
+if __name__ == "__main__":
+    main()
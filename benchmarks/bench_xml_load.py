@@ -0,0 +1,95 @@
+"""Load time and peak RSS of the annotation readers.
+
+Each mode runs in its own interpreter so the peak RSS belongs to that loader alone:
+  fromstring  the previous parse_comic (eT.fromstring + find() per field)
+  iterparse   xml_stream.load_comic
+  lazy        xml_stream.load_comic(lazy=True), then one page is touched
+  cvat        xml_stream.load_cvat on Data/c100-val.xml
+
+The annotation modes read a synthetic file built by repeating the pages of Data/comics.
+
+    python -m benchmarks.bench_xml_load --scale 20
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as eT
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CVAT_PATH = os.path.join(ROOT, "Data", "c100-val.xml")
+
+
+def run_mode(mode, path):
+    from src.Classes.comic import Comic
+    from src.Utils import io_utils, xml_stream
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+
+    if mode == "fromstring":
+        with open(path, encoding="utf-8") as f:
+            root = eT.fromstring(f.read())
+        comic = Comic(root.find('Name').text, [io_utils.parse_page_pair(pp) for pp in root.find('PagePairs')])
+        pages = sum(page is not None for pair in comic.page_pairs for page in pair)
+    elif mode == "iterparse":
+        comic = xml_stream.load_comic(path)
+        pages = sum(page is not None for pair in comic.page_pairs for page in pair)
+    elif mode == "lazy":
+        comic = xml_stream.load_comic(path, lazy=True)
+        comic.page_pairs[len(comic.page_pairs) // 2]
+        pages = comic.page_pairs.loaded_count()
+    else:
+        comics = xml_stream.load_cvat(path)
+        pages = sum(page is not None for comic in comics for pair in comic.page_pairs for page in pair)
+
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"mode": mode, "seconds": elapsed, "pages": pages, "peak_rss_mb": peak / 1024,
+            "added_rss_mb": (peak - baseline) / 1024}
+
+
+def build_annotation_file(scale, path):
+    from src.Classes.comic import Comic
+    from src.Utils import xml_stream
+
+    page_pairs = []
+    comic_dir = os.path.join(ROOT, "Data", "comics")
+    for file_name in sorted(os.listdir(comic_dir)):
+        if file_name.endswith(".xml"):
+            page_pairs += xml_stream.load_comic(os.path.join(comic_dir, file_name)).page_pairs
+    xml_stream.save_comic(Comic("benchmark", page_pairs * scale), path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=20, help="how often the corpus pages are repeated")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.path)))
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "annotation.xml")
+        build_annotation_file(args.scale, path)
+        print(f"annotation file: {os.path.getsize(path) / 2 ** 20:.1f} MiB, "
+              f"CVAT file: {os.path.getsize(CVAT_PATH) / 2 ** 20:.1f} MiB")
+
+        print(f"{'mode':<11} {'pages':>6} {'seconds':>8} {'peak RSS MiB':>13} {'added MiB':>10}")
+        for mode, source in (("fromstring", path), ("iterparse", path), ("lazy", path), ("cvat", CVAT_PATH)):
+            output = subprocess.run([sys.executable, "-m", "benchmarks.bench_xml_load", "--mode", mode,
+                                     "--path", source], cwd=ROOT, capture_output=True, text=True, check=True)
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            print(f"{mode:<11} {result['pages']:>6} {result['seconds']:>8.2f} {result['peak_rss_mb']:>13.1f} "
+                  f"{result['added_rss_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
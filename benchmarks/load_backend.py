@@ -0,0 +1,126 @@
+"""Load test: /comics latency while /api/process is saturated.
+
+Starts the backend with uvicorn (or uses --url), measures /comics latency idle, then keeps
+--clients concurrent /api/process requests in flight with uncached parameters and measures
+/comics again. Status counts show how many detection requests were shed with 503 or timed out.
+
+    python -m benchmarks.load_backend --clients 32 --seconds 15
+"""
+import argparse
+import itertools
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def request(url, data=None, timeout=60):
+    body = urllib.parse.urlencode(data).encode() if data is not None else None
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, data=body, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = "error"
+    return status, time.perf_counter() - start
+
+
+def probe_comics(url, seconds, interval=0.1):
+    latencies = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        _, elapsed = request(f"{url}/comics")
+        latencies.append(elapsed)
+        time.sleep(interval)
+    return latencies
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def wait_until_up(url, timeout=30):
+    end = time.perf_counter() + timeout
+    while time.perf_counter() < end:
+        status, _ = request(f"{url}/comics", timeout=2)
+        if status == 200:
+            return
+        time.sleep(0.3)
+    raise RuntimeError(f"backend at {url} did not come up")
+
+
+def saturate(url, comic, page, clients, seconds):
+    statuses = Counter()
+    lock = threading.Lock()
+    thresholds = itertools.count(1)
+    stop = time.perf_counter() + seconds
+
+    def client():
+        while time.perf_counter() < stop:
+            with lock:
+                threshold = 50 + next(thresholds) % 200
+            status, _ = request(f"{url}/api/process", {"comic": comic, "page": page, "threshold": threshold,
+                                                       "blur": 5 + 2 * (threshold % 3)})
+            with lock:
+                statuses[status] += 1
+            if status == 503:
+                time.sleep(0.25)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    return threads, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="use a running backend instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--comic", default="2b24d495")
+    parser.add_argument("--page", default="001.jpg")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=15)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        url = f"http://127.0.0.1:{args.port}"
+        server = subprocess.Popen([sys.executable, "-m", "uvicorn", "src.Components.backend:app", "--port",
+                                   str(args.port), "--log-level", "warning"], cwd=ROOT)
+    try:
+        wait_until_up(url)
+        idle = probe_comics(url, 3)
+
+        threads, statuses = saturate(url, args.comic, args.page, args.clients, args.seconds)
+        time.sleep(1)
+        loaded = probe_comics(url, args.seconds - 1)
+        for thread in threads:
+            thread.join()
+
+        print(f"{'/comics':<10} {'samples':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+        for name, latencies in (("idle", idle), ("saturated", loaded)):
+            print(f"{name:<10} {len(latencies):>8} {statistics.median(latencies) * 1000:>8.1f} "
+                  f"{percentile(latencies, 0.95) * 1000:>8.1f} {max(latencies) * 1000:>8.1f}")
+        print(f"/api/process statuses: {dict(statuses)}")
+        print(f"/api/process completed per second: {statuses[200] / args.seconds:.1f}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
+import os
+
 from .page import Page
+from ..Utils import image_utils as iU
 from typing import Optional, List
 import xml.etree.ElementTree as eT
-import numpy as np
-import cv2
 
 
 class Comic:
@@ -12,6 +13,20 @@ class Comic:
         self.scenes = []
         self.scene_data = ''
 
+    @classmethod
+    def from_pages(cls, name: str, pages: List[Page]):
+        """Pairs pages the way the reader does: the first page stands alone on the right, the rest go in pairs."""
+        page_pairs = [(None, pages[0])] if pages else []
+        rest = pages[1:]
+
+        for i in range(0, len(rest), 2):
+            if i + 1 < len(rest):
+                page_pairs.append((rest[i], rest[i + 1]))
+            else:
+                page_pairs.append((rest[i], None))
+
+        return cls(name=name, page_pairs=page_pairs)
+
     def to_narrative(self) -> str:
         script = ''
         white_spaces = '     '
@@ -51,37 +66,45 @@ class Comic:
             for panel in scene:
                 panel.entities.clear()
 
-    def get_scene_images(self):
+    def iter_scene_images(self, output_dir: Optional[str] = None, max_height: Optional[int] = None,
+                          mode: str = 'pad'):
+        """Yields (scene_image, pages) per scene, the scene's pages composed side by side in BGR.
+
+        Pages of different sizes are padded or rescaled (see image_utils.compose_horizontal) and
+        max_height produces downscaled previews. With output_dir every image is also written there
+        as scene_<idx>.png.
+        """
         comic_pages = []
-        scene_images = []
+        seen = set()
         for page_pair in self.page_pairs:
             for page in page_pair:
-                if page is not None and page not in comic_pages:
+                if page is not None and id(page) not in seen:
+                    seen.add(id(page))
                     comic_pages.append(page)
 
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
         for idx, scene in enumerate(self.scenes):
-            scene_pages = []
             used_pages = []
-
+            used = set()
             for panel in scene:
-                if comic_pages[panel.page_id]not in used_pages:
-                    page_image = comic_pages[panel.page_id].page_image
-
-                    if page_image.shape[2] == 3:
-                        page_image = cv2.cvtColor(page_image, cv2.COLOR_RGB2BGR)
-
-                    page_image = page_image.astype(np.uint8)
+                page = comic_pages[panel.page_id]
+                if id(page) not in used:
+                    used.add(id(page))
+                    used_pages.append(page)
 
-                    scene_pages.append(page_image)
-                    used_pages.append(comic_pages[panel.page_id])
+            if not used_pages:
+                continue
 
-            if scene_pages:
-                try:
-                    scene_image = np.hstack(scene_pages)
-                    scene_images.append((scene_image,used_pages))
-                    cv2.imwrite(f'scene_{idx}.png', scene_image)
-                except ValueError as e:
-                    print(f"Error stacking images for scene {idx}: {e}")
-        return scene_images
+            scene_image = iU.compose_horizontal([page.page_image for page in used_pages], max_height=max_height,
+                                                mode=mode, rgb_to_bgr=True)
+            if output_dir is not None:
+                import cv2
 
+                cv2.imwrite(os.path.join(output_dir, f'scene_{idx}.png'), scene_image)
+            yield scene_image, used_pages
 
+    def get_scene_images(self, output_dir: Optional[str] = None, max_height: Optional[int] = None,
+                         mode: str = 'pad'):
+        return list(self.iter_scene_images(output_dir, max_height, mode))
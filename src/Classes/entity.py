@@ -1,12 +1,17 @@
 from typing import Tuple
 import xml.etree.ElementTree as eT
 
+from ..Utils.image_utils import LazyImage
+
 
 class Entity:
 
+    image = LazyImage()
+
     def __init__(self, bounding_box: Tuple[float, float, float, float]):
         self.bounding_box = bounding_box
         self.image = None
+        self.image_loader = None
         self.named_entity_id = 0
         self.tags = []
         self.active_tag = True
@@ -22,6 +22,7 @@ class Page:
     bbox_color_entity = (0, 0, 255)
     bbox_color_deactivated_entity = (255, 0, 255)
     bbox_thickness_entity = 4
+    page_image = iU.LazyImage()
 
     # TODO: refactor height and width ou
     def __init__(self, page_index: int, page_type: PageType,
@@ -32,8 +33,31 @@ class Page:
         self.page_type = page_type
         self.panels = panels if panels else []
         self.page_image = page_image
+        self.page_image_loader = None
         self.height = height
         self.width = width
+        self._panel_index = None
+        self._panel_index_key = None
+
+    def get_panel_index(self):
+        """Grid index over the panel bounding boxes, rebuilt only when the panels have changed."""
+        from ..Utils.spatial_index import GridIndex
+        from ..Utils.box_association import boxes_to_array
+
+        key = tuple((id(panel), tuple(panel.bounding_box.values())) for panel in self.panels)
+        if self._panel_index is None or key != self._panel_index_key:
+            self._panel_index = GridIndex(boxes_to_array([panel.bounding_box for panel in self.panels]))
+            self._panel_index_key = key
+        return self._panel_index
+
+    def panel_at(self, x: float, y: float) -> Optional[Panel]:
+        """Returns the smallest panel containing the point, or None."""
+        hits = self.get_panel_index().query_point(x, y)
+        if len(hits) == 0:
+            return None
+        boxes = self._panel_index.boxes[hits]
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        return self.panels[hits[areas.argmin()]]
 
     def annotated_image(self, draw_panels: bool, draw_speech_bubbles: bool, draw_entities: bool,
                         draw_deactivated_entities: bool):
@@ -0,0 +1,461 @@
+"""Columnar storage for the annotations of one page, with slotted views that keep the object API.
+
+A PageStore keeps the panels, speech bubbles and entities of a page as NumPy columns instead of
+one __dict__ object and one bounding box dict per box. PanelView, SpeechBubbleView and EntityView
+are two-slot handles onto a row that read and write those columns, so code written against Panel,
+SpeechBubble and Entity (panel.bounding_box['x'], panel.speech_bubbles, to_xml, to_narrative,
+annotated_image) works unchanged on a CompactPage.
+"""
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from .entity import Entity
+from .page import Page
+from .panel import Panel
+from .speech_bubble import SpeechBubble
+from ..Utils.box_association import boxes_to_array
+
+BOX_KEYS = ('x', 'y', 'width', 'height')
+PAGE = 0
+DETACHED = -1
+
+# Numeric columns per kind with their dtype and default. Categorical columns hold an index into
+# the table's list of distinct values, -1 for None.
+COLUMNS = {
+    'panels': {'scene_id': (np.int32, 0), 'starting_tag': (np.bool_, False), 'page_id': (np.int32, 0)},
+    'speech_bubbles': {'speaker_id': (np.int32, 0)},
+    'entities': {'named_entity_id': (np.int32, 0), 'active_tag': (np.bool_, True)},
+}
+CATEGORY_COLUMNS = {'panels': (), 'speech_bubbles': ('type',), 'entities': ()}
+OBJECT_COLUMNS = {'panels': ('description',), 'speech_bubbles': ('text',), 'entities': ()}
+# Attributes that are empty for almost every box live in a dict keyed by (name, row).
+LIST_ATTRIBUTES = {'panels': ('descriptions',), 'speech_bubbles': ('speaker',), 'entities': ('tags',)}
+NONE_ATTRIBUTES = ('image', 'image_loader', 'trail')
+CHILDREN = {
+    'panels': {'speech_bubbles': 'speech_bubbles', 'entities': 'entities'},
+    'speech_bubbles': {},
+    'entities': {},
+}
+
+
+def _grow(array, capacity, fill):
+    grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def is_plain_box(bbox):
+    """True for a dict with exactly the float keys x, y, width, height, in that order.
+
+    Anything else (ints, extra keys such as confidence, another order) is kept as given so
+    to_xml writes the same text as before.
+    """
+    return (type(bbox) is dict and tuple(bbox) == BOX_KEYS
+            and all(isinstance(value, float) for value in bbox.values()))
+
+
+def _to_column(value, dtype):
+    """value as a scalar of dtype if it converts without changing its str(), else None."""
+    if dtype == np.bool_:
+        return value if isinstance(value, (bool, np.bool_)) else None
+    if isinstance(value, (bool, np.bool_)):
+        return None
+    if isinstance(value, (int, np.integer)):
+        return value if np.iinfo(dtype).min <= value <= np.iinfo(dtype).max else None
+    if isinstance(value, str):
+        try:
+            number = int(value)
+        except ValueError:
+            return None
+        return _to_column(number, dtype) if str(number) == value else None
+    return None
+
+
+class _Table:
+    """Rows of one kind of annotation. Columns are allocated with spare capacity and grow by doubling."""
+
+    __slots__ = ('kind', 'size', 'boxes', 'parent', 'order', 'columns', 'categories', 'objects', 'sparse')
+
+    def __init__(self, kind, capacity=0):
+        self.kind = kind
+        self.size = 0
+        self.boxes = np.zeros((capacity, 4), dtype=np.float64)
+        self.parent = np.full(capacity, DETACHED, dtype=np.int32)
+        self.order = np.zeros(capacity, dtype=np.int32)
+        self.columns = {name: np.full(capacity, default, dtype=dtype) for name, (dtype, default) in COLUMNS[kind].items()}
+        self.columns.update({name: np.full(capacity, -1, dtype=np.int16) for name in CATEGORY_COLUMNS[kind]})
+        self.categories = {name: [] for name in CATEGORY_COLUMNS[kind]}
+        self.objects = {name: [] for name in OBJECT_COLUMNS[kind]}
+        self.sparse = {}
+
+    def append(self):
+        if self.size == len(self.parent):
+            capacity = max(4, 2 * self.size)
+            self.boxes = _grow(self.boxes, capacity, 0.0)
+            self.parent = _grow(self.parent, capacity, DETACHED)
+            self.order = _grow(self.order, capacity, 0)
+            for name, column in self.columns.items():
+                default = COLUMNS[self.kind][name][1] if name in COLUMNS[self.kind] else -1
+                self.columns[name] = _grow(column, capacity, default)
+        for values in self.objects.values():
+            values.append(None)
+        self.size += 1
+        return self.size - 1
+
+    def nbytes(self):
+        return (self.boxes.nbytes + self.parent.nbytes + self.order.nbytes
+                + sum(column.nbytes for column in self.columns.values()))
+
+
+class BoxView(MutableMapping):
+    """The {'x', 'y', 'width', 'height'} dict of a row, backed by the table's box array.
+
+    Setting another key or a non-float value turns the row's box into a plain dict again.
+    """
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, key):
+        return float(self._table.boxes[self._row, BOX_KEYS.index(key)]) if key in BOX_KEYS else {}[key]
+
+    def __setitem__(self, key, value):
+        if key in BOX_KEYS and isinstance(value, float):
+            self._table.boxes[self._row, BOX_KEYS.index(key)] = value
+        else:
+            self._table.sparse[('bounding_box', self._row)] = {**self, key: value}
+
+    def __delitem__(self, key):
+        bbox = dict(self)
+        del bbox[key]
+        self._table.sparse[('bounding_box', self._row)] = bbox
+
+    def __iter__(self):
+        return iter(BOX_KEYS)
+
+    def __len__(self):
+        return len(BOX_KEYS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class _WriteBackList(list):
+    """List handed out for a stored list attribute; every in-place change is passed to commit."""
+
+    __slots__ = ('_commit',)
+
+    def __init__(self, items, commit):
+        super().__init__(items)
+        self._commit = commit
+
+
+def _write_back(name):
+    method = getattr(list, name)
+
+    def write_back(self, *args):
+        result = method(self, *args)
+        self._commit(self)
+        return result
+
+    write_back.__name__ = name
+    return write_back
+
+
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse',
+              '__setitem__', '__delitem__', '__iadd__', '__imul__'):
+    setattr(_WriteBackList, _name, _write_back(_name))
+
+
+
+class _RowView:
+    """Handle onto one row of a PageStore; attribute access reads and writes the store."""
+
+    __slots__ = ('_store', '_row')
+    kind = None
+
+    def __init__(self, store, row):
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, '_row', row)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._store.get(self.kind, name, self._row)
+
+    def __setattr__(self, name, value):
+        self._store.set(self.kind, name, self._row, value)
+
+    def __reduce__(self):
+        # Rebuilt through __init__: the default protocol would fill the slots via __setattr__.
+        return type(self), (self._store, self._row)
+
+    def __eq__(self, other):
+        return (isinstance(other, _RowView) and self._store is other._store
+                and self.kind == other.kind and self._row == other._row)
+
+    def __hash__(self):
+        return hash((id(self._store), self.kind, self._row))
+
+    def __repr__(self):
+        return f"<{type(self).__name__} row {self._row} {dict(self.bounding_box)}>"
+
+
+class PanelView(_RowView):
+    __slots__ = ()
+    kind = 'panels'
+    get_transcript = Panel.get_transcript
+    to_xml = Panel.to_xml
+
+
+class SpeechBubbleView(_RowView):
+    __slots__ = ()
+    kind = 'speech_bubbles'
+    get_string = SpeechBubble.get_string
+    to_xml = SpeechBubble.to_xml
+
+
+class EntityView(_RowView):
+    __slots__ = ()
+    kind = 'entities'
+    to_xml = Entity.to_xml
+
+
+VIEWS = {'panels': PanelView, 'speech_bubbles': SpeechBubbleView, 'entities': EntityView}
+
+
+class PageStore:
+    """Panels, speech bubbles and entities of one page as parallel NumPy columns.
+
+    Each kind has an (N, 4) float64 array of x, y, width, height boxes, a parent column (the panel
+    row of a speech bubble or entity, PAGE for the panels, DETACHED once removed from its list) and
+    an order column for the position among its siblings. Scene, speaker and entity ids, tags and
+    flags are numeric columns, bubble types are categorical, and texts and descriptions are one
+    Python list per kind. Removed rows are only detached, not reclaimed.
+    """
+
+    __slots__ = ('tables', 'version')
+
+    def __init__(self, capacities=None):
+        capacities = capacities or {}
+        self.tables = {kind: _Table(kind, capacities.get(kind, 0)) for kind in VIEWS}
+        self.version = 0
+
+    @classmethod
+    def from_panels(cls, panels):
+        """Copies panels (Panel objects or views of another store) and their bubbles and entities."""
+        store = cls({
+            'panels': len(panels),
+            'speech_bubbles': sum(len(panel.speech_bubbles) for panel in panels),
+            'entities': sum(len(panel.entities) for panel in panels)
+        })
+        store.set_children('panels', PAGE, panels)
+        return store
+
+    def view(self, kind, row):
+        return VIEWS[kind](self, row)
+
+    def children(self, kind, parent):
+        """Rows of kind under parent, in list order."""
+        table = self.tables[kind]
+        rows = np.flatnonzero(table.parent[:table.size] == parent)
+        return rows[np.argsort(table.order[rows], kind='stable')]
+
+    def set_children(self, kind, parent, items):
+        """Makes items the list of kind under parent; objects that are not rows of this store are copied in."""
+        rows = [self.add(kind, item) for item in items]
+        table = self.tables[kind]
+        parents = table.parent[:table.size]
+        parents[parents == parent] = DETACHED
+        table.parent[rows] = parent
+        table.order[rows] = np.arange(len(rows))
+        self.version += 1
+
+    def xyxy(self, kind, rows):
+        """(len(rows), 4) x1, y1, x2, y2 array of the boxes of rows, as box_association uses them."""
+        table = self.tables[kind]
+        boxes = table.boxes[rows].copy()
+        boxes[:, 2:] += boxes[:, :2]
+        for i, row in enumerate(rows):
+            bbox = table.sparse.get(('bounding_box', row))
+            if bbox is not None:
+                boxes[i] = boxes_to_array([bbox])[0]
+        return boxes
+
+    def nbytes(self):
+        """Bytes held by the NumPy columns."""
+        return sum(table.nbytes() for table in self.tables.values())
+
+    def add(self, kind, item):
+        """Row of item in this store, appending a copy of it (and its children) if it is not one."""
+        if isinstance(item, _RowView) and item._store is self and item.kind == kind:
+            return item._row
+        row = self.tables[kind].append()
+        for name, value in self._attributes(kind, item):
+            self.set(kind, name, row, value)
+        return row
+
+    def _attributes(self, kind, item):
+        if isinstance(item, _RowView):
+            store, row = item._store, item._row
+            table = store.tables[kind]
+            names = ('bounding_box', *table.columns, *table.objects, *CHILDREN[kind],
+                     *{name for name, sparse_row in table.sparse if sparse_row == row})
+            attributes = []
+            for name in names:
+                value = store.get(kind, name, row, lazy=False)
+                attributes.append((name, list(value) if name in LIST_ATTRIBUTES[kind] else value))
+            return attributes
+
+        attributes = []
+        for name, value in vars(item).items():
+            if name == '_image':
+                name = 'image'
+            if (name in NONE_ATTRIBUTES and value is None) or (name in LIST_ATTRIBUTES[kind] and not value):
+                continue
+            attributes.append((name, value))
+        return attributes
+
+    def get(self, kind, name, row, lazy=True):
+        table = self.tables[kind]
+        if name in CHILDREN[kind]:
+            child_kind = CHILDREN[kind][name]
+            views = [self.view(child_kind, child) for child in self.children(child_kind, row).tolist()]
+            return _WriteBackList(views, lambda items: self.set_children(child_kind, row, items))
+
+        key = (name, row)
+        if name in LIST_ATTRIBUTES[kind]:
+            # sparse keeps a plain list (picklable); the handed-out copy writes changes back through set.
+            return _WriteBackList(table.sparse.get(key, ()), lambda items: self.set(kind, name, row, list(items)))
+        if name == 'image':
+            image = table.sparse.get(key)
+            loader = table.sparse.get(('image_loader', row))
+            return loader() if lazy and image is None and loader is not None else image
+        if key in table.sparse:
+            return table.sparse[key]
+        if name == 'bounding_box':
+            return BoxView(table, row)
+        if name in table.categories:
+            code = table.columns[name][row]
+            return table.categories[name][code] if code >= 0 else None
+        if name in table.columns:
+            return table.columns[name][row].item()
+        if name in table.objects:
+            return table.objects[name][row]
+        if name in NONE_ATTRIBUTES:
+            return None
+        raise AttributeError(f"{VIEWS[kind].__name__} has no attribute {name!r}")
+
+    def set(self, kind, name, row, value):
+        table = self.tables[kind]
+        key = (name, row)
+        self.version += 1
+        if name in CHILDREN[kind]:
+            self.set_children(CHILDREN[kind][name], row, value)
+            return
+        table.sparse.pop(key, None)
+        if isinstance(value, _WriteBackList):
+            value = list(value)
+
+        if name == 'bounding_box':
+            if isinstance(value, BoxView):
+                value = dict(value)
+            if is_plain_box(value):
+                table.boxes[row] = [value[box_key] for box_key in BOX_KEYS]
+            else:
+                table.sparse[key] = value
+        elif name in table.categories:
+            categories = table.categories[name]
+            if value is not None and value not in categories:
+                categories.append(value)
+            table.columns[name][row] = categories.index(value) if value is not None else -1
+        elif name in table.columns:
+            column = table.columns[name]
+            number = _to_column(value, column.dtype)
+            if number is None:
+                table.sparse[key] = value
+            else:
+                column[row] = number
+        elif name in table.objects:
+            table.objects[name][row] = value
+        elif value is not None or name not in NONE_ATTRIBUTES:
+            table.sparse[key] = value
+
+
+class CompactPage(Page):
+    """Page whose panels, speech bubbles and entities live in a PageStore.
+
+    panels and every nested list are views built on access; assigning or mutating them updates
+    the store. The panel grid index is built straight from the box column.
+    """
+
+    def __init__(self, page_index, page_type, panels=None, page_image=None, height=None, width=None,
+                 store=None):
+        self.store = PageStore() if store is None else store
+        # Page.__init__ assigns panels, so hand it the store's own panels when none are given.
+        super().__init__(page_index, page_type, panels or self.panels, page_image, height, width)
+
+    @classmethod
+    def from_page(cls, page):
+        """Copies a Page into the columnar layout; images and image loaders are carried over."""
+        compact = cls(page.page_index, page.page_type, height=page.height, width=page.width,
+                      store=PageStore.from_panels(page.panels))
+        compact.page_image = getattr(page, '_page_image', None)
+        compact.page_image_loader = page.page_image_loader
+        return compact
+
+    def to_page(self):
+        """Copies the page back into Panel, SpeechBubble and Entity objects."""
+        page = Page(self.page_index, self.page_type, [_to_object(panel) for panel in self.panels],
+                    height=self.height, width=self.width)
+        page.page_image = getattr(self, '_page_image', None)
+        page.page_image_loader = self.page_image_loader
+        return page
+
+    @property
+    def panels(self):
+        views = [PanelView(self.store, row) for row in self.store.children('panels', PAGE).tolist()]
+        return _WriteBackList(views, lambda items: self.store.set_children('panels', PAGE, items))
+
+    @panels.setter
+    def panels(self, panels):
+        self.store.set_children('panels', PAGE, panels)
+
+    def get_panel_index(self):
+        from ..Utils.spatial_index import GridIndex
+
+        if self._panel_index is None or self._panel_index_key != self.store.version:
+            rows = self.store.children('panels', PAGE)
+            self._panel_index = GridIndex(self.store.xyxy('panels', rows))
+            self._panel_index_key = self.store.version
+        return self._panel_index
+
+    def panel_at(self, x, y):
+        hits = self.get_panel_index().query_point(x, y)
+        if len(hits) == 0:
+            return None
+        boxes = self._panel_index.boxes[hits]
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        return PanelView(self.store, int(self.store.children('panels', PAGE)[hits[areas.argmin()]]))
+
+
+def _to_object(view):
+    store, kind = view._store, view.kind
+    if kind == 'panels':
+        item = Panel(view.description, dict(view.bounding_box))
+    elif kind == 'speech_bubbles':
+        item = SpeechBubble(view.type, view.text, dict(view.bounding_box))
+    else:
+        item = Entity(dict(view.bounding_box))
+
+    for name, value in store._attributes(kind, view):
+        if name in CHILDREN[kind]:
+            value = [_to_object(child) for child in value]
+        elif isinstance(value, BoxView):
+            value = dict(value)
+        setattr(item, name, value)
+    return item
@@ -1,14 +1,18 @@
 from typing import List
 from .entity import Entity
 from .speech_bubble import SpeechBubble
+from ..Utils.image_utils import LazyImage
 import xml.etree.ElementTree as ET
 
 
 class Panel:
+    image = LazyImage()
+
     def __init__(self, description: str, bounding_box, image=None, speech_bubbles=None):
         self.description = description
         self.bounding_box = bounding_box
         self.image = image
+        self.image_loader = None
         self.starting_tag = False
         self.scene_id = 0
         self.entities: List[Entity] = []
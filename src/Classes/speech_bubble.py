@@ -3,6 +3,7 @@ from typing import List
 from .entity import Entity
 import xml.etree.ElementTree as ET
 from src.Utils import io_utils
+from src.Utils.image_utils import LazyImage
 
 
 class SpeechBubbleType(Enum):
@@ -15,11 +16,14 @@ class SpeechBubbleType(Enum):
 
 class SpeechBubble:
 
+    image = LazyImage()
+
     def __init__(self, type: str, text: str, bounding_box, image=None):
         self.type: str = type
         self.text = text
         self.bounding_box = bounding_box
         self.image = image
+        self.image_loader = None
         self.speaker_id = 0
         self.speaker: List[Entity] = []
         self.trail = None
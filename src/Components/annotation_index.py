@@ -0,0 +1,286 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from src.Utils import xml_stream
+from src.Utils.io_utils import file_digest
+
+DEFAULT_INDEX_PATH = os.environ.get("ANNOTATION_INDEX", os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Data", "annotation_index.sqlite")))
+DEFAULT_REFRESH_INTERVAL = float(os.environ.get("ANNOTATION_INDEX_REFRESH_INTERVAL", 30))
+DEFAULT_LIMIT = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comics (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    comic_id INTEGER NOT NULL REFERENCES comics(id) ON DELETE CASCADE,
+    pair INTEGER NOT NULL,
+    side TEXT NOT NULL,
+    page_index INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    panels INTEGER NOT NULL,
+    bubbles INTEGER NOT NULL,
+    entities INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS panels (
+    id INTEGER PRIMARY KEY,
+    page_id INTEGER NOT NULL REFERENCES pages(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    scene_id INTEGER NOT NULL,
+    starting_tag INTEGER NOT NULL,
+    description TEXT,
+    x REAL, y REAL, width REAL, height REAL
+);
+CREATE TABLE IF NOT EXISTS bubbles (
+    id INTEGER PRIMARY KEY,
+    panel_id INTEGER NOT NULL REFERENCES panels(id) ON DELETE CASCADE,
+    page_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT,
+    text TEXT,
+    speaker_id TEXT,
+    x REAL, y REAL, width REAL, height REAL
+);
+CREATE TABLE IF NOT EXISTS entities (
+    id INTEGER PRIMARY KEY,
+    panel_id INTEGER NOT NULL REFERENCES panels(id) ON DELETE CASCADE,
+    page_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    named_entity_id INTEGER NOT NULL,
+    active_tag INTEGER NOT NULL,
+    x REAL, y REAL, width REAL, height REAL
+);
+CREATE TABLE IF NOT EXISTS tags (
+    entity_id INTEGER NOT NULL REFERENCES entities(id) ON DELETE CASCADE,
+    label TEXT,
+    value REAL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS bubble_text USING fts5(text);
+CREATE INDEX IF NOT EXISTS pages_comic ON pages(comic_id);
+CREATE INDEX IF NOT EXISTS panels_page ON panels(page_id);
+CREATE INDEX IF NOT EXISTS bubbles_panel ON bubbles(panel_id);
+CREATE INDEX IF NOT EXISTS bubbles_page ON bubbles(page_id);
+CREATE INDEX IF NOT EXISTS entities_panel ON entities(panel_id);
+CREATE INDEX IF NOT EXISTS tags_entity ON tags(entity_id);
+"""
+
+
+def fts_query(text):
+    """Turns free text into an FTS5 query matching every word, so quotes and operators are taken literally."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+def _content_version(connection):
+    rows = connection.execute("SELECT name, sha256 FROM comics ORDER BY name").fetchall()
+    return hashlib.sha256(repr([tuple(row) for row in rows]).encode("utf-8")).hexdigest()[:16]
+
+
+def _box(bbox):
+    return bbox.get("x"), bbox.get("y"), bbox.get("width"), bbox.get("height")
+
+
+class AnnotationIndex:
+    """SQLite index over the annotation XMLs in data_dir, for corpus queries without parsing the files.
+
+    Comics, pages, panels, speech bubbles, entities and tags each get a table, and the bubble
+    texts an FTS5 table. update() re-indexes only the XMLs whose mtime or size changed and whose
+    content hash differs, and drops comics whose XML is gone; start() runs it periodically on a
+    daemon thread. version is a digest of the indexed files, so it changes whenever the indexed
+    content does and survives restarts.
+    """
+
+    def __init__(self, data_dir: str, path: str = DEFAULT_INDEX_PATH,
+                 refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
+        self.data_dir = data_dir
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self.version = _content_version(connection)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    def _query(self, sql, params=()):
+        with closing(self._connect()) as connection:
+            return [dict(row) for row in connection.execute(sql, params)]
+
+    def update(self):
+        """Brings the index in line with the XMLs on disk. Returns {indexed, unchanged, removed} comic names."""
+        files = {}
+        if os.path.isdir(self.data_dir):
+            files = {
+                os.path.splitext(name)[0]: os.path.join(self.data_dir, name)
+                for name in sorted(os.listdir(self.data_dir)) if name.endswith(".xml")
+            }
+        summary = {"indexed": [], "unchanged": [], "removed": []}
+
+        with self._lock, closing(self._connect()) as connection:
+            known = {row["name"]: row for row in connection.execute("SELECT * FROM comics")}
+            for name in sorted(set(known) - set(files)):
+                with connection:
+                    self._delete_comic(connection, known[name]["id"])
+                summary["removed"].append(name)
+
+            for name, path in files.items():
+                try:
+                    stat = os.stat(path)
+                    row = known.get(name)
+                    if row is not None and (row["mtime_ns"], row["size"]) == (stat.st_mtime_ns, stat.st_size):
+                        summary["unchanged"].append(name)
+                        continue
+                    digest = file_digest(path)
+                    if row is not None and row["sha256"] == digest:
+                        with connection:
+                            connection.execute("UPDATE comics SET mtime_ns = ?, size = ? WHERE id = ?",
+                                               (stat.st_mtime_ns, stat.st_size, row["id"]))
+                        summary["unchanged"].append(name)
+                        continue
+                    pairs = list(xml_stream.load_comic(path).page_pairs)
+                    with connection:
+                        if row is not None:
+                            self._delete_comic(connection, row["id"])
+                        self._insert_comic(connection, name, path, stat, digest, pairs)
+                except Exception as e:
+                    # A malformed XML (e.g. an empty <Index/>) must not abort the pass over the other comics.
+                    print(f"Could not index {path}: {e}")
+                    continue
+                summary["indexed"].append(name)
+
+            if summary["indexed"] or summary["removed"]:
+                self.version = _content_version(connection)
+        return summary
+
+    @staticmethod
+    def _delete_comic(connection, comic_id):
+        connection.execute(
+            "DELETE FROM bubble_text WHERE rowid IN (SELECT bubbles.id FROM bubbles "
+            "JOIN pages ON pages.id = bubbles.page_id WHERE pages.comic_id = ?)", (comic_id,))
+        connection.execute("DELETE FROM comics WHERE id = ?", (comic_id,))
+
+    @staticmethod
+    def _insert_comic(connection, name, path, stat, digest, pairs):
+        comic_id = connection.execute(
+            "INSERT INTO comics (name, path, mtime_ns, size, sha256, indexed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, path, stat.st_mtime_ns, stat.st_size, digest, time.time())).lastrowid
+
+        for pair_number, pair in enumerate(pairs):
+            for side, page in zip(("left", "right"), pair):
+                if page is None:
+                    continue
+                panels = page.panels
+                page_id = connection.execute(
+                    "INSERT INTO pages (comic_id, pair, side, page_index, type, panels, bubbles, entities) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (comic_id, pair_number, side, page.page_index, page.page_type.name, len(panels),
+                     sum(len(panel.speech_bubbles) for panel in panels),
+                     sum(len(panel.entities) for panel in panels))).lastrowid
+
+                for position, panel in enumerate(panels):
+                    panel_id = connection.execute(
+                        "INSERT INTO panels (page_id, position, scene_id, starting_tag, description, x, y, width, "
+                        "height) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (page_id, position, panel.scene_id, bool(panel.starting_tag), panel.description,
+                         *_box(panel.bounding_box))).lastrowid
+
+                    for bubble_position, bubble in enumerate(panel.speech_bubbles):
+                        bubble_id = connection.execute(
+                            "INSERT INTO bubbles (panel_id, page_id, position, type, text, speaker_id, x, y, width, "
+                            "height) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (panel_id, page_id, bubble_position, bubble.type, bubble.text,
+                             None if bubble.speaker_id is None else str(bubble.speaker_id),
+                             *_box(bubble.bounding_box))).lastrowid
+                        connection.execute("INSERT INTO bubble_text (rowid, text) VALUES (?, ?)",
+                                           (bubble_id, bubble.text or ""))
+
+                    for entity_position, entity in enumerate(panel.entities):
+                        entity_id = connection.execute(
+                            "INSERT INTO entities (panel_id, page_id, position, named_entity_id, active_tag, x, y, "
+                            "width, height) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (panel_id, page_id, entity_position, entity.named_entity_id, bool(entity.active_tag),
+                             *_box(entity.bounding_box))).lastrowid
+                        connection.executemany("INSERT INTO tags (entity_id, label, value) VALUES (?, ?, ?)",
+                                               [(entity_id, label, value) for label, value in entity.tags])
+
+    def search_bubbles(self, text, comic=None, limit=DEFAULT_LIMIT):
+        """Speech bubbles containing every word of text, best matches first, with their page and panel."""
+        query = fts_query(text)
+        if not query:
+            return []
+        return self._query(
+            "SELECT comics.name AS comic, pages.page_index, pages.pair, pages.side, panels.position AS panel, "
+            "bubbles.position AS bubble, bubbles.type, bubbles.speaker_id, bubbles.text, "
+            "snippet(bubble_text, 0, '[', ']', '…', 12) AS snippet, "
+            "bubbles.x, bubbles.y, bubbles.width, bubbles.height "
+            "FROM bubble_text JOIN bubbles ON bubbles.id = bubble_text.rowid "
+            "JOIN panels ON panels.id = bubbles.panel_id JOIN pages ON pages.id = bubbles.page_id "
+            "JOIN comics ON comics.id = pages.comic_id "
+            "WHERE bubble_text MATCH ? AND (? IS NULL OR comics.name = ?) ORDER BY bm25(bubble_text) LIMIT ?",
+            (query, comic, comic, limit))
+
+    def find_pages(self, min_panels=None, min_bubbles=None, min_entities=None, comic=None, limit=DEFAULT_LIMIT):
+        """Pages with at least the given numbers of panels, speech bubbles and entities (characters)."""
+        return self._query(
+            "SELECT comics.name AS comic, pages.page_index, pages.pair, pages.side, pages.type, pages.panels, "
+            "pages.bubbles, pages.entities FROM pages JOIN comics ON comics.id = pages.comic_id "
+            "WHERE pages.panels >= ? AND pages.bubbles >= ? AND pages.entities >= ? AND (? IS NULL OR comics.name = ?) "
+            "ORDER BY comics.name, pages.pair, pages.side LIMIT ?",
+            (min_panels or 0, min_bubbles or 0, min_entities or 0, comic, comic, limit))
+
+    def scene_counts(self, comic=None):
+        """Panels and pages per scene id, per comic."""
+        return self._query(
+            "SELECT comics.name AS comic, panels.scene_id, COUNT(*) AS panels, COUNT(DISTINCT pages.id) AS pages "
+            "FROM panels JOIN pages ON pages.id = panels.page_id JOIN comics ON comics.id = pages.comic_id "
+            "WHERE (? IS NULL OR comics.name = ?) GROUP BY comics.name, panels.scene_id "
+            "ORDER BY comics.name, panels.scene_id", (comic, comic))
+
+    def stats(self):
+        with closing(self._connect()) as connection:
+            counts = {table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ("comics", "pages", "panels", "bubbles", "entities", "tags")}
+        return {**counts, "version": self.version, "path": self.path}
+
+    def start(self):
+        """Updates the index now and then every refresh_interval seconds on a daemon thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="annotation-index", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.update()
+            except Exception as e:
+                print(f"Annotation index update failed: {e}")
+            if self._stop.wait(self.refresh_interval):
+                break
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -1,23 +1,51 @@
+import asyncio
+import hashlib
+import itertools
+import json
 import os
+import time
+from typing import Optional
 
 import cv2
 import uvicorn
-from starlette.responses import StreamingResponse
 import numpy as np
 from PIL import Image
 import io
 import base64
-from fastapi import FastAPI, Form
+from fastapi import FastAPI, Form, Header, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from src.Components.cv_panel import detect_panels, detect_speech_bubbles
+from src.Components.annotation_index import AnnotationIndex, DEFAULT_LIMIT as SEARCH_LIMIT
+from src.Components.catalog import ComicCatalog
+from src.Components.cv_panel import DETECTION_PARAMS, draw_boxes, PANEL_COLOR, SPEECH_BUBBLE_COLOR
+from src.Components.detection_pipeline import DetectionPipeline
+from src.Components.image_cache import PageImageCache
+from src.Components.param_profiles import ParameterProfiles
+from src.Components.thumbnails import ThumbnailStore
+from src.Components.worker_pool import DetectionPool, PoolFullError
+from src.Utils.lru_cache import ByteLRUCache
 
 app = FastAPI()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "..", r"Data/comics"))
+THUMBNAIL_DIR = os.environ.get("THUMBNAIL_DIR", os.path.abspath(os.path.join(DATA_DIR, "..", "thumbnails")))
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+RESPONSE_MEDIA_TYPES = {"png": "image/png", "json": "application/json"}
+MAX_BATCH_COMBINATIONS = int(os.environ.get("MAX_BATCH_COMBINATIONS", 256))
+BATCH_RETRY_DELAY = 0.1
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", 256 * 1024 ** 2))
+
+result_cache = ByteLRUCache(RESULT_CACHE_BYTES)
+detection_pool = DetectionPool()
+page_cache = PageImageCache()
+pipeline = DetectionPipeline()
+catalog = ComicCatalog(DATA_DIR)
+thumbnails = ThumbnailStore(catalog, THUMBNAIL_DIR)
+profiles = ParameterProfiles()
+annotation_index = AnnotationIndex(DATA_DIR)
 
 app.mount("/comics", StaticFiles(directory=DATA_DIR), name="comics")
 
@@ -29,6 +57,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing", "X-Total-Count"],
 )
 
 
@@ -50,70 +79,388 @@ def image_to_base64_np(array: np.ndarray) -> str:
         raise ValueError("Unsupported image shape for base64 conversion")
     return image_to_base64_pil(pil_img)
 
+def result_etag(key) -> str:
+    return '"' + hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    return any(tag.strip() in (etag, "*") for tag in if_none_match.split(","))
+
+
 @app.post("/api/process")
 async def process_image(
     comic: str = Form(...),
     page: str = Form(...),
-    threshold: int = Form(200),
-    blur: int = Form(5),
-    morph: int = Form(5),
-    min_size: int = Form(50),
-    bubble_thresh: int = Form(220),
-    bubble_min_area: float = Form(0.005),
-    bubble_max_area: float = Form(0.05),
-    min_circularity: float = Form(0.4),
-    use_adaptive: bool = Form(False)
+    threshold: Optional[int] = Form(None),
+    blur: Optional[int] = Form(None),
+    morph: Optional[int] = Form(None),
+    min_size: Optional[int] = Form(None),
+    bubble_thresh: Optional[int] = Form(None),
+    bubble_min_area: Optional[float] = Form(None),
+    bubble_max_area: Optional[float] = Form(None),
+    min_circularity: Optional[float] = Form(None),
+    use_adaptive: Optional[bool] = Form(None),
+    working_size: Optional[int] = Form(None),
+    refine: Optional[bool] = Form(None),
+    response_format: str = Form("png"),
+    include_contours: bool = Form(False),
+    if_none_match: Optional[str] = Header(None)
 ):
+    if response_format not in RESPONSE_MEDIA_TYPES:
+        return JSONResponse(status_code=400, content={"error": f"Unknown response_format {response_format}"})
+
     img_path = os.path.join(DATA_DIR, comic, page)
     if not os.path.exists(img_path):
         return JSONResponse(status_code=404, content={"error": "Page not found"})
 
-    img = cv2.imread(img_path)
-    if img is None:
+    # Parameters left out of the form take the comic's tuned profile, or the detector defaults.
+    given = {
+        "threshold": threshold,
+        "blur": blur,
+        "morph": morph,
+        "min_size": min_size,
+        "bubble_thresh": bubble_thresh,
+        "bubble_min_area": bubble_min_area,
+        "bubble_max_area": bubble_max_area,
+        "min_circularity": min_circularity,
+        "use_adaptive": use_adaptive,
+        "working_size": working_size,
+        "refine": refine
+    }
+    _, params = profiles.get(comic)
+    params.update({name: value for name, value in given.items() if value is not None})
+    media_type = RESPONSE_MEDIA_TYPES[response_format]
+
+    # The result only depends on the page file and the parameters, so the key doubles as a strong ETag.
+    stat = os.stat(img_path)
+    key = (comic, page, stat.st_mtime_ns, stat.st_size, tuple(params.values()), response_format, include_contours)
+    etag = result_etag(key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    cached = result_cache.get(key)
+    if cached is not None:
+        return Response(content=cached, media_type=media_type, headers={**headers, "Server-Timing": "result;desc=hit"})
+
+    try:
+        content, timings = await detection_pool.run(render_detection, img_path, params, response_format,
+                                                    include_contours)
+    except PoolFullError:
+        return JSONResponse(status_code=503, content={"error": "Server busy, try again"}, headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        return JSONResponse(status_code=504, content={"error": "Detection timed out"})
+
+    if content is None:
         return JSONResponse(status_code=400, content={"error": "Invalid image"})
 
-    panel_img = detect_panels(img, blur, threshold, morph, min_size)
-    result_img = detect_speech_bubbles(
-        panel_img,
-        bubble_thresh=bubble_thresh,
-        min_area_ratio=bubble_min_area,
-        max_area_ratio=bubble_max_area,
-        use_adaptive=use_adaptive,
-        min_circularity=min_circularity
-    )
+    result_cache.put(key, content)
+    return Response(content=content, media_type=media_type, headers={**headers, "Server-Timing": timings})
+
+
+def server_timing(**durations):
+    """Server-Timing header value; a duration of None marks a step served from cache."""
+    return ", ".join(f"{name};desc=hit" if seconds is None else f"{name};dur={seconds * 1000:.1f}"
+                     for name, seconds in durations.items())
+
+
+def image_key(img_path):
+    """Identity of a page's contents for the stage cache."""
+    stat = os.stat(img_path)
+    return img_path, stat.st_mtime_ns, stat.st_size
+
+
+def render_detection(img_path, params, response_format="png", include_contours=False):
+    """Blocking part of /api/process, run on the detection pool.
+
+    Returns (response bytes or None, Server-Timing header value). The json format holds the box
+    lists; the png format draws them onto a copy of the page. The timing lists every detection
+    stage, so it shows which ones were recomputed and which came from the stage cache.
+    """
+    key = image_key(img_path)
+    page_img, gray, decode_seconds = page_cache.get(img_path, gray=True)
+    if page_img is None:
+        return None, server_timing(decode=decode_seconds)
+
+    start = time.perf_counter()
+    panels, speech_bubbles, stage_timings = pipeline.run(key, gray, params, include_contours=include_contours)
+    detect_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if response_format == "json":
+        height, width = page_img.shape[:2]
+        content = json.dumps({
+            "width": width,
+            "height": height,
+            "panels": panels,
+            "speech_bubbles": speech_bubbles
+        }).encode("utf-8")
+    else:
+        result_img = draw_boxes(page_img.copy(), panels, PANEL_COLOR)
+        result_img = draw_boxes(result_img, speech_bubbles, SPEECH_BUBBLE_COLOR)
+        _, img_encoded = cv2.imencode('.png', result_img)
+        content = img_encoded.tobytes()
+    encode_seconds = time.perf_counter() - start
+
+    return content, server_timing(decode=decode_seconds, **stage_timings, detect=detect_seconds,
+                                  encode=encode_seconds)
+
+
+def expand_param_grid(spec, defaults=None):
+    """Turns a parameter spec into a list of complete parameter sets.
+
+    Missing names take their value from defaults (DETECTION_PARAMS if not given); a list value
+    sweeps over its entries and the grid is the cartesian product of all swept names. Raises
+    ValueError on unknown names and on a spec that is not an object, and TypeError on values that
+    do not fit a parameter's type.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("Parameters must be a JSON object")
+    defaults = DETECTION_PARAMS if defaults is None else defaults
+    unknown = set(spec) - set(DETECTION_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+
+    axes = []
+    for name, default in DETECTION_PARAMS.items():
+        values = spec.get(name, defaults.get(name, default))
+        if not isinstance(values, list):
+            values = [values]
+        if not values:
+            raise ValueError(f"Empty value list for {name}")
+        if isinstance(default, bool) and not all(isinstance(value, bool) for value in values):
+            # bool("false") is True, so flags only accept JSON booleans.
+            raise TypeError(f"{name} takes true or false")
+        axes.append([type(default)(value) for value in values])
+
+    return [dict(zip(DETECTION_PARAMS, combination)) for combination in itertools.product(*axes)]
+
+
+def detect_page_grid(img_path, param_sets, include_contours=False):
+    """Blocking part of /api/batch for one page, run on the detection pool.
+
+    Decode and grayscale happen once for the whole grid, and the stage cache means each grid point
+    only recomputes the stages whose parameters differ from earlier ones. Returns (record or None,
+    timings), where record holds the page size, one result per parameter set and how many stage
+    results were computed or reused.
+    """
+    key = image_key(img_path)
+    page_img, gray, decode_seconds = page_cache.get(img_path, gray=True)
+    if page_img is None:
+        return None, {"decode": decode_seconds}
+
+    start = time.perf_counter()
+    results = []
+    computed = reused = 0
+    for params in param_sets:
+        panels, speech_bubbles, stage_timings = pipeline.run(key, gray, params, include_contours=include_contours)
+        results.append({"params": params, "panels": panels, "speech_bubbles": speech_bubbles})
+        reused += sum(seconds is None for seconds in stage_timings.values())
+        computed += sum(seconds is not None for seconds in stage_timings.values())
+
+    height, width = page_img.shape[:2]
+    record = {"width": width, "height": height, "results": results, "stages": {"computed": computed, "reused": reused}}
+    return record, {"decode": decode_seconds, "detect": time.perf_counter() - start}
+
+
+async def run_batch_page(index, page, img_path, param_sets, include_contours):
+    # Batches share the pool with /api/process, so a full pool means waiting for a slot rather than failing the page.
+    while True:
+        try:
+            record, timings = await detection_pool.run(detect_page_grid, img_path, param_sets, include_contours,
+                                                        timeout=detection_pool.timeout * len(param_sets))
+            break
+        except PoolFullError:
+            await asyncio.sleep(BATCH_RETRY_DELAY)
+        except asyncio.TimeoutError:
+            return {"index": index, "page": page, "error": "Detection timed out"}
+        except Exception as e:
+            # One failing page must not end the stream for the pages after it.
+            return {"index": index, "page": page, "error": f"Detection failed: {e}"}
+
+    if record is None:
+        return {"index": index, "page": page, "error": "Invalid image"}
+    return {"index": index, "page": page, **record,
+            "timings": {name: round(seconds * 1000, 1) for name, seconds in timings.items()}}
+
 
-    _, img_encoded = cv2.imencode('.png', result_img)
-    return StreamingResponse(io.BytesIO(img_encoded.tobytes()), media_type='image/png')
+async def stream_batch(comic_dir, pages, param_sets, include_contours):
+    """Yields one NDJSON line per page in completion order, keeping at most one job per worker in flight."""
+    window = max(1, detection_pool.workers)
+    remaining = iter(enumerate(pages))
+    pending = set()
+    try:
+        while True:
+            for index, page in itertools.islice(remaining, window - len(pending)):
+                img_path = os.path.join(comic_dir, page)
+                pending.add(asyncio.ensure_future(run_batch_page(index, page, img_path, param_sets, include_contours)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield json.dumps(task.result()) + "\n"
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+@app.post("/api/batch")
+async def process_batch(
+    comic: str = Form(...),
+    params: str = Form("{}"),
+    pages: Optional[str] = Form(None),
+    include_contours: bool = Form(False)
+):
+    """Runs the detectors over a comic for one parameter set or a grid of them.
+
+    params is a JSON object of detection parameters, where list values are swept; pages is an
+    optional JSON list restricting the run to those page files (duplicates are run once). The
+    response is NDJSON with one line per page as soon as that page finishes.
+    """
+    entry = catalog.get(comic)
+    if entry is None:
+        return JSONResponse(status_code=404, content={"error": "Comic not found"})
+
+    try:
+        param_sets = expand_param_grid(json.loads(params), profiles.get(comic)[1])
+        selected = entry["pages"] if pages is None else json.loads(pages)
+        if not isinstance(selected, list) or not all(isinstance(page, str) for page in selected):
+            raise ValueError("pages must be a JSON list of page file names")
+        selected = list(dict.fromkeys(selected))
+    except (ValueError, TypeError) as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    if len(param_sets) > MAX_BATCH_COMBINATIONS:
+        return JSONResponse(status_code=400, content={
+            "error": f"{len(param_sets)} parameter combinations, at most {MAX_BATCH_COMBINATIONS} allowed"})
+    missing = set(selected) - set(entry["pages"])
+    if missing:
+        return JSONResponse(status_code=404, content={"error": f"Pages not found: {', '.join(sorted(missing))}"})
+
+    comic_dir = os.path.join(DATA_DIR, comic)
+    return StreamingResponse(stream_batch(comic_dir, selected, param_sets, include_contours),
+                             media_type="application/x-ndjson")
+
+
+@app.get("/api/profiles/{comic}")
+def get_profile(comic: str):
+    """The detection parameters /api/process uses for comic when the form leaves them out."""
+    name, params = profiles.get(comic)
+    return {"comic": comic, "profile": name, "params": params}
+
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return {"results": result_cache.stats(), "pages": page_cache.stats(), "stages": pipeline.stats(),
+            "thumbnails": thumbnails.stats()}
+
+
+@app.get("/api/pool/stats")
+def pool_stats():
+    return detection_pool.stats()
+
+
+@app.on_event("startup")
+def start_catalog():
+    catalog.start()
+    thumbnails.start()
+    annotation_index.start()
+
+
+@app.on_event("shutdown")
+def shutdown_pool():
+    annotation_index.stop()
+    thumbnails.stop()
+    catalog.stop()
+    detection_pool.shutdown()
 
 
 @app.get("/comics")
-def list_comics():
-    comics = []
+def list_comics(
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    q: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None)
+):
     if not os.path.exists(DATA_DIR):
         return JSONResponse(status_code=500, content={"error": f"DATA_DIR not found: {DATA_DIR}"})
 
-    for comic_name in os.listdir(DATA_DIR):
-        if comic_name == "static":
-            continue
-        comic_path = os.path.join(DATA_DIR, comic_name)
-        if not os.path.isdir(comic_path):
-            continue
-
-        pages = sorted([
-            f for f in os.listdir(comic_path)
-            if f.lower().endswith((".jpg", ".jpeg", ".png"))
-        ])
-        if not pages:
-            continue
-
-        xml_content = os.path.join(DATA_DIR, comic_name + ".xml")
-        comics.append({
-            "name": comic_name,
-            "pages": pages,
-            "annotations": xml_content,
-            "previewImage": pages[0]
-        })
-    return comics
+    etag = result_etag((catalog.etag, offset, limit, q))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    comics, total = catalog.list(offset, limit, q)
+    return JSONResponse(content=comics, headers={**headers, "X-Total-Count": str(total)})
+
+
+def index_response(result, key, if_none_match):
+    """JSON response for an annotation index query, revalidated against the index version."""
+    headers = {"ETag": result_etag((annotation_index.version, key)), "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    start = time.perf_counter()
+    content = result()
+    headers["Server-Timing"] = server_timing(index=time.perf_counter() - start)
+    return JSONResponse(content=content, headers=headers)
+
+
+@app.get("/api/search")
+def search_bubbles(q: str, comic: Optional[str] = None, limit: int = Query(SEARCH_LIMIT, ge=1, le=1000),
+                   if_none_match: Optional[str] = Header(None)):
+    """Speech bubbles across the annotated corpus that contain every word of q."""
+    return index_response(lambda: annotation_index.search_bubbles(q, comic, limit), ("bubbles", q, comic, limit),
+                          if_none_match)
+
+
+@app.get("/api/search/pages")
+def search_pages(min_panels: Optional[int] = None, min_bubbles: Optional[int] = None,
+                 min_entities: Optional[int] = None, comic: Optional[str] = None,
+                 limit: int = Query(SEARCH_LIMIT, ge=1, le=1000), if_none_match: Optional[str] = Header(None)):
+    """Pages with at least the given numbers of panels, speech bubbles and entities."""
+    key = ("pages", min_panels, min_bubbles, min_entities, comic, limit)
+    return index_response(lambda: annotation_index.find_pages(min_panels, min_bubbles, min_entities, comic, limit),
+                          key, if_none_match)
+
+
+@app.get("/api/search/scenes")
+def search_scenes(comic: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
+    """Panels and pages per scene."""
+    return index_response(lambda: annotation_index.scene_counts(comic), ("scenes", comic), if_none_match)
+
+
+@app.get("/api/search/stats")
+def search_stats():
+    return annotation_index.stats()
+
+
+@app.get("/thumbnails/{tier}/{comic}/{page}")
+def get_thumbnail(tier: str, comic: str, page: str, v: Optional[str] = None,
+                  if_none_match: Optional[str] = Header(None)):
+    """Serves a reduced rendition of a page (tier preview or page), generating it on first request.
+
+    URLs carrying the current source version (v, as in the catalog's thumbnail field) are
+    immutable; unversioned ones are revalidated by ETag.
+    """
+    entry = catalog.get(comic)
+    if entry is None or page not in entry["pages"]:
+        return JSONResponse(status_code=404, content={"error": "Page not found"})
+
+    rendition = thumbnails.get(comic, page, tier)
+    if rendition is None:
+        return JSONResponse(status_code=404, content={"error": f"No {tier} rendition for {page}"})
+
+    path, source_mtime = rendition
+    cache_control = "public, no-cache"
+    if v == str(source_mtime):
+        cache_control = f"public, max-age={THUMBNAIL_MAX_AGE}, immutable"
+    headers = {"ETag": result_etag((tier, comic, page, source_mtime)), "Cache-Control": cache_control}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import threading
+
+PAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+SKIPPED_DIRS = ("static",)
+DEFAULT_REFRESH_INTERVAL = float(os.environ.get("CATALOG_REFRESH_INTERVAL", 5))
+
+
+class ComicCatalog:
+    """In-memory index of the comic folders in data_dir.
+
+    The index is built once and then refreshed incrementally: the data directory is only re-listed
+    when its mtime changes, and a comic folder is only rescanned when its own mtime or the mtime of
+    its preview page changes (a page rewritten in place leaves the folder mtime alone).
+    Readers get an immutable snapshot, so listing never touches the file system.
+    """
+
+    def __init__(self, data_dir: str, refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
+        self.data_dir = data_dir
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self._root_mtime = None
+        self._folders = {}
+        self._snapshot = ()
+        self._etag = '"0"'
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.refresh()
+
+    @property
+    def etag(self):
+        return self._etag
+
+    def _scan_comic(self, comic_name):
+        """(entry, preview mtime) of a comic folder; (None, None) if it has no pages."""
+        comic_path = os.path.join(self.data_dir, comic_name)
+        pages = sorted(f for f in os.listdir(comic_path) if f.lower().endswith(PAGE_EXTENSIONS))
+        if not pages:
+            return None, None
+        # The preview's mtime versions the thumbnail URL, so clients may cache it indefinitely.
+        preview_mtime = os.stat(os.path.join(comic_path, pages[0])).st_mtime_ns
+        return {
+            "name": comic_name,
+            "pages": pages,
+            "annotations": os.path.join(self.data_dir, comic_name + ".xml"),
+            "previewImage": pages[0],
+            "thumbnail": f"thumbnails/preview/{comic_name}/{pages[0]}?v={preview_mtime}"
+        }, preview_mtime
+
+    def refresh(self):
+        """Rescans whatever changed since the last refresh. Returns True if the catalog changed."""
+        if not os.path.isdir(self.data_dir):
+            return False
+
+        with self._lock:
+            changed = False
+            root_mtime = os.stat(self.data_dir).st_mtime_ns
+            if root_mtime != self._root_mtime:
+                names = {
+                    name for name in os.listdir(self.data_dir)
+                    if name not in SKIPPED_DIRS and os.path.isdir(os.path.join(self.data_dir, name))
+                }
+                for removed in set(self._folders) - names:
+                    del self._folders[removed]
+                    changed = True
+                for added in names - set(self._folders):
+                    self._folders[added] = (None, None, None)
+                self._root_mtime = root_mtime
+
+            for name, (mtime, preview_mtime, entry) in list(self._folders.items()):
+                comic_path = os.path.join(self.data_dir, name)
+                try:
+                    current = os.stat(comic_path).st_mtime_ns
+                except FileNotFoundError:
+                    del self._folders[name]
+                    changed = True
+                    continue
+                if current == mtime:
+                    if entry is None:
+                        continue
+                    try:
+                        if os.stat(os.path.join(comic_path, entry["previewImage"])).st_mtime_ns == preview_mtime:
+                            continue
+                    except FileNotFoundError:
+                        pass
+                new_entry, new_preview_mtime = self._scan_comic(name)
+                self._folders[name] = (current, new_preview_mtime, new_entry)
+                changed = changed or new_entry != entry
+
+            if changed or self.version == 0:
+                self._snapshot = tuple(entry for _, (_, _, entry) in sorted(self._folders.items())
+                                       if entry is not None)
+                self.version += 1
+                digest = hashlib.sha256(repr(self._snapshot).encode("utf-8")).hexdigest()[:32]
+                self._etag = f'"{digest}"'
+            return changed
+
+    def list(self, offset: int = 0, limit=None, query=None):
+        """Returns (comics, total) for the given page of the (optionally name-filtered) catalog."""
+        comics = self._snapshot
+        if query:
+            query = query.lower()
+            comics = tuple(comic for comic in comics if query in comic["name"].lower())
+        end = None if limit is None else offset + limit
+        return list(comics[offset:end]), len(comics)
+
+    def get(self, name):
+        for comic in self._snapshot:
+            if comic["name"] == name:
+                return comic
+        return None
+
+    def start(self):
+        """Refreshes the catalog every refresh_interval seconds on a daemon thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="catalog-refresh", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except OSError as e:
+                print(f"Catalog refresh failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
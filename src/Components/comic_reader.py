@@ -6,50 +6,70 @@ import numpy as np
 import xml.etree.ElementTree as ET
 
 from src.Utils import image_utils as iu
+from src.Utils import box_association as ba
 from src.Classes.comic import Comic
 from src.Classes.page import Page,PageType
 from src.Classes.panel import Panel
 from src.Classes.speech_bubble import SpeechBubble,SpeechBubbleType
 from src.Classes.entity import Entity
-from Models import magi
+from Models import registry
 from PIL import Image
 
-class ComicReader:
-    def __init__(self):
-        self.model = magi.MagiModel()
+DEFAULT_BATCH_SIZE = 8
 
-    def read_comic(self, name, images):
-        comic = Comic(name=name, page_pairs=[])
-        pages = []
 
-        for i, image in enumerate(images):
-            page = Page(
+class ComicReader:
+    def __init__(self, model=None, batch_size=DEFAULT_BATCH_SIZE, cache=None):
+        self.model = model if model is not None else registry.get_model()
+        self.batch_size = batch_size
+        self.cache = cache
+
+    def read_comic(self, name, images, batch_size=None):
+        pages = [
+            Page(
                 page_index=i + 1,
                 page_type=PageType(3),
                 page_image=image
             )
-            self.handle_detect_objects(page)
-
-            if i == 0:
-                comic.page_pairs.append((None,page))
-            else:
-                pages.append(page)
-
-        for i in range(0, len(pages), 2):
-            if i + 1 < len(pages):
-                page_pair = (pages[i], pages[i + 1])
-            else:
-                page_pair = (pages[i],None)
-            comic.page_pairs.append(page_pair)
-
-        return comic
+            for i, image in enumerate(images)
+        ]
+        self.detect_pages(pages, batch_size)
+
+        return Comic.from_pages(name, pages)
+
+    def detect_pages(self, pages, batch_size=None):
+        """Sends the pages to the model batch_size at a time and post-processes every page result.
+
+        A batch whose pages are all in the detection cache (from a model call over exactly these
+        pages) skips the model and only runs the post-processing. Character labels come from one
+        clustering per batch, so they are only comparable within a batch.
+        """
+        batch_size = max(1, batch_size or self.batch_size)
+
+        for start in range(0, len(pages), batch_size):
+            batch = pages[start:start + batch_size]
+            images = [page.page_image for page in batch]
+            keys = self.cache.batch_keys(images) if self.cache is not None else []
+            data = []
+            for key in keys:
+                page_result = self.cache.get(key)
+                if page_result is None:
+                    break
+                data.append(page_result)
+
+            if len(data) != len(batch):
+                data = self.model.detect_objects_batch(images)
+                for key, page_result in zip(keys, data):
+                    self.cache.put(key, page_result)
+            for page, page_result in zip(batch, data):
+                self.handle_page_result(page, page_result)
 
     def handle_panels(self, panel_list, page, y_tolerance=50):
+        boxes = ba.xyxy_to_array(panel_list)
         panels = []
 
-        for panel in panel_list:
-            bbox = iu.x1y1x2y2_to_xywh(panel)
-            print(bbox)
+        for i in ba.reading_order(boxes, y_tolerance):
+            bbox = iu.x1y1x2y2_to_xywh(panel_list[i])
             panel_image = iu.image_from_bbox(page.page_image, bbox)
 
             description = ""
@@ -58,119 +78,83 @@ class ComicReader:
             panel.descriptions.append(panel.description)
             panels.append(panel)
 
-            sorted_panels = sorted(
-                panels,
-                key=lambda p: (p.bounding_box['y'] // y_tolerance, p.bounding_box['x'])
-            )
-            page.panels = sorted_panels
+        page.panels = panels
 
     def handle_entities(self, entity_list, character_cluster_labels, page):
-        for i, entity_ in enumerate(entity_list):
-            bbox = iu.x1y1x2y2_to_xywh(entity_)
-            entity = Entity(bbox)
-            entity.named_entity_id = character_cluster_labels[i]
-            entity.image = iu.image_from_bbox(page.page_image, bbox)
-
-            for panel in page.panels:
-                best_panel = None
-                highest_iou = 0
-
-                for panel in page.panels:
-                    iou_value = iu.calculate_iou(panel.bounding_box, entity.bounding_box)
-
-                    if iou_value > highest_iou:
-                        highest_iou = iou_value
-                        best_panel = panel
-
-                if best_panel is not None and highest_iou > 0:
-                    if not any(iu.calculate_iou(existing_entity.bounding_box, entity.bounding_box) > 0.6
-                               for existing_entity in best_panel.entities):
-                        best_panel.entities.append(entity)
-
-                for panel in page.panels:
-                    entities = panel.entities
-                    panel.entities = sorted(entities,
-                                            key=lambda p: ((p.bounding_box['y'] - p.bounding_box['height']),
-                                                           (p.bounding_box['x']) - p.bounding_box['width']))
+        boxes = ba.xyxy_to_array(entity_list)
+        panel_index = page.get_panel_index()
+
+        rows, cols = panel_index.query_pairs(boxes)
+        scores = ba.pair_iou(boxes, panel_index.boxes, rows, cols)
+        best_panels = ba.assign_pairs_to_best(rows, cols, scores, len(boxes))
+        keep = ba.deduplicate(boxes, best_panels, threshold=0.6)
+
+        for panel, indices in zip(page.panels, ba.group_indices(best_panels, len(page.panels))):
+            for i in indices[keep[indices]]:
+                bbox = iu.x1y1x2y2_to_xywh(entity_list[i])
+                entity = Entity(bbox)
+                entity.named_entity_id = character_cluster_labels[i]
+                entity.image = iu.image_from_bbox(page.page_image, bbox)
+                panel.entities.append(entity)
+
+            if len(indices):
+                order = ba.corner_order(ba.boxes_to_array([entity.bounding_box for entity in panel.entities]))
+                panel.entities = [panel.entities[i] for i in order]
 
     def handle_speechbubbles(self, speechbubble_list, is_essential_text, page):
-        essential_counter = 0
-        for i, speechbubble in enumerate(speechbubble_list):
-            bbox = iu.x1y1x2y2_to_xywh(speechbubble)
-            speech_bubble_image = iu.image_from_bbox(page.page_image, bbox)
-            description = ""
-            speech_bubble = SpeechBubble(SpeechBubbleType.SPEECH, description, bbox, speech_bubble_image)
-            speech_bubble.type = 'dialogue'
-            speech_bubble.person_list = []
-
-            if is_essential_text[i]:
-                speech_bubble.speaker_id = 1
-                essential_counter += 1
-            else:
-                speech_bubble.speaker_id = 0
-
-            max_overlap = 0
-            best_panel = None
-            for panel in page.panels:
-                overlap = iu.calculate_overlap_percentage(speech_bubble.bounding_box, panel.bounding_box)
-                if overlap > max_overlap:
-                    max_overlap = overlap
-                    best_panel = panel
-
-            if best_panel:
-                best_panel.speech_bubbles.append(speech_bubble)
-
-        for panel in page.panels:
-            speech_bubbles = panel.speech_bubbles
-            panel.speech_bubbles = sorted(
-                speech_bubbles,
-                key=lambda p: ((p.bounding_box['y'] - p.bounding_box['height']),
-                               (p.bounding_box['x'] - p.bounding_box['width']))
-            )
+        boxes = ba.xyxy_to_array(speechbubble_list)
+        panel_index = page.get_panel_index()
+
+        rows, cols = panel_index.query_pairs(boxes)
+        scores = ba.pair_overlap(boxes, panel_index.boxes, rows, cols)
+        best_panels = ba.assign_pairs_to_best(rows, cols, scores, len(boxes))
+
+        for panel, indices in zip(page.panels, ba.group_indices(best_panels, len(page.panels))):
+            for i in indices:
+                bbox = iu.x1y1x2y2_to_xywh(speechbubble_list[i])
+                speech_bubble_image = iu.image_from_bbox(page.page_image, bbox)
+                description = ""
+                speech_bubble = SpeechBubble(SpeechBubbleType.SPEECH, description, bbox, speech_bubble_image)
+                speech_bubble.type = 'dialogue'
+                speech_bubble.person_list = []
+                speech_bubble.speaker_id = 1 if is_essential_text[i] else 0
+                panel.speech_bubbles.append(speech_bubble)
+
+            if len(panel.speech_bubbles):
+                order = ba.corner_order(ba.boxes_to_array([sb.bounding_box for sb in panel.speech_bubbles]))
+                panel.speech_bubbles = [panel.speech_bubbles[i] for i in order]
 
     def handle_detect_objects(self, page):
-        data = self.model.detect_objects(image=page.page_image)
-        panel_list = data[0]['panels']
-        speechbubble_list = data[0]['texts']
-        entity_list = data[0]['characters']
-        tails = data[0]['tails']
-        text_character_associations = data[0]['text_character_associations']
-        text_tail_associations = data[0]['text_tail_associations']
-        character_cluster_labels = data[0]['character_cluster_labels']
-        is_essential_text = data[0]['is_essential_text']
-        character_names = data[0]['character_names']
+        self.detect_pages([page], batch_size=1)
+
+    def handle_page_result(self, page, page_result):
+        panel_list = page_result['panels']
+        speechbubble_list = page_result['texts']
+        entity_list = page_result['characters']
+        tails = page_result['tails']
+        text_character_associations = page_result['text_character_associations']
+        text_tail_associations = page_result['text_tail_associations']
+        character_cluster_labels = page_result['character_cluster_labels']
+        is_essential_text = page_result['is_essential_text']
+        character_names = page_result['character_names']
 
         self.handle_panels(panel_list, page)
         self.handle_entities(entity_list, character_cluster_labels, page)
         self.handle_speechbubbles(speechbubble_list, is_essential_text, page)
 
 
-def read_comics():
-
-    comic = ComicReader()
-    comic_dir = r"C:\Users\derra\PycharmProjects\ComicToNarration\Data\comics"
-    for root, dirs, files in os.walk(comic_dir):
-        for dir_name in dirs:
-            dir_path = os.path.join(root, dir_name)
-            images = []
-
-            for file_name in os.listdir(dir_path):
-                file_path = os.path.join(dir_path, file_name)
-
-                if os.path.isfile(file_path):
-                    try:
-                        img = Image.open(file_path).convert("RGB")
-                        image = np.array(img)
-                        images.append(image)
-                    except Exception as e:
-                        print(f"Error reading {file_path}: {e}")
-
-            comic_reader = ComicReader()
-            comic = comic_reader.read_comic(dir_path, images)
-
-            xml_element = comic.to_xml()
-            xml_bytes = ET.tostring(xml_element, encoding='utf-8')
-            xml_str = xml_bytes.decode('utf-8')
-
-            with open(os.path.join(root, f"{dir_name}.xml"), "w", encoding="utf-8") as f:
-                f.write(xml_str)
\ No newline at end of file
+def read_comics(comic_dir=None, workers=1, batch_size=None, cache_dir=None, max_memory_mb=None, force=False,
+                incremental=False):
+    from src.Components import corpus_annotator
+
+    summary = corpus_annotator.annotate_corpus(
+        comic_dir or corpus_annotator.DEFAULT_COMIC_DIR,
+        workers=workers,
+        batch_size=batch_size,
+        cache_dir=cache_dir,
+        max_memory_mb=max_memory_mb,
+        force=force,
+        incremental=incremental
+    )
+    print(summary)
+    return summary
@@ -0,0 +1,487 @@
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+DEFAULT_COMIC_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Data", "comics"))
+SKIPPED_DIRS = ("static",)
+MANIFEST_VERSION = 1
+
+
+def find_comics(comic_dir):
+    """Returns (name, dir_path, xml_path) for every comic folder that contains page images."""
+    comics = []
+    for dir_name in sorted(os.listdir(comic_dir)):
+        dir_path = os.path.join(comic_dir, dir_name)
+        if dir_name in SKIPPED_DIRS or not os.path.isdir(dir_path):
+            continue
+        if page_files(dir_path):
+            comics.append((dir_name, dir_path, os.path.join(comic_dir, f"{dir_name}.xml")))
+    return comics
+
+
+def page_files(dir_path):
+    return [
+        os.path.join(dir_path, file_name)
+        for file_name in sorted(os.listdir(dir_path))
+        if file_name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(dir_path, file_name))
+    ]
+
+
+def is_up_to_date(dir_path, xml_path):
+    """An annotation is up to date if it is newer than the comic folder and every page in it."""
+    if not os.path.exists(xml_path):
+        return False
+    xml_mtime = os.path.getmtime(xml_path)
+    newest_source = max([os.path.getmtime(dir_path)] + [os.path.getmtime(path) for path in page_files(dir_path)])
+    return xml_mtime >= newest_source
+
+
+def load_images(paths):
+    images = []
+    for file_path in paths:
+        try:
+            img = Image.open(file_path).convert("RGB")
+            images.append(np.array(img))
+        except Exception as e:
+            print(f"Error reading {file_path}: {e}")
+    return images
+
+
+def _write_atomic(path, write):
+    """Writes path through write(file) on a temporary file, so a crash never leaves a partial file behind."""
+    from src.Utils.io_utils import match_file_mode
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=os.path.splitext(path)[1] + ".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        match_file_mode(temp_path, path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def write_annotation(comic, xml_path):
+    """Writes the XML next to the comic folder, atomically."""
+    from src.Utils.xml_stream import write_comic
+
+    _write_atomic(xml_path, lambda f: write_comic(comic, f))
+
+
+def manifest_path(xml_path):
+    return os.path.splitext(xml_path)[0] + ".manifest.json"
+
+
+def fingerprint_pages(paths, previous=None):
+    """One {file, size, mtime_ns, sha256} entry per page file.
+
+    The hash of a file whose size and mtime match its entry in previous is reused, so only new or
+    touched files are read.
+    """
+    from src.Utils.io_utils import file_digest
+
+    known = {entry["file"]: entry for entry in previous or ()}
+    entries = []
+    for path in paths:
+        stat = os.stat(path)
+        entry = known.get(os.path.basename(path))
+        if entry is None or (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+            entry = {"file": os.path.basename(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                     "sha256": file_digest(path)}
+        entries.append(entry)
+    return entries
+
+
+def read_manifest(xml_path):
+    """The page entries the XML was written from, or None if there is no usable manifest."""
+    try:
+        with open(manifest_path(xml_path), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest.get("pages")
+
+
+def write_manifest(xml_path, pages):
+    """Records which page file each page of the XML was annotated from; page n of the XML is pages[n - 1]."""
+    data = json.dumps({"version": MANIFEST_VERSION, "pages": pages}, indent=1).encode("utf-8")
+    _write_atomic(manifest_path(xml_path), lambda f: f.write(data))
+
+
+def remove_manifest(xml_path):
+    if os.path.exists(manifest_path(xml_path)):
+        os.remove(manifest_path(xml_path))
+
+
+def page_elements(root):
+    """The Page elements of an annotation tree in reading order."""
+    return [
+        side.find("Page")
+        for pair in root.find("PagePairs")
+        for side in (pair.find("LeftPage"), pair.find("RightPage"))
+        if side is not None and side.find("Page") is not None
+    ]
+
+
+def kept_entity_ids(elements):
+    """The integer Named_Entity_Id values used by the entities of the Page elements."""
+    for element in elements:
+        for id_element in element.iter("Named_Entity_Id"):
+            try:
+                yield int(id_element.text)
+            except (TypeError, ValueError):
+                continue
+
+
+def splice_pages(root, pages):
+    """A new annotation tree with root's Name and the Page elements pages, paired like Comic.from_pages."""
+    import xml.etree.ElementTree as eT
+
+    from src.Classes.comic import Comic
+
+    element = eT.Element("Comic")
+    element.append(root.find("Name"))
+    pairs_element = eT.SubElement(element, "PagePairs")
+    for left, right in Comic.from_pages(None, pages).page_pairs:
+        pair_element = eT.SubElement(pairs_element, "PagePair")
+        if left is not None:
+            eT.SubElement(pair_element, "LeftPage").append(left)
+        if right is not None:
+            eT.SubElement(pair_element, "RightPage").append(right)
+    return element
+
+
+def annotate_comic(reader, dir_path, xml_path, incremental=False):
+    """Annotates one comic folder and returns the number of pages that went through the model.
+
+    With incremental set and an existing XML, pages whose file content is unchanged keep their
+    Page elements (including manual scene and entity edits) byte for byte; only added or changed
+    pages are detected and spliced in, and the page pairs and indices are rebuilt. An existing XML
+    is never replaced by a full re-annotation in incremental mode (see _annotate_changed_pages).
+    """
+    paths = page_files(dir_path)
+    if incremental and os.path.exists(xml_path):
+        previous = read_manifest(xml_path)
+        return _annotate_changed_pages(reader, xml_path, paths, fingerprint_pages(paths, previous), previous)
+
+    pages = fingerprint_pages(paths)
+    images = load_images(paths)
+    comic = reader.read_comic(dir_path, images)
+    write_annotation(comic, xml_path)
+    if len(images) == len(paths):
+        write_manifest(xml_path, pages)
+    else:
+        remove_manifest(xml_path)
+    return len(images)
+
+
+def _annotate_changed_pages(reader, xml_path, paths, pages, previous):
+    """Splices freshly detected pages into the existing XML and returns how many were detected.
+
+    An XML without a manifest (e.g. written before manifests existed) is taken to match the current
+    page files if it has one Page per file, and the manifest is seeded from them. Otherwise, and
+    when the XML no longer has one Page per manifest entry, ValueError is raised and the XML is
+    left alone, so manual edits are never lost to a full re-annotation.
+    """
+    import xml.etree.ElementTree as eT
+
+    from src.Classes.page import Page, PageType
+
+    root = eT.parse(xml_path).getroot()
+    old_elements = page_elements(root)
+    if previous is None:
+        if len(old_elements) != len(pages):
+            raise ValueError(f"{xml_path} has no manifest and {len(old_elements)} pages for {len(pages)} page "
+                             f"files; re-annotate it without incremental to replace it")
+        previous = pages
+    elif len(old_elements) != len(previous):
+        raise ValueError(f"{xml_path} has {len(old_elements)} pages but its manifest lists {len(previous)}; "
+                         f"re-annotate it without incremental to replace it")
+
+    reusable = {}
+    for entry, element in zip(previous, old_elements):
+        reusable.setdefault(entry["sha256"], []).append(element)
+    elements = [reusable[entry["sha256"]].pop(0) if reusable.get(entry["sha256"]) else None for entry in pages]
+    changed = [i for i, element in enumerate(elements) if element is None]
+
+    if changed:
+        images = load_images([paths[i] for i in changed])
+        if len(images) != len(changed):
+            raise ValueError(f"Could not read every changed page of {os.path.dirname(paths[0])}")
+        detected = [Page(page_index=i + 1, page_type=PageType.SINGLE, page_image=image)
+                    for i, image in zip(changed, images)]
+        reader.detect_pages(detected)
+        # The new pages were clustered on their own, so their character labels start again at 0;
+        # move them past every Named_Entity_Id on the kept pages so no two characters share an id.
+        offset = 1 + max(kept_entity_ids(element for element in elements if element is not None), default=-1)
+        for i, page in zip(changed, detected):
+            for panel in page.panels:
+                for entity in panel.entities:
+                    entity.named_entity_id = int(entity.named_entity_id) + offset
+            elements[i] = page.to_xml()
+
+    for i, element in enumerate(elements):
+        element.find("Index").text = str(i + 1)
+
+    data = eT.tostring(splice_pages(root, elements), encoding="utf-8")
+    _write_atomic(xml_path, lambda f: f.write(data))
+    write_manifest(xml_path, pages)
+    return len(changed)
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _create_reader(batch_size, cache_dir):
+    from Models import registry
+    from src.Components.comic_reader import ComicReader
+    from src.Utils.detection_cache import DetectionCache
+
+    model = registry.get_model()
+    cache = DetectionCache(cache_dir, model.model_id) if cache_dir is not None else None
+    return ComicReader(model=model, batch_size=batch_size, cache=cache)
+
+
+def _worker_main(task_queue, result_queue, batch_size, cache_dir, max_memory_mb, incremental):
+    reader = _create_reader(batch_size, cache_dir)
+    pid = os.getpid()
+
+    while True:
+        result_queue.put(("ready", pid, None, None))
+        task = task_queue.get()
+        if task is None:
+            break
+
+        name, dir_path, xml_path = task
+        result_queue.put(("started", pid, name, None))
+        start = time.perf_counter()
+        try:
+            pages = annotate_comic(reader, dir_path, xml_path, incremental)
+            result_queue.put(("done", pid, name, (pages, time.perf_counter() - start)))
+        except Exception as e:
+            result_queue.put(("failed", pid, name, repr(e)))
+
+        if max_memory_mb is not None and current_rss_mb() > max_memory_mb:
+            result_queue.put(("recycle", pid, None, current_rss_mb()))
+            break
+
+
+class CorpusSummary:
+    def __init__(self, total):
+        self.total = total
+        self.annotated = []
+        self.skipped = []
+        self.failed = []
+        self.pages = 0
+        self.worker_restarts = 0
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+        return self
+
+    def as_dict(self):
+        return {
+            "comics": self.total,
+            "annotated": len(self.annotated),
+            "skipped": len(self.skipped),
+            "failed": self.failed,
+            "pages": self.pages,
+            "seconds": self.seconds,
+            "pages_per_sec": self.pages / self.seconds if self.seconds else 0.0,
+            "comics_per_sec": len(self.annotated) / self.seconds if self.seconds else 0.0,
+            "worker_restarts": self.worker_restarts
+        }
+
+    def __str__(self):
+        stats = self.as_dict()
+        lines = [
+            f"Comics: {stats['comics']} (annotated {stats['annotated']}, skipped {stats['skipped']}, "
+            f"failed {len(stats['failed'])})",
+            f"Pages: {stats['pages']} in {stats['seconds']:.1f}s ({stats['pages_per_sec']:.2f} pages/sec, "
+            f"{stats['comics_per_sec']:.3f} comics/sec)",
+            f"Worker restarts: {stats['worker_restarts']}"
+        ]
+        lines += [f"  failed {name}: {error}" for name, error in stats['failed']]
+        return "\n".join(lines)
+
+
+def annotate_corpus(comic_dir=DEFAULT_COMIC_DIR, workers=1, batch_size=None, cache_dir=None,
+                    max_memory_mb=None, force=False, incremental=False):
+    """Annotates every comic folder in comic_dir and writes <name>.xml next to it.
+
+    Comics whose XML is already newer than their pages are skipped unless force is set, so an
+    interrupted run can simply be restarted. With more than one worker every process loads the
+    model once and is handed one whole comic at a time; a worker whose resident memory exceeds
+    max_memory_mb after a comic is replaced by a fresh one. With incremental set only the added or
+    changed pages of a comic are detected (see annotate_comic), and pages counts those.
+    """
+    from src.Components.comic_reader import DEFAULT_BATCH_SIZE
+
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    comics = find_comics(comic_dir)
+    summary = CorpusSummary(len(comics))
+
+    pending = []
+    for comic in comics:
+        name, dir_path, xml_path = comic
+        if not force and is_up_to_date(dir_path, xml_path):
+            summary.skipped.append(name)
+        else:
+            pending.append(comic)
+
+    if not pending:
+        return summary.finish()
+
+    if workers <= 1:
+        reader = _create_reader(batch_size, cache_dir)
+        for name, dir_path, xml_path in pending:
+            try:
+                summary.pages += annotate_comic(reader, dir_path, xml_path, incremental)
+                summary.annotated.append(name)
+            except Exception as e:
+                summary.failed.append((name, repr(e)))
+        return summary.finish()
+
+    _run_workers(pending, min(workers, len(pending)), batch_size, cache_dir, max_memory_mb, incremental, summary)
+    return summary.finish()
+
+
+def _run_workers(pending, workers, batch_size, cache_dir, max_memory_mb, incremental, summary):
+    # Every worker has its own task queue and asks for one comic at a time, so the parent always
+    # knows which comic a worker holds, even if it dies before its "started" message arrives.
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+
+    def spawn():
+        task_queue = context.Queue()
+        process = context.Process(target=_worker_main,
+                                  args=(task_queue, result_queue, batch_size, cache_dir, max_memory_mb,
+                                        incremental),
+                                  daemon=True)
+        process.start()
+        processes[process.pid] = (process, task_queue)
+
+    def dispatch():
+        while waiting and idle:
+            pid = idle.pop()
+            assigned[pid] = waiting.popleft()
+            processes[pid][1].put(assigned[pid])
+
+    processes = {}
+    for _ in range(workers):
+        spawn()
+
+    waiting = collections.deque(pending)
+    idle = set()
+    assigned = {}
+    in_flight = {}
+    remaining = len(pending)
+    idle_crashes = 0
+
+    while remaining > 0:
+        try:
+            kind, pid, name, payload = result_queue.get(timeout=1.0)
+        except queue.Empty:
+            for pid, (process, _) in list(processes.items()):
+                if process.is_alive():
+                    continue
+                del processes[pid]
+                idle.discard(pid)
+                task = assigned.pop(pid, None)
+                if pid in in_flight:
+                    name = in_flight.pop(pid)
+                    summary.failed.append((name, f"worker exited with code {process.exitcode}"))
+                    remaining -= 1
+                else:
+                    if task is not None:
+                        # Taken but never started: give it to another worker.
+                        waiting.appendleft(task)
+                    idle_crashes += 1
+                if remaining > len(in_flight):
+                    summary.worker_restarts += 1
+                    spawn()
+
+            if idle_crashes >= 2 * workers:
+                while waiting:
+                    name, _, _ = waiting.popleft()
+                    summary.failed.append((name, "workers keep exiting before starting it"))
+                    remaining -= 1
+            dispatch()
+            continue
+
+        if pid not in processes:
+            continue
+        if kind == "ready":
+            idle.add(pid)
+            dispatch()
+        elif kind == "started":
+            in_flight[pid] = name
+        elif kind == "done":
+            assigned.pop(pid, None)
+            in_flight.pop(pid, None)
+            pages, _ = payload
+            summary.pages += pages
+            summary.annotated.append(name)
+            remaining -= 1
+        elif kind == "failed":
+            assigned.pop(pid, None)
+            in_flight.pop(pid, None)
+            summary.failed.append((name, payload))
+            remaining -= 1
+        elif kind == "recycle":
+            process, _ = processes.pop(pid)
+            process.join()
+            if remaining > len(in_flight):
+                summary.worker_restarts += 1
+                spawn()
+
+    for _, task_queue in processes.values():
+        task_queue.put(None)
+    for process, _ in processes.values():
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate every comic folder with the Magi model.")
+    parser.add_argument("comic_dir", nargs="?", default=DEFAULT_COMIC_DIR)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--max-memory-mb", type=float, default=None)
+    parser.add_argument("--force", action="store_true", help="re-annotate comics whose XML is up to date")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only detect added or changed pages and keep the rest of the existing XML")
+    args = parser.parse_args()
+
+    summary = annotate_corpus(args.comic_dir, workers=args.workers, batch_size=args.batch_size,
+                              cache_dir=args.cache_dir, max_memory_mb=args.max_memory_mb, force=args.force,
+                              incremental=args.incremental)
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,392 @@
+import time
+
 import cv2
 import numpy as np
 
+from src.Utils import box_association as ba
+
 THICKNESS = 2
+PANEL_COLOR = (255, 0, 0)
+SPEECH_BUBBLE_COLOR = (0, 0, 255)
+ADAPTIVE_BLOCK_SIZE = 15
+
+# Parameter set shared by the API, the batch endpoint and the benchmarks, with its defaults.
+DETECTION_PARAMS = {
+    "threshold": 200,
+    "blur": 5,
+    "morph": 5,
+    "min_size": 50,
+    "bubble_thresh": 220,
+    "bubble_min_area": 0.005,
+    "bubble_max_area": 0.05,
+    "min_circularity": 0.4,
+    "use_adaptive": False,
+    "working_size": 0,
+    "refine": False
+}
+# Parameters each detector depends on; results can be reused while these stay the same.
+PANEL_PARAMS = ("blur", "threshold", "morph", "min_size", "working_size", "refine")
+BUBBLE_PARAMS = ("bubble_thresh", "bubble_min_area", "bubble_max_area", "min_circularity", "use_adaptive",
+                 "working_size", "refine")
+REFINE_MIN_IOU = 0.5
+
+
+def _to_gray(image, gray):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if gray is None else gray
+
+
+def _odd(value):
+    value = max(1, int(round(value)))
+    return value if value % 2 else value + 1
+
+
+def _working_image(gray, working_size):
+    """Downscales gray so its longest side is at most working_size.
+
+    Returns (image, scale_x, scale_y); the scales are 1 when no downscaling is needed.
+    """
+    height, width = gray.shape[:2]
+    if not working_size or max(height, width) <= working_size:
+        return gray, 1.0, 1.0
+    factor = working_size / max(height, width)
+    size = (max(1, round(width * factor)), max(1, round(height * factor)))
+    small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return small, size[0] / width, size[1] / height
+
+
+def _to_full_resolution(cnt, scale_x, scale_y):
+    if scale_x == 1.0 and scale_y == 1.0:
+        return cnt
+    return np.round(cnt / (scale_x, scale_y)).astype(np.int32)
+
 
-def detect_panels(image, blur_kernel=5, thresh_val=200, morph_kernel=5, min_size=50):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def _refine(cnt, gray, binarize, margin, mode):
+    """Re-extracts a coarse contour at full resolution inside its bounding box grown by margin.
+
+    The contour whose bounding box best overlaps the coarse one replaces it; if none overlaps by at
+    least REFINE_MIN_IOU the coarse contour is kept.
+    """
+    height, width = gray.shape[:2]
+    x, y, w, h = cv2.boundingRect(cnt)
+    x1, y1 = max(0, x - margin), max(0, y - margin)
+    x2, y2 = min(width, x + w + margin), min(height, y + h + margin)
+
+    contours, _ = cv2.findContours(binarize(gray[y1:y2, x1:x2]), mode, cv2.CHAIN_APPROX_SIMPLE, offset=(x1, y1))
+    if not contours:
+        return cnt
+
+    rects = np.array([cv2.boundingRect(c) for c in contours], dtype=np.float64)
+    rects[:, 2:] += rects[:, :2]
+    ious = ba.iou_matrix(np.array([[x, y, x + w, y + h]], dtype=np.float64), rects)[0]
+    best = int(np.argmax(ious))
+    return contours[best] if ious[best] >= REFINE_MIN_IOU else cnt
+
+
+def _panel_mask(gray, blur_kernel, thresh_val, morph_kernel):
     blur = cv2.GaussianBlur(gray, (blur_kernel, blur_kernel), 0)
     _, thresh = cv2.threshold(blur, thresh_val, 255, cv2.THRESH_BINARY_INV)
     kernel = np.ones((morph_kernel, morph_kernel), np.uint8)
-    closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+    return cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+
+
+def _bubble_mask(gray, bubble_thresh, use_adaptive, block_size=ADAPTIVE_BLOCK_SIZE):
+    if use_adaptive:
+        bin_img = cv2.adaptiveThreshold(
+            gray, 255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY,
+            max(3, block_size), 2
+        )
+    else:
+        _, bin_img = cv2.threshold(gray, bubble_thresh, 255, cv2.THRESH_BINARY)
+    return cv2.bitwise_not(bin_img)
+
+
+def _box(cnt, area=None, perimeter=None, include_contour=False):
+    x, y, w, h = cv2.boundingRect(cnt)
+    area = cv2.contourArea(cnt) if area is None else area
+    perimeter = cv2.arcLength(cnt, True) if perimeter is None else perimeter
+    box = {
+        'x': int(x),
+        'y': int(y),
+        'width': int(w),
+        'height': int(h),
+        'area': float(area),
+        'perimeter': float(perimeter),
+        'circularity': float(4 * np.pi * area / (perimeter ** 2)) if perimeter > 0 else 0.0,
+        'vertices': int(len(cnt))
+    }
+    if include_contour:
+        box['contour'] = cnt.reshape(-1, 2).tolist()
+    return box
+
+
+class Stage:
+    """One step of the detection graph: function(params, *inputs) with params restricted to the listed names.
+
+    A stage's result only depends on its own params and its inputs' results, which is what makes
+    it safe to reuse under that key.
+    """
+
+    def __init__(self, name, inputs, params, function):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.params = tuple(params)
+        self.function = function
+
+
+def _scale(working):
+    _, scale_x, scale_y = working
+    return min(scale_x, scale_y)
+
+
+def _stage_working(params, gray):
+    return _working_image(gray, params["working_size"])
+
+
+def _stage_panel_blur(params, working):
+    kernel = _odd(params["blur"] * _scale(working))
+    return cv2.GaussianBlur(working[0], (kernel, kernel), 0)
+
+
+def _stage_panel_threshold(params, blur):
+    return cv2.threshold(blur, params["threshold"], 255, cv2.THRESH_BINARY_INV)[1]
+
+
+def _stage_panel_closed(params, thresh, working):
+    size = max(1, round(params["morph"] * _scale(working)))
+    return cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, np.ones((size, size), np.uint8))
+
+
+def _stage_panel_contours(params, closed, working):
+    """Panel contours at full resolution with their (N, 4) x, y, width, height bounding rects."""
     contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    for cnt in contours:
-        x, y, w, h = cv2.boundingRect(cnt)
-        if w > min_size and h > min_size:
-            cv2.rectangle(image, (x, y), (x + w, y + h), (255, 0, 0), THICKNESS)
-    return image
+    contours = [_to_full_resolution(cnt, working[1], working[2]) for cnt in contours]
+    rects = np.array([cv2.boundingRect(cnt) for cnt in contours], dtype=np.int64).reshape(-1, 4)
+    return contours, rects
 
 
+def _stage_panels(params, panel_contours, gray, working):
+    """Panels as (contour, area, perimeter) shapes; area and perimeter are left to _box."""
+    contours, rects = panel_contours
+    keep = np.flatnonzero((rects[:, 2] > params["min_size"]) & (rects[:, 3] > params["min_size"]))
+    scale = _scale(working)
+    if not (params["refine"] and scale < 1.0):
+        return [(contours[i], None, None) for i in keep]
 
+    blur, thresh_val, morph = params["blur"], params["threshold"], params["morph"]
+    margin = int(np.ceil(2 / scale)) + max(blur, morph)
 
-def detect_speech_bubbles(
+    def binarize(window):
+        return _panel_mask(window, blur, thresh_val, morph)
+
+    return [(_refine(contours[i], gray, binarize, margin, cv2.RETR_EXTERNAL), None, None) for i in keep]
+
+
+def _stage_bubble_binary(params, working):
+    block_size = _odd(ADAPTIVE_BLOCK_SIZE * _scale(working))
+    return _bubble_mask(working[0], params["bubble_thresh"], params["use_adaptive"], block_size)
+
+
+def _stage_bubble_contours(params, binary, working):
+    """All bubble contour candidates at working resolution with their areas at full resolution."""
+    contours, _ = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    _, scale_x, scale_y = working
+    areas = np.array([cv2.contourArea(cnt) for cnt in contours], dtype=np.float64) / (scale_x * scale_y)
+    return contours, areas
+
+
+def _stage_bubble_candidates(params, bubble_contours, gray, working):
+    """Contours within the area limits as (contour, area, perimeter, circularity) at full resolution."""
+    contours, areas = bubble_contours
+    height, width = gray.shape[:2]
+    min_area = (width * height) * params["bubble_min_area"]
+    max_area = (width * height) * params["bubble_max_area"]
+
+    _, scale_x, scale_y = working
+    refine = params["refine"] and _scale(working) < 1.0
+    margin = int(np.ceil(2 / _scale(working)))
+    bubble_thresh, use_adaptive = params["bubble_thresh"], params["use_adaptive"]
+
+    def binarize(window):
+        return _bubble_mask(window, bubble_thresh, use_adaptive)
+
+    candidates = []
+    for i in np.flatnonzero((areas > min_area) & (areas < max_area)):
+        cnt = _to_full_resolution(contours[i], scale_x, scale_y)
+        area = areas[i]
+        if refine:
+            cnt = _refine(cnt, gray, binarize, margin, cv2.RETR_TREE)
+            area = cv2.contourArea(cnt)
+        perimeter = cv2.arcLength(cnt, True)
+        if perimeter == 0:
+            continue
+        candidates.append((cnt, area, perimeter, 4 * np.pi * area / (perimeter ** 2)))
+    return candidates
+
+
+def _stage_speech_bubbles(params, candidates):
+    return [(cnt, area, perimeter) for cnt, area, perimeter, circularity in candidates
+            if circularity >= params["min_circularity"]]
+
+
+# Detection as a graph of stages. gray is the input; panels and speech_bubbles are the outputs,
+# lists of (contour, area, perimeter) shapes at full resolution.
+STAGES = {stage.name: stage for stage in (
+    Stage("working", ["gray"], ["working_size"], _stage_working),
+    Stage("panel_blur", ["working"], ["blur"], _stage_panel_blur),
+    Stage("panel_threshold", ["panel_blur"], ["threshold"], _stage_panel_threshold),
+    Stage("panel_closed", ["panel_threshold", "working"], ["morph"], _stage_panel_closed),
+    Stage("panel_contours", ["panel_closed", "working"], [], _stage_panel_contours),
+    Stage("panels", ["panel_contours", "gray", "working"], ["min_size", "refine", "blur", "threshold", "morph"],
+          _stage_panels),
+    Stage("bubble_binary", ["working"], ["bubble_thresh", "use_adaptive"], _stage_bubble_binary),
+    Stage("bubble_contours", ["bubble_binary", "working"], [], _stage_bubble_contours),
+    Stage("bubble_candidates", ["bubble_contours", "gray", "working"],
+          ["bubble_min_area", "bubble_max_area", "refine", "bubble_thresh", "use_adaptive"], _stage_bubble_candidates),
+    Stage("speech_bubbles", ["bubble_candidates"], ["min_circularity"], _stage_speech_bubbles)
+)}
+
+
+def stage_key(name, params, keys=None):
+    """Cache key of stage name: its own parameter values plus the keys of its inputs, recursively."""
+    if name == "gray":
+        return ()
+    if keys is not None and name in keys:
+        return keys[name]
+    stage = STAGES[name]
+    key = (name, tuple(params[param] for param in stage.params),
+           tuple(stage_key(input_name, params, keys) for input_name in stage.inputs))
+    if keys is not None:
+        keys[name] = key
+    return key
+
+
+def run_stages(targets, gray, params, cache=None, image_key=None, timings=None):
+    """Evaluates the target stages for one page and returns {target: result}.
+
+    Stages are only computed when needed. With a cache (anything with get and put, e.g. a
+    ByteLRUCache) results are looked up and stored under (image_key, stage_key); image_key must
+    identify the page contents. timings, if given, receives the seconds of every computed stage
+    and None for every stage served from the cache. Results may be shared, so never modify them.
+    """
+    params = {**DETECTION_PARAMS, **params}
+    values = {"gray": gray}
+    keys = {}
+
+    def evaluate(name):
+        if name in values:
+            return values[name]
+        stage = STAGES[name]
+        key = (image_key, stage_key(name, params, keys)) if cache is not None else None
+        value = cache.get(key) if cache is not None else None
+        if value is not None:
+            if timings is not None:
+                timings[name] = None
+        else:
+            inputs = [evaluate(input_name) for input_name in stage.inputs]
+            start = time.perf_counter()
+            value = stage.function({param: params[param] for param in stage.params}, *inputs)
+            if timings is not None:
+                timings[name] = time.perf_counter() - start
+            if cache is not None:
+                cache.put(key, value)
+        values[name] = value
+        return value
+
+    return {target: evaluate(target) for target in targets}
+
+
+def shapes_to_boxes(shapes, include_contours=False):
+    return [_box(cnt, area, perimeter, include_contour=include_contours) for cnt, area, perimeter in shapes]
+
+
+def find_panels(image, blur_kernel=5, thresh_val=200, morph_kernel=5, min_size=50, gray=None,
+                include_contours=False, working_size=None, refine=False):
+    """Returns the panel boxes as dicts with x, y, width, height and contour metadata.
+
+    With working_size set, detection runs on a copy whose longest side is working_size pixels,
+    with the kernels scaled to match, and the boxes are mapped back to full resolution. refine
+    then re-extracts each box at full resolution in a small window around it.
+    """
+    params = {"blur": blur_kernel, "threshold": thresh_val, "morph": morph_kernel, "min_size": min_size,
+              "working_size": working_size, "refine": refine}
+    shapes = run_stages(["panels"], _to_gray(image, gray), params)["panels"]
+    return shapes_to_boxes(shapes, include_contours)
+
+
+def find_speech_bubbles(
     image,
     bubble_thresh=220,
     min_area_ratio=0.005,
     max_area_ratio=0.05,
-        min_circularity = 0.4,
-    use_adaptive=False
+    min_circularity=0.4,
+    use_adaptive=False,
+    gray=None,
+    include_contours=False,
+    working_size=None,
+    refine=False
 ):
-    height, width = image.shape[:2]
-    min_area = (width * height) * min_area_ratio
-    max_area = (width * height) * max_area_ratio
+    """Returns the speech bubble boxes as dicts with x, y, width, height, area, circularity and contour metadata.
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    working_size and refine work as in find_panels; the area limits are ratios of the page area
+    and therefore hold at any resolution.
+    """
+    params = {"bubble_thresh": bubble_thresh, "bubble_min_area": min_area_ratio, "bubble_max_area": max_area_ratio,
+              "min_circularity": min_circularity, "use_adaptive": use_adaptive, "working_size": working_size,
+              "refine": refine}
+    shapes = run_stages(["speech_bubbles"], _to_gray(image, gray), params)["speech_bubbles"]
+    return shapes_to_boxes(shapes, include_contours)
 
-    if use_adaptive:
-        bin_img = cv2.adaptiveThreshold(
-            gray, 255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY,
-            15, 2
-        )
-        bin_img = cv2.bitwise_not(bin_img)
-    else:
-        _, bin_img = cv2.threshold(gray, bubble_thresh, 255, cv2.THRESH_BINARY)
-        bin_img = cv2.bitwise_not(bin_img)
 
-    contours, hierarchy = cv2.findContours(bin_img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+def detect_boxes(image, gray, params, include_contours=False, panels=True, bubbles=True):
+    """Runs the detectors with a DETECTION_PARAMS style dict and returns (panels, speech_bubbles).
+
+    Missing parameters take their defaults; a detector switched off returns None in its slot.
+    """
+    params = {**DETECTION_PARAMS, **params}
+    panel_boxes = bubble_boxes = None
+    if panels:
+        panel_boxes = find_panels(image, params["blur"], params["threshold"], params["morph"], params["min_size"],
+                                  gray=gray, include_contours=include_contours,
+                                  working_size=params["working_size"], refine=params["refine"])
+    if bubbles:
+        bubble_boxes = find_speech_bubbles(
+            image,
+            bubble_thresh=params["bubble_thresh"],
+            min_area_ratio=params["bubble_min_area"],
+            max_area_ratio=params["bubble_max_area"],
+            use_adaptive=params["use_adaptive"],
+            min_circularity=params["min_circularity"],
+            gray=gray,
+            include_contours=include_contours,
+            working_size=params["working_size"],
+            refine=params["refine"]
+        )
+    return panel_boxes, bubble_boxes
 
-    for i, cnt in enumerate(contours):
-        area = cv2.contourArea(cnt)
-        if min_area < area < max_area:
-            perimeter = cv2.arcLength(cnt, True)
-            if perimeter == 0:
-                continue
-            circularity = 4 * np.pi * area / (perimeter ** 2)
-            if circularity >= min_circularity:
-                x, y, w, h = cv2.boundingRect(cnt)
-                cv2.rectangle(image, (x, y), (x + w, y + h), (0, 0, 255), THICKNESS)
 
+def draw_boxes(image, boxes, color, thickness=THICKNESS):
+    for box in boxes:
+        x, y, w, h = box['x'], box['y'], box['width'], box['height']
+        cv2.rectangle(image, (x, y), (x + w, y + h), color, thickness)
     return image
 
+
+def detect_panels(image, blur_kernel=5, thresh_val=200, morph_kernel=5, min_size=50, gray=None):
+    return draw_boxes(image, find_panels(image, blur_kernel, thresh_val, morph_kernel, min_size, gray=gray),
+                      PANEL_COLOR)
+
+
+def detect_speech_bubbles(
+    image,
+    bubble_thresh=220,
+    min_area_ratio=0.005,
+    max_area_ratio=0.05,
+        min_circularity = 0.4,
+    use_adaptive=False,
+    gray=None
+):
+    bubbles = find_speech_bubbles(image, bubble_thresh, min_area_ratio, max_area_ratio, min_circularity,
+                                  use_adaptive, gray=gray)
+    return draw_boxes(image, bubbles, SPEECH_BUBBLE_COLOR)
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+
+from src.Components.cv_panel import run_stages, shapes_to_boxes
+from src.Utils.lru_cache import ByteLRUCache
+
+DEFAULT_MAX_BYTES = int(os.environ.get("PIPELINE_CACHE_BYTES", 256 * 1024 ** 2))
+
+
+def _sizeof(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(_sizeof(item) for item in value)
+    return 64
+
+
+class DetectionPipeline:
+    """cv_panel's stage graph with every stage result memoized under one shared byte budget.
+
+    A stage is keyed by the page identity plus only the parameters it and its inputs depend on,
+    so moving min_size just re-filters the cached panel contours and changing min_circularity
+    reuses the bubble candidates. Stage results are shared between callers and must not be
+    modified.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self._cache = ByteLRUCache(max_bytes, sizeof=_sizeof)
+
+    def run(self, image_key, gray, params, panels=True, bubbles=True, include_contours=False):
+        """Returns (panels, speech_bubbles, timings) for the page identified by image_key.
+
+        The boxes are dicts as from find_panels/find_speech_bubbles, None for a detector switched
+        off. timings maps every stage that was needed to its seconds, or None if it came from the
+        cache.
+        """
+        targets = (["panels"] if panels else []) + (["speech_bubbles"] if bubbles else [])
+        timings = {}
+        results = run_stages(targets, gray, params, cache=self._cache, image_key=image_key, timings=timings)
+        panel_boxes = shapes_to_boxes(results["panels"], include_contours) if panels else None
+        bubble_boxes = shapes_to_boxes(results["speech_bubbles"], include_contours) if bubbles else None
+        return panel_boxes, bubble_boxes, timings
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,65 @@
+import os
+import time
+
+import cv2
+
+from src.Utils.lru_cache import ByteLRUCache
+
+DEFAULT_MAX_BYTES = int(os.environ.get("PAGE_CACHE_BYTES", 512 * 1024 ** 2))
+
+
+def _entry_size(entry):
+    _, image, gray = entry
+    return image.nbytes + (gray.nbytes if gray is not None else 0)
+
+
+class PageImageCache:
+    """Process-wide LRU of decoded page images (and their grayscale versions) keyed by path.
+
+    An entry is only reused while the file's mtime and size are unchanged. The arrays are shared
+    between requests and therefore read-only; callers that draw on a page must copy it first.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self._cache = ByteLRUCache(max_bytes, sizeof=_entry_size)
+
+    @staticmethod
+    def _signature(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, path, gray=False):
+        """Returns (image, gray_or_None, decode_seconds); decode_seconds is 0 for a cache hit.
+
+        Returns (None, None, seconds) if the file cannot be decoded.
+        """
+        signature = self._signature(path)
+        entry = self._cache.get(path)
+        decode_seconds = 0.0
+
+        if entry is None or entry[0] != signature:
+            start = time.perf_counter()
+            image = cv2.imread(path)
+            decode_seconds = time.perf_counter() - start
+            if image is None:
+                self._cache.pop(path)
+                return None, None, decode_seconds
+            image.flags.writeable = False
+            entry = (signature, image, None)
+            self._cache.put(path, entry)
+
+        if gray and entry[2] is None:
+            start = time.perf_counter()
+            gray_image = cv2.cvtColor(entry[1], cv2.COLOR_BGR2GRAY)
+            gray_image.flags.writeable = False
+            decode_seconds += time.perf_counter() - start
+            entry = (entry[0], entry[1], gray_image)
+            self._cache.put(path, entry)
+
+        return entry[1], (entry[2] if gray else None), decode_seconds
+
+    def stats(self):
+        return self._cache.stats()
+
+    def clear(self):
+        self._cache.clear()
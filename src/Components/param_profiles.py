@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import threading
+
+from src.Components.cv_panel import DETECTION_PARAMS
+from src.Utils.io_utils import match_file_mode
+
+DEFAULT_PROFILE_PATH = os.environ.get("PARAM_PROFILES", os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Data", "param_profiles.json")))
+DEFAULT_PROFILE = "default"
+
+
+def read_profiles(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("profiles", {})
+
+
+def save_profile(path, name, params, comics=(), **metadata):
+    """Adds or replaces profile name in the profiles file at path, atomically.
+
+    params are stored as given on top of DETECTION_PARAMS, comics lists the comic folders the
+    profile applies to (a publisher profile simply lists several), and metadata such as the score
+    is stored alongside.
+    """
+    profiles = read_profiles(path)
+    profiles[name] = {"params": {**DETECTION_PARAMS, **params}, "comics": sorted(comics), **metadata}
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".json.tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"profiles": profiles}, f, indent=2, sort_keys=True)
+        match_file_mode(temp_path, path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return profiles[name]
+
+
+class ParameterProfiles:
+    """Tuned detection defaults per comic, read from the file written by param_tuner.
+
+    A comic uses the profile that lists it, otherwise the profile named default, otherwise
+    DETECTION_PARAMS. The file is re-read whenever its mtime changes, so a finished tuning run
+    takes effect without restarting the backend.
+    """
+
+    def __init__(self, path: str = DEFAULT_PROFILE_PATH):
+        self.path = path
+        self._mtime = None
+        self._profiles = {}
+        self._by_comic = {}
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            try:
+                profiles = read_profiles(self.path)
+            except (OSError, ValueError) as e:
+                print(f"Could not read parameter profiles {self.path}: {e}")
+                return
+            self._profiles = profiles
+            self._by_comic = {comic: name for name, profile in profiles.items() for comic in profile.get("comics", ())}
+            self._mtime = mtime
+
+    def get(self, comic):
+        """Returns (profile name or None, full parameter dict) for comic."""
+        self._reload()
+        name = self._by_comic.get(comic)
+        if name is None and DEFAULT_PROFILE in self._profiles:
+            name = DEFAULT_PROFILE
+        if name is None:
+            return None, dict(DETECTION_PARAMS)
+        params = self._profiles[name].get("params", {})
+        return name, {key: params.get(key, default) for key, default in DETECTION_PARAMS.items()}
+
+    def names(self):
+        self._reload()
+        return sorted(self._profiles)
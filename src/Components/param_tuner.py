@@ -0,0 +1,326 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from src.Components.cv_panel import BUBBLE_PARAMS, DETECTION_PARAMS, PANEL_PARAMS
+from src.Components.param_profiles import DEFAULT_PROFILE_PATH, save_profile
+from src.Utils import evaluation
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Data"))
+DEFAULT_WORKERS = os.cpu_count() or 2
+STAGE_CACHE_ENTRIES = int(os.environ.get("TUNER_STAGE_CACHE_ENTRIES", 200_000))
+
+# Candidate values per parameter; grid search takes their product, random search samples from them.
+SEARCH_SPACE = {
+    "threshold": [160, 180, 200, 220, 240],
+    "blur": [3, 5, 7, 9],
+    "morph": [3, 5, 7, 9],
+    "min_size": [30, 50, 80, 120],
+    "bubble_thresh": [180, 200, 220, 235],
+    "bubble_min_area": [0.001, 0.002, 0.005],
+    "bubble_max_area": [0.03, 0.05, 0.1],
+    "min_circularity": [0.3, 0.4, 0.5, 0.6],
+    "use_adaptive": [False, True]
+}
+
+# Each label only depends on its detector's parameters, so its page scores are cached under those alone.
+# The third field is the slot of the label's boxes in detect_boxes' result.
+STAGES = ((evaluation.CLASSICAL_LABELS["panels"], PANEL_PARAMS, 0),
+          (evaluation.CLASSICAL_LABELS["speech_bubbles"], BUBBLE_PARAMS, 1))
+LABELS = [label for label, _, _ in STAGES]
+
+
+def load_pages(ground_truth, images_dir=None, comics=None, limit=None):
+    """Ground truth pages from a CVAT export or from one of our per-comic annotation XMLs.
+
+    Returns (pages, missing) with the page dicts of src.Utils.evaluation; comics restricts a CVAT
+    export to those folders.
+    """
+    with open(ground_truth, "rb") as f:
+        head = f.read(512)
+    if b"<annotations" in head:
+        pages, missing = evaluation.load_ground_truth(ground_truth, images_dir or os.path.join(DATA_DIR, "comics"),
+                                                      labels=LABELS)
+        if comics:
+            pages = [page for page in pages if comic_of(page) in comics]
+    else:
+        pages, missing = evaluation.load_annotation_ground_truth(ground_truth, images_dir)
+    return (pages[:limit] if limit else pages), missing
+
+
+def comic_of(page):
+    return page["name"].split("/")[0]
+
+
+def tunable_stages(pages):
+    """The STAGES whose label has at least one ground truth box on pages; the others would score a constant."""
+    return tuple(stage for stage in STAGES if any(len(page["boxes"].get(stage[0], ())) for page in pages))
+
+
+def _evaluate_shard(pages, grays, cache, pipeline, params, page_count, thresholds, stages):
+    import cv2
+
+    from src.Utils import box_association as ba
+
+    score = evaluation.DetectionScore([label for label, _, _ in stages], thresholds)
+    for i, page in enumerate(pages[:page_count]):
+        gray = grays.get(i)
+        for label, names, slot in stages:
+            key = (i, label, tuple(params[name] for name in names))
+            counts = cache.get(key)
+            if counts is None:
+                if gray is None:
+                    image = cv2.imread(page["path"])
+                    gray = grays[i] = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                boxes = pipeline.run(i, gray, params, panels=slot == 0, bubbles=slot == 1)[slot]
+                counts = cache[key] = evaluation.match_counts(ba.boxes_to_array(boxes), page["boxes"][label],
+                                                              thresholds)
+                if len(cache) > STAGE_CACHE_ENTRIES:
+                    # Drop the oldest entry; dicts keep insertion order.
+                    cache.pop(next(iter(cache)))
+            score.add_counts(label, counts)
+        score.pages += 1
+    return score
+
+
+def _worker_main(pages, thresholds, stages, task_queue, result_queue):
+    from src.Components.detection_pipeline import DetectionPipeline
+
+    # Every worker owns a fixed shard of pages, so its grayscale pages, page scores and detection stages
+    # stay valid across all trials it is sent.
+    grays = {}
+    cache = {}
+    pipeline = DetectionPipeline()
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        trial_id, params, page_fraction = task
+        page_count = math.ceil(len(pages) * page_fraction)
+        try:
+            score = _evaluate_shard(pages, grays, cache, pipeline, params, page_count, thresholds, stages)
+            result_queue.put((trial_id, score))
+        except Exception as e:
+            result_queue.put((trial_id, e))
+
+
+class ParameterTuner:
+    """Scores cv_panel parameter sets against ground truth pages on a pool of worker processes.
+
+    The pages are shuffled and split into one shard per worker; a trial is sent to every shard and
+    the per-shard counts are merged. Inside a worker the grayscale pages are decoded once, each
+    detector's page scores are cached under that detector's parameters, and detection goes through
+    a DetectionPipeline, so a trial only recomputes the stages whose parameters changed. Only
+    stages is scored (default: the tunable_stages of pages).
+    """
+
+    def __init__(self, pages, workers=DEFAULT_WORKERS, thresholds=(0.5,), seed=0, stages=None):
+        if not pages:
+            raise ValueError("No ground truth pages to tune on")
+        self.stages = tuple(stages) if stages is not None else tunable_stages(pages)
+        if not self.stages:
+            raise ValueError(f"The ground truth pages have no {' or '.join(LABELS)} boxes to tune against")
+        pages = list(pages)
+        np.random.default_rng(seed).shuffle(pages)
+        self.pages = pages
+        self.thresholds = list(thresholds)
+        self.trials = 0
+        workers = max(1, min(workers, len(pages)))
+
+        context = multiprocessing.get_context("spawn")
+        self._result_queue = context.Queue()
+        self._task_queues = []
+        self._processes = []
+        for shard in range(workers):
+            task_queue = context.Queue()
+            process = context.Process(target=_worker_main, daemon=True,
+                                      args=(pages[shard::workers], self.thresholds, self.stages, task_queue,
+                                            self._result_queue))
+            process.start()
+            self._task_queues.append(task_queue)
+            self._processes.append(process)
+        self._next_id = 0
+
+    def evaluate(self, param_sets, page_fraction=1.0):
+        """Returns one merged DetectionScore per parameter set, scored on page_fraction of every shard."""
+        param_sets = [{**DETECTION_PARAMS, **params} for params in param_sets]
+        first_id = self._next_id
+        self._next_id += len(param_sets)
+        for offset, params in enumerate(param_sets):
+            for task_queue in self._task_queues:
+                task_queue.put((first_id + offset, params, page_fraction))
+
+        labels = [label for label, _, _ in self.stages]
+        scores = [evaluation.DetectionScore(labels, self.thresholds) for _ in param_sets]
+        for _ in range(len(param_sets) * len(self._task_queues)):
+            trial_id, result = self._next_result()
+            if isinstance(result, Exception):
+                raise result
+            scores[trial_id - first_id].merge(result)
+        self.trials += len(param_sets)
+        return scores
+
+    def _next_result(self):
+        while True:
+            try:
+                return self._result_queue.get(timeout=1)
+            except queue.Empty:
+                dead = [process.pid for process in self._processes if not process.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Tuner workers {dead} exited")
+
+    def close(self):
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _ranked(scores, param_sets):
+    order = sorted(range(len(param_sets)), key=lambda i: -scores[i].f1())
+    return [(scores[i], param_sets[i]) for i in order]
+
+
+def grid_candidates(space, max_trials=None):
+    names = list(space)
+    count = math.prod(len(space[name]) for name in names)
+    if max_trials and count > max_trials:
+        raise ValueError(f"The grid has {count} points, more than max_trials={max_trials}; narrow the space "
+                         f"or use random or halving search")
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_candidates(space, trials, seed=0):
+    rng = np.random.default_rng(seed)
+    names = list(space)
+    unique = {}
+    # Draw a few more than needed so duplicates in a small space do not shrink the sample much.
+    for _ in range(trials * 4):
+        values = tuple(space[name][rng.integers(len(space[name]))] for name in names)
+        unique.setdefault(values, dict(zip(names, values)))
+        if len(unique) == trials:
+            break
+    return list(unique.values())
+
+
+def grid_search(tuner, space, max_trials=None):
+    candidates = grid_candidates(space, max_trials)
+    return _ranked(tuner.evaluate(candidates), candidates)
+
+
+def random_search(tuner, space, trials, seed=0):
+    candidates = random_candidates(space, trials, seed)
+    return _ranked(tuner.evaluate(candidates), candidates)
+
+
+def successive_halving(tuner, space, trials, eta=3, seed=0):
+    """Scores trials random candidates on a small share of the pages, keeps the best 1/eta and grows the share
+    by eta until the survivors are scored on all pages."""
+    candidates = random_candidates(space, trials, seed)
+    rungs = max(1, int(math.log(len(candidates), eta)))
+    page_fraction = max(eta ** -rungs, 1 / len(tuner.pages))
+    while True:
+        ranked = _ranked(tuner.evaluate(candidates, page_fraction), candidates)
+        if page_fraction >= 1 or len(candidates) == 1:
+            return ranked
+        candidates = [params for _, params in ranked[:max(1, len(candidates) // eta)]]
+        page_fraction = min(1.0, page_fraction * eta)
+
+
+def tune(pages, search="halving", space=None, trials=81, workers=DEFAULT_WORKERS, eta=3, seed=0):
+    """Searches the parameter space on pages and returns (best score, best params, tuner statistics).
+
+    A stage whose label has no ground truth boxes on pages is not tuned: parameters only it uses
+    are left out of the space and keep their defaults, and stats lists its label under untuned.
+    """
+    stages = tunable_stages(pages)
+    tuned_params = {name for _, names, _ in stages for name in names}
+    space = {name: values for name, values in {**SEARCH_SPACE, **(space or {})}.items() if name in tuned_params}
+    untuned = [label for label, _, _ in STAGES if all(label != tuned for tuned, _, _ in stages)]
+    start = time.perf_counter()
+    with ParameterTuner(pages, workers=workers, seed=seed, stages=stages) as tuner:
+        if search == "grid":
+            ranked = grid_search(tuner, space, max_trials=trials)
+        elif search == "random":
+            ranked = random_search(tuner, space, trials, seed)
+        elif search == "halving":
+            ranked = successive_halving(tuner, space, trials, eta, seed)
+        else:
+            raise ValueError(f"Unknown search {search}")
+        best_score, best_params = ranked[0]
+        stats = {"search": search, "trials": tuner.trials, "pages": len(pages), "untuned": untuned,
+                 "seconds": time.perf_counter() - start}
+    return best_score, {**DETECTION_PARAMS, **best_params}, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the cv_panel detection parameters against ground truth and "
+                                                 "store the result as a parameter profile for the backend.")
+    parser.add_argument("--ground-truth", default=os.path.join(DATA_DIR, "c100-val.xml"),
+                        help="CVAT export or one of our per-comic annotation XMLs")
+    parser.add_argument("--images", default=None, help="directory the CVAT image names are relative to, "
+                                                         "or the comic folder of an annotation XML")
+    parser.add_argument("--comics", nargs="*", help="restrict a CVAT export to these comic folders")
+    parser.add_argument("--search", choices=("grid", "random", "halving"), default="halving")
+    parser.add_argument("--trials", type=int, default=81,
+                        help="candidates for random and halving search, the largest allowed grid for grid search")
+    parser.add_argument("--eta", type=int, default=3)
+    parser.add_argument("--space", default="{}", help="JSON object replacing the candidate lists of SEARCH_SPACE")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--pages", type=int, default=0, help="limit the number of pages, 0 for all")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--per-comic", action="store_true", help="tune and store one profile per comic folder")
+    parser.add_argument("--profile", default=None, help="profile name, e.g. a publisher (default: the comic name)")
+    parser.add_argument("--profiles", default=DEFAULT_PROFILE_PATH, help="profiles file the backend reads")
+    args = parser.parse_args()
+
+    space = json.loads(args.space)
+    pages, missing = load_pages(args.ground_truth, args.images, args.comics, args.pages)
+    if missing:
+        print(f"{len(missing)} ground truth pages are not on disk and were skipped")
+    if not pages:
+        print("No ground truth pages found, nothing to tune")
+        return
+
+    groups = {}
+    for page in pages:
+        groups.setdefault(comic_of(page) if args.per_comic else None, []).append(page)
+
+    for comic, group in groups.items():
+        comics = sorted({comic_of(page) for page in group})
+        name = comic or args.profile or (comics[0] if len(comics) == 1 else "default")
+        try:
+            score, params, stats = tune(group, args.search, space, args.trials, args.workers, args.eta, args.seed)
+        except ValueError as e:
+            print(f"{name}: not tuned, {e}")
+            continue
+        labels = ", ".join(f"{label} {score.f1(label):.3f}" for label in score.labels)
+        print(f"{name}: F1 {score.f1():.3f} ({labels}) after {stats['trials']} trials on {stats['pages']} pages "
+              f"in {stats['seconds']:.1f} s")
+        if stats["untuned"]:
+            print(f"  no ground truth boxes for {', '.join(stats['untuned'])}; those parameters keep their defaults")
+        print(f"  {json.dumps(params)}")
+        save_profile(args.profiles, name, params, comics, f1=score.f1(), scores=score.as_dict(),
+                     ground_truth=os.path.basename(args.ground_truth),
+                     tuned_at=datetime.now(timezone.utc).isoformat(timespec="seconds"), **stats)
+    print(f"profiles written to {args.profiles}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import io
+import os
+import tempfile
+import threading
+
+from PIL import Image
+
+# Longest side in pixels per rendition; previews are the catalog tiles, pages the reduced viewer pages.
+THUMBNAIL_TIERS = {"preview": 480, "page": 1600}
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", 80))
+DEFAULT_REFRESH_INTERVAL = float(os.environ.get("CATALOG_REFRESH_INTERVAL", 5))
+
+
+def render_thumbnail(source, longest_side, quality=THUMBNAIL_QUALITY):
+    """Returns source scaled down to fit longest_side as JPEG bytes, or None if it cannot be decoded.
+
+    For JPEG sources draft() lets the decoder skip straight to a reduced size. Images are never
+    scaled up.
+    """
+    try:
+        with Image.open(source) as image:
+            image.draft("RGB", (longest_side, longest_side))
+            image = image.convert("RGB")
+            image.thumbnail((longest_side, longest_side), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    except (OSError, Image.DecompressionBombError):
+        return None
+    return buffer.getvalue()
+
+
+class ThumbnailStore:
+    """Reduced JPEG renditions of comic pages, kept on disk in cache_dir/<tier>/<comic>/<page>.jpg.
+
+    <page> keeps its extension (001.png.jpg), so 001.png and 001.jpg get separate renditions. A
+    rendition carries the mtime of its source page, so it is regenerated as soon as the page
+    changes. Renditions are made on first request; start() additionally keeps the catalog
+    previews warm on a daemon thread whenever the catalog changes.
+    """
+
+    def __init__(self, catalog, cache_dir: str, tiers=None, quality: int = THUMBNAIL_QUALITY,
+                 refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
+        self.catalog = catalog
+        self.cache_dir = cache_dir
+        self.tiers = dict(THUMBNAIL_TIERS if tiers is None else tiers)
+        self.quality = quality
+        self.refresh_interval = refresh_interval
+        self.hits = 0
+        self.generated = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def rendition_path(self, comic, page, tier):
+        return os.path.join(self.cache_dir, tier, comic, page + ".jpg")
+
+    def get(self, comic, page, tier):
+        """Returns (path, source mtime_ns) of an up to date rendition, generating it if needed.
+
+        Returns None for an unknown tier or a page that is missing or cannot be decoded.
+        """
+        if tier not in self.tiers:
+            return None
+        source = os.path.join(self.catalog.data_dir, comic, page)
+        try:
+            source_mtime = os.stat(source).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        target = self.rendition_path(comic, page, tier)
+        try:
+            if os.stat(target).st_mtime_ns == source_mtime:
+                with self._lock:
+                    self.hits += 1
+                return target, source_mtime
+        except FileNotFoundError:
+            pass
+
+        content = render_thumbnail(source, self.tiers[tier], self.quality)
+        if content is None:
+            with self._lock:
+                self.failed += 1
+            return None
+        if source.lower().endswith((".jpg", ".jpeg")) and len(content) >= os.path.getsize(source):
+            # Pages already within the tier size would only grow by re-encoding.
+            with open(source, "rb") as f:
+                content = f.read()
+
+        # Write to a temporary file first so concurrent readers never see a partial JPEG.
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.utime(tmp_path, ns=(source_mtime, source_mtime))
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self.generated += 1
+        return target, source_mtime
+
+    def warm(self, tier="preview"):
+        """Makes sure every comic in the catalog has an up to date rendition of its preview page."""
+        comics, _ = self.catalog.list()
+        for comic in comics:
+            if self._stop.is_set():
+                return
+            try:
+                self.get(comic["name"], comic["previewImage"], tier)
+            except OSError as e:
+                print(f"Thumbnail for {comic['name']} failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"tiers": self.tiers, "hits": self.hits, "generated": self.generated, "failed": self.failed}
+
+    def start(self):
+        """Warms the previews now and again after every catalog change, on a daemon thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="thumbnail-warm", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        version = None
+        while True:
+            if self.catalog.version != version:
+                version = self.catalog.version
+                self.warm()
+            if self._stop.wait(self.refresh_interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = int(os.environ.get("DETECTION_WORKERS", os.cpu_count() or 2))
+DEFAULT_QUEUE = int(os.environ.get("DETECTION_QUEUE", 2 * DEFAULT_WORKERS))
+DEFAULT_TIMEOUT = float(os.environ.get("DETECTION_TIMEOUT", 30))
+
+
+class PoolFullError(Exception):
+    pass
+
+
+class DetectionPool:
+    """Runs blocking OpenCV work on a thread pool with admission control.
+
+    At most workers jobs run at once and at most max_queue more wait; further submissions are
+    rejected with PoolFullError instead of queueing without bound. OpenCV releases the GIL, so
+    threads keep the event loop responsive. A job that times out stops being awaited, but keeps
+    its slot until its thread actually finishes, so the admission count stays honest.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_queue: int = DEFAULT_QUEUE,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._admitted = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="detection")
+
+    @property
+    def capacity(self):
+        return self.workers + self.max_queue
+
+    def _release(self, _future):
+        with self._lock:
+            self._admitted -= 1
+            self.completed += 1
+
+    async def run(self, function, *args, timeout=None, **kwargs):
+        with self._lock:
+            if self._admitted >= self.capacity:
+                self.rejected += 1
+                raise PoolFullError(f"{self._admitted} jobs admitted, capacity is {self.capacity}")
+            self._admitted += 1
+
+        future = self._executor.submit(function, *args, **kwargs)
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'timeout': self.timeout,
+                'admitted': self._admitted,
+                'running': min(self._admitted, self.workers),
+                'waiting': max(0, self._admitted - self.workers),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,159 @@
+import numpy as np
+
+
+def boxes_to_array(bboxes):
+    """Converts a list of {'x','y','width','height'} dicts into an (N, 4) array of x1, y1, x2, y2."""
+    array = np.empty((len(bboxes), 4), dtype=np.float64)
+    for i, bbox in enumerate(bboxes):
+        array[i] = (bbox['x'], bbox['y'], bbox['x'] + bbox['width'], bbox['y'] + bbox['height'])
+    return array
+
+
+def xyxy_to_array(boxes):
+    """Converts a list of [x1, y1, x2, y2] model outputs into an (N, 4) array."""
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def areas(boxes):
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def intersection_matrix(boxes_a, boxes_b):
+    """Intersection area of every box in boxes_a with every box in boxes_b, shape (N, M)."""
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    return np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Matrix form of image_utils.calculate_iou."""
+    intersection = intersection_matrix(boxes_a, boxes_b)
+    union = areas(boxes_a)[:, None] + areas(boxes_b)[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def overlap_matrix(boxes_a, boxes_b):
+    """Matrix form of image_utils.calculate_overlap_percentage: the share of each box in boxes_a covered by each box in boxes_b."""
+    intersection = intersection_matrix(boxes_a, boxes_b)
+    area_a = np.broadcast_to(areas(boxes_a)[:, None], intersection.shape)
+    return np.divide(intersection, area_a, out=np.zeros_like(intersection), where=intersection > 0)
+
+
+def assign_to_best(scores):
+    """Index of the highest scoring column per row, or -1 if no column scores above zero.
+
+    Ties go to the first column, like the strict '>' comparison in the former per-pair loops.
+    """
+    if scores.shape[1] == 0:
+        return np.full(scores.shape[0], -1, dtype=np.intp)
+    best = np.argmax(scores, axis=1)
+    best[scores[np.arange(scores.shape[0]), best] <= 0] = -1
+    return best
+
+
+def pair_intersections(boxes_a, boxes_b, rows, cols):
+    """Intersection area of boxes_a[rows[k]] with boxes_b[cols[k]] for each candidate pair k."""
+    a, b = boxes_a[rows], boxes_b[cols]
+    width = np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])
+    height = np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])
+    return np.clip(width, 0, None) * np.clip(height, 0, None)
+
+
+def pair_iou(boxes_a, boxes_b, rows, cols):
+    intersection = pair_intersections(boxes_a, boxes_b, rows, cols)
+    union = areas(boxes_a)[rows] + areas(boxes_b)[cols] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def pair_overlap(boxes_a, boxes_b, rows, cols):
+    intersection = pair_intersections(boxes_a, boxes_b, rows, cols)
+    area_a = areas(boxes_a)[rows]
+    return np.divide(intersection, area_a, out=np.zeros_like(intersection), where=intersection > 0)
+
+
+def assign_pairs_to_best(rows, cols, scores, row_count):
+    """Sparse counterpart of assign_to_best for candidate pairs, e.g. from GridIndex.query_pairs.
+
+    Rows without a candidate scoring above zero get -1; ties go to the lowest column.
+    """
+    best = np.full(row_count, -1, dtype=np.intp)
+    positive = scores > 0
+    rows, cols, scores = rows[positive], cols[positive], scores[positive]
+    if len(rows) == 0:
+        return best
+
+    order = np.lexsort((cols, -scores, rows))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = rows[order][1:] != rows[order][:-1]
+    best[rows[order][first]] = cols[order][first]
+    return best
+
+
+def match_boxes(predicted, truth, threshold=0.5):
+    """Greedy one-to-one matching by descending IoU, as used for detection precision and recall.
+
+    Returns (predicted indices, truth indices) of the pairs with IoU >= threshold.
+    """
+    if len(predicted) == 0 or len(truth) == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    ious = iou_matrix(predicted, truth)
+    rows, cols = np.nonzero(ious >= threshold)
+    order = np.argsort(-ious[rows, cols], kind='stable')
+
+    used_rows = np.zeros(len(predicted), dtype=bool)
+    used_cols = np.zeros(len(truth), dtype=bool)
+    matched_rows, matched_cols = [], []
+    for row, col in zip(rows[order], cols[order]):
+        if not used_rows[row] and not used_cols[col]:
+            used_rows[row] = used_cols[col] = True
+            matched_rows.append(row)
+            matched_cols.append(col)
+    return np.asarray(matched_rows, dtype=np.intp), np.asarray(matched_cols, dtype=np.intp)
+
+
+def deduplicate(boxes, groups, threshold=0.6):
+    """Greedy duplicate removal inside each group.
+
+    A box is kept unless it has an IoU above threshold with an earlier kept box of the same group.
+    Boxes with group -1 are never kept. Only boxes of the same group are compared with each other.
+    """
+    keep = groups >= 0
+    if len(boxes) < 2:
+        return keep
+
+    group_count = int(groups.max()) + 1 if keep.any() else 0
+    for indices in group_indices(groups, group_count):
+        if len(indices) < 2:
+            continue
+        duplicates = iou_matrix(boxes[indices], boxes[indices]) > threshold
+        duplicates &= np.tri(len(indices), k=-1, dtype=bool)
+
+        kept = np.ones(len(indices), dtype=bool)
+        for i in np.flatnonzero(duplicates.any(axis=1)):
+            if np.any(duplicates[i, :i] & kept[:i]):
+                kept[i] = False
+        keep[indices[~kept]] = False
+    return keep
+
+
+def reading_order(boxes, y_tolerance=50):
+    """Row-major reading order: rows of height y_tolerance top to bottom, left to right inside a row."""
+    return np.lexsort((boxes[:, 0], np.floor_divide(boxes[:, 1], y_tolerance)))
+
+
+def corner_order(boxes):
+    """Order used for entities and speech bubbles inside a panel: by y - height, then x - width."""
+    width = boxes[:, 2] - boxes[:, 0]
+    height = boxes[:, 3] - boxes[:, 1]
+    return np.lexsort((boxes[:, 0] - width, boxes[:, 1] - height))
+
+
+def group_indices(assignment, group_count):
+    """Splits row indices by their assigned group, preserving the row order inside each group."""
+    order = np.argsort(assignment, kind='stable')
+    sorted_groups = assignment[order]
+    bounds = np.searchsorted(sorted_groups, np.arange(group_count + 1))
+    return [order[bounds[g]:bounds[g + 1]] for g in range(group_count)]
@@ -0,0 +1,313 @@
+"""Versioned binary container for comic annotations, with random access to single pages.
+
+Layout, all integers little endian:
+
+    b'CTNB' | version u16 | reserved u16 | header length u32 | header JSON (padded to 8 bytes)
+    page offset table: (pages + 1) u64, relative to the first page chunk
+    page chunks
+
+The header holds the comic name, the page count and the page pairs as [left, right] page
+numbers (null for a missing side). A page chunk is a u32 manifest length, the JSON manifest
+(index, type, height, width and the name, dtype and shape of every array) and the array bytes,
+each padded to 8 bytes. Boxes, ids and flags are typed arrays; descriptions, texts, bubble types,
+speaker ids, tag labels and non-standard bounding boxes are indices into the page's string table
+(UTF-8 bytes plus offsets), -1 for None.
+
+Converting an annotation XML to the container and back writes the same bytes as
+xml_stream.write_comic of the loaded XML.
+
+    python -m src.Utils.comic_container Data/comics/2b24d495.xml 2b24d495.ctn
+"""
+import argparse
+import json
+import mmap
+import struct
+from collections.abc import Sequence
+
+import numpy as np
+
+from src.Classes.comic import Comic
+from src.Classes.entity import Entity
+from src.Classes.page import Page, PageType
+from src.Classes.page_store import BOX_KEYS, CompactPage, is_plain_box
+from src.Classes.panel import Panel
+from src.Classes.speech_bubble import SpeechBubble
+from src.Utils import xml_stream
+
+MAGIC = b'CTNB'
+VERSION = 1
+CONTAINER_SUFFIX = '.ctn'
+_PREAMBLE = struct.Struct('<4sHHI')
+_ALIGNMENT = 8
+
+
+def _padded(data):
+    return data + b'\0' * (-len(data) % _ALIGNMENT)
+
+
+class _StringTable:
+    def __init__(self):
+        self.indices = {}
+
+    def add(self, text):
+        if text is None:
+            return -1
+        return self.indices.setdefault(text, len(self.indices))
+
+    def arrays(self):
+        encoded = [text.encode('utf-8') for text in self.indices]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _encode_boxes(prefix, bboxes, strings, arrays):
+    boxes = np.zeros((len(bboxes), 4), dtype=np.float64)
+    box_text = np.full(len(bboxes), -1, dtype=np.int32)
+    for i, bbox in enumerate(bboxes):
+        bbox = dict(bbox)
+        if is_plain_box(bbox):
+            boxes[i] = [bbox[key] for key in BOX_KEYS]
+        else:
+            box_text[i] = strings.add(','.join(f"{key}:{value}" for key, value in bbox.items()))
+    arrays[f'{prefix}_boxes'] = boxes
+    arrays[f'{prefix}_box_text'] = box_text
+
+
+def _encode_entities(prefix, owned, strings, arrays):
+    """owned is a list of (owner row, entity); the owner is a panel for entities, a bubble for speakers."""
+    arrays[f'{prefix}_owner'] = np.array([owner for owner, _ in owned], dtype=np.int32)
+    _encode_boxes(prefix, [entity.bounding_box for _, entity in owned], strings, arrays)
+    arrays[f'{prefix}_named_entity_id'] = np.array([int(entity.named_entity_id) for _, entity in owned], dtype=np.int64)
+    arrays[f'{prefix}_active_tag'] = np.array([bool(entity.active_tag) for _, entity in owned], dtype=np.bool_)
+    tags = [(i, label, confidence) for i, (_, entity) in enumerate(owned) for label, confidence in entity.tags]
+    arrays[f'{prefix}_tag_owner'] = np.array([i for i, _, _ in tags], dtype=np.int32)
+    arrays[f'{prefix}_tag_label'] = np.array([strings.add(str(label)) for _, label, _ in tags], dtype=np.int32)
+    arrays[f'{prefix}_tag_value'] = np.array([float(confidence) for _, _, confidence in tags], dtype=np.float64)
+
+
+def encode_page(page):
+    """One page chunk: manifest length, manifest and the 8-byte aligned arrays."""
+    strings = _StringTable()
+    arrays = {}
+    panels = list(page.panels)
+    bubbles = [(i, bubble) for i, panel in enumerate(panels) for bubble in panel.speech_bubbles]
+    entities = [(i, entity) for i, panel in enumerate(panels) for entity in panel.entities]
+    speakers = [(i, entity) for i, (_, bubble) in enumerate(bubbles) for entity in bubble.speaker]
+
+    _encode_boxes('panel', [panel.bounding_box for panel in panels], strings, arrays)
+    arrays['panel_description'] = np.array([strings.add(panel.description) for panel in panels], dtype=np.int32)
+    arrays['panel_scene_id'] = np.array([int(panel.scene_id) for panel in panels], dtype=np.int64)
+    arrays['panel_starting_tag'] = np.array([bool(panel.starting_tag) for panel in panels], dtype=np.bool_)
+
+    arrays['bubble_owner'] = np.array([owner for owner, _ in bubbles], dtype=np.int32)
+    _encode_boxes('bubble', [bubble.bounding_box for _, bubble in bubbles], strings, arrays)
+    arrays['bubble_type'] = np.array([strings.add(bubble.type) for _, bubble in bubbles], dtype=np.int32)
+    arrays['bubble_text'] = np.array([strings.add(bubble.text) for _, bubble in bubbles], dtype=np.int32)
+    arrays['bubble_speaker_id'] = np.array([strings.add(str(bubble.speaker_id)) for _, bubble in bubbles],
+                                           dtype=np.int32)
+
+    _encode_entities('entity', entities, strings, arrays)
+    _encode_entities('speaker', speakers, strings, arrays)
+    arrays['strings'], arrays['string_offsets'] = strings.arrays()
+
+    manifest = {
+        'index': page.page_index,
+        'type': page.page_type.name,
+        'height': page.height,
+        'width': page.width,
+        'arrays': [[name, array.dtype.str, list(array.shape)] for name, array in arrays.items()]
+    }
+    header = json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-(4 + len(header)) % _ALIGNMENT)
+    return b''.join([struct.pack('<I', len(header)), header]
+                    + [_padded(np.ascontiguousarray(array).tobytes()) for array in arrays.values()])
+
+
+def _read_arrays(chunk):
+    length, = struct.unpack_from('<I', chunk)
+    manifest = json.loads(bytes(chunk[4:4 + length]))
+    position = 4 + length
+    arrays = {}
+    for name, dtype, shape in manifest['arrays']:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(chunk, dtype=dtype, count=count, offset=position).reshape(shape)
+        position += count * dtype.itemsize + (-(count * dtype.itemsize) % _ALIGNMENT)
+    return manifest, arrays
+
+
+def _decode_boxes(prefix, arrays, strings):
+    return [dict(zip(BOX_KEYS, box)) if text < 0 else xml_stream.parse_bounding_box(strings[text])
+            for box, text in zip(arrays[f'{prefix}_boxes'].tolist(), arrays[f'{prefix}_box_text'].tolist())]
+
+
+def _decode_entities(prefix, arrays, strings, owners):
+    """Appends every entity to the list of its owner in owners."""
+    entities = [Entity(bbox) for bbox in _decode_boxes(prefix, arrays, strings)]
+    for entity, owner, named_entity_id, active_tag in zip(entities, arrays[f'{prefix}_owner'].tolist(),
+                                                          arrays[f'{prefix}_named_entity_id'].tolist(),
+                                                          arrays[f'{prefix}_active_tag'].tolist()):
+        entity.named_entity_id = named_entity_id
+        entity.active_tag = active_tag
+        owners[owner].append(entity)
+    for owner, label, confidence in zip(arrays[f'{prefix}_tag_owner'].tolist(), arrays[f'{prefix}_tag_label'].tolist(),
+                                        arrays[f'{prefix}_tag_value'].tolist()):
+        entities[owner].tags.append((strings[label], confidence))
+
+
+def decode_page(chunk, compact=False):
+    """Builds the Page of one chunk from encode_page; a CompactPage with compact=True."""
+    manifest, arrays = _read_arrays(chunk)
+    blob = arrays['strings'].tobytes()
+    offsets = arrays['string_offsets'].tolist()
+    strings = [blob[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+    def text(index):
+        return strings[index] if index >= 0 else None
+
+    panels = []
+    for bbox, description, scene_id, starting_tag in zip(_decode_boxes('panel', arrays, strings),
+                                                         arrays['panel_description'].tolist(),
+                                                         arrays['panel_scene_id'].tolist(),
+                                                         arrays['panel_starting_tag'].tolist()):
+        panel = Panel(text(description), bbox)
+        panel.scene_id = scene_id
+        panel.starting_tag = starting_tag
+        panels.append(panel)
+
+    bubbles = []
+    for bbox, owner, bubble_type, bubble_text, speaker_id in zip(_decode_boxes('bubble', arrays, strings),
+                                                                  arrays['bubble_owner'].tolist(),
+                                                                  arrays['bubble_type'].tolist(),
+                                                                  arrays['bubble_text'].tolist(),
+                                                                  arrays['bubble_speaker_id'].tolist()):
+        bubble = SpeechBubble(text(bubble_type), text(bubble_text), bbox)
+        bubble.speaker_id = text(speaker_id)
+        panels[owner].speech_bubbles.append(bubble)
+        bubbles.append(bubble)
+
+    _decode_entities('entity', arrays, strings, [panel.entities for panel in panels])
+    _decode_entities('speaker', arrays, strings, [bubble.speaker for bubble in bubbles])
+
+    page = Page(manifest['index'], PageType[manifest['type']], panels,
+                height=manifest['height'], width=manifest['width'])
+    return CompactPage.from_page(page) if compact else page
+
+
+def write_container(comic, file):
+    """Writes comic into the binary file handle; every page is encoded exactly once."""
+    pairs = []
+    chunks = []
+    for pair in comic.page_pairs:
+        numbers = []
+        for page in pair:
+            if page is None:
+                numbers.append(None)
+            else:
+                numbers.append(len(chunks))
+                chunks.append(encode_page(page))
+        pairs.append(numbers)
+
+    header = _padded(json.dumps({'name': comic.name, 'pages': len(chunks), 'pairs': pairs}).encode('utf-8'))
+    offsets = np.zeros(len(chunks) + 1, dtype='<u8')
+    np.cumsum([len(chunk) for chunk in chunks], out=offsets[1:])
+
+    file.write(_PREAMBLE.pack(MAGIC, VERSION, 0, len(header)))
+    file.write(header)
+    file.write(offsets.tobytes())
+    for chunk in chunks:
+        file.write(chunk)
+
+
+def save_container(comic, filepath):
+    with open(filepath, 'wb') as file:
+        write_container(comic, file)
+
+
+class ContainerPagePairs(Sequence):
+    """Page pairs of a container; opening reads only the header and the page offset table.
+
+    Pages are decoded on first access and then kept. A path is memory-mapped, so reading one page
+    only touches the bytes of that page.
+    """
+
+    def __init__(self, data, compact=False):
+        magic, version, _, header_length = _PREAMBLE.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a comic annotation container")
+        if version != VERSION:
+            raise ValueError(f"Unsupported container version {version}, expected {VERSION}")
+        header_end = _PREAMBLE.size + header_length
+        header = json.loads(bytes(data[_PREAMBLE.size:header_end]).rstrip(b'\0'))
+        self.name = header['name']
+        self._pairs = header['pairs']
+        self._offsets = np.frombuffer(data, dtype='<u8', count=header['pages'] + 1, offset=header_end).tolist()
+        self._start = header_end + 8 * len(self._offsets)
+        self._data = data
+        self._compact = compact
+        self._pages = [None] * header['pages']
+
+    def __len__(self):
+        return len(self._pairs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return tuple(None if number is None else self.page(number) for number in self._pairs[index])
+
+    def page_count(self):
+        return len(self._pages)
+
+    def page(self, number):
+        """The number-th page of the file in reading order, decoded on first access."""
+        if self._pages[number] is None:
+            start = self._start + self._offsets[number]
+            end = self._start + self._offsets[number + 1]
+            self._pages[number] = decode_page(self._data[start:end], self._compact)
+        return self._pages[number]
+
+    def loaded_count(self):
+        return sum(page is not None for page in self._pages)
+
+    def materialize(self):
+        return [self[i] for i in range(len(self))]
+
+
+def _read_source(source):
+    if isinstance(source, (bytes, bytearray)):
+        return source
+    if isinstance(source, str):
+        with open(source, 'rb') as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return source.read()
+
+
+def load_container(source, lazy=False, compact=False):
+    """Loads a container from a path, binary file object or bytes, like xml_stream.load_comic.
+
+    With lazy=True the returned Comic's page_pairs is a ContainerPagePairs and pages are only
+    decoded when accessed. With compact=True pages are CompactPages.
+    """
+    pairs = ContainerPagePairs(_read_source(source), compact)
+    return Comic(pairs.name, pairs if lazy else pairs.materialize())
+
+
+def convert(source, destination):
+    """Converts between annotation XML and the container, by the suffix of destination."""
+    if destination.endswith(CONTAINER_SUFFIX):
+        save_container(xml_stream.load_comic(source), destination)
+    else:
+        xml_stream.save_comic(load_container(source), destination)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between annotation XML and the binary container.")
+    parser.add_argument("source")
+    parser.add_argument("destination", help=f"written as a container if it ends with {CONTAINER_SUFFIX}, else as XML")
+    args = parser.parse_args()
+    convert(args.source, args.destination)
+
+
+if __name__ == "__main__":
+    main()
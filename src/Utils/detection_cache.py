@@ -0,0 +1,153 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+import numpy as np
+
+CACHE_FORMAT_VERSION = 2
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def page_fingerprint(image):
+    """Hashes the pixel data of a page together with its shape and dtype."""
+    array = np.ascontiguousarray(image)
+    digest = hashlib.sha256()
+    digest.update(str(array.shape).encode('utf-8'))
+    digest.update(str(array.dtype).encode('utf-8'))
+    digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """Content-addressed on-disk store for raw Magi page results.
+
+    Magi clusters characters over a whole model call, so a page's character_cluster_labels only
+    mean something next to the other pages of that call. Entries are therefore keyed on the model
+    identifier, the pixel hashes of every page of the call and the page's position in it (see
+    batch_keys), and a call is only served from the cache when all of its pages are. Labels of
+    different calls are not comparable, cached or not. Entries live under a directory per
+    format version and are evicted least-recently-used first once max_bytes is exceeded. A hit
+    refreshes the entry's mtime, which is what the eviction order is based on.
+    """
+
+    def __init__(self, cache_dir: str, model_id: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.join(cache_dir, f"v{CACHE_FORMAT_VERSION}")
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def batch_keys(self, images):
+        """One key per page of a model call over images, in order."""
+        batch = hashlib.sha256()
+        batch.update(self.model_id.encode('utf-8'))
+        for image in images:
+            batch.update(page_fingerprint(image).encode('utf-8'))
+        batch = batch.hexdigest()
+        return [hashlib.sha256(f"{batch}:{position}".encode('utf-8')).hexdigest() for position in range(len(images))]
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pkl")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for file_name in files:
+                if not file_name.endswith('.pkl'):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime_ns
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                entry = pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if entry.get('version') != CACHE_FORMAT_VERSION or entry.get('model_id') != self.model_id:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry['page_result']
+
+    def put(self, key, page_result):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            'version': CACHE_FORMAT_VERSION,
+            'model_id': self.model_id,
+            'page_result': page_result
+        }
+
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        with self._lock:
+            self._total_bytes += os.path.getsize(path) - previous_size
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits into max_bytes again."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+            self._total_bytes = total
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in list(self._entries()):
+                os.unlink(path)
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'version': CACHE_FORMAT_VERSION,
+                'model_id': self.model_id
+            }
@@ -0,0 +1,192 @@
+import os
+
+import numpy as np
+
+from src.Utils import box_association as ba
+from src.Utils import xml_stream
+
+DEFAULT_IOU_THRESHOLDS = (0.5, 0.75)
+
+# Ground truth labels of the Comics100 CVAT export that each detector family predicts. The export
+# has no balloon boxes (the label is declared but unused), so speech bubbles are scored against
+# text, the per-bubble text region. That box is usually a bit smaller than the balloon outline
+# cv_panel finds, so bubble scores are an approximation, especially at the stricter thresholds.
+CLASSICAL_LABELS = {"panels": "panel", "speech_bubbles": "text"}
+MODEL_LABELS = {"panels": "panel", "texts": "text", "characters": "character"}
+
+
+def load_ground_truth(annotations, images_dir, labels=None, limit=None):
+    """Reads the CVAT boxes of every page whose image exists under images_dir.
+
+    Returns (pages, missing): pages are dicts with name, path, width, height and boxes
+    ({label: (N, 4) x1, y1, x2, y2 array}, restricted to labels if given); missing lists the
+    names of the pages that are not on disk.
+    """
+    pages = []
+    missing = []
+    for image in xml_stream.iter_cvat_images(annotations):
+        path = os.path.join(images_dir, image["name"])
+        if not os.path.exists(path):
+            missing.append(image["name"])
+            continue
+        boxes = image["boxes"]
+        if labels is not None:
+            boxes = {label: boxes.get(label, np.empty((0, 4))) for label in labels}
+        pages.append({"name": image["name"], "path": path, "width": image["width"], "height": image["height"],
+                      "boxes": boxes})
+        if limit and len(pages) >= limit:
+            break
+    return pages, missing
+
+
+def load_annotation_ground_truth(xml_path, comic_dir=None, limit=None):
+    """Reads the panel and speech bubble boxes of one of our annotation XMLs as ground truth.
+
+    Page n of the XML is the n-th page image of comic_dir (default: the folder next to the XML
+    with the same name). Speech bubbles are reported under CLASSICAL_LABELS["speech_bubbles"] so
+    both sources score the same way. Returns (pages, missing) like load_ground_truth.
+    """
+    from src.Components.corpus_annotator import page_files
+
+    comic_dir = comic_dir or os.path.splitext(xml_path)[0]
+    paths = page_files(comic_dir) if os.path.isdir(comic_dir) else []
+    comic_name = os.path.basename(os.path.normpath(comic_dir))
+
+    pages = []
+    missing = []
+    for pair in xml_stream.load_comic(xml_path).page_pairs:
+        for page in pair:
+            if page is None:
+                continue
+            name = f"{comic_name}/{page.page_index}"
+            if not 0 < page.page_index <= len(paths):
+                missing.append(name)
+                continue
+            path = paths[page.page_index - 1]
+            bubbles = [bubble.bounding_box for panel in page.panels for bubble in panel.speech_bubbles]
+            pages.append({
+                "name": f"{comic_name}/{os.path.basename(path)}",
+                "path": path,
+                "width": None,
+                "height": None,
+                "boxes": {
+                    CLASSICAL_LABELS["panels"]: ba.boxes_to_array([panel.bounding_box for panel in page.panels]),
+                    CLASSICAL_LABELS["speech_bubbles"]: ba.boxes_to_array(bubbles)
+                }
+            })
+            if limit and len(pages) >= limit:
+                return pages, missing
+    return pages, missing
+
+
+def match_counts(predicted, truth, thresholds=DEFAULT_IOU_THRESHOLDS):
+    """(len(thresholds), 3) array of matched, predicted and ground truth counts for one label on one page."""
+    counts = np.empty((len(thresholds), 3), dtype=np.int64)
+    for j, threshold in enumerate(thresholds):
+        matched, _ = ba.match_boxes(predicted, truth, threshold)
+        counts[j] = (len(matched), len(predicted), len(truth))
+    return counts
+
+
+def precision_recall_f1(matched, predicted, truth):
+    precision = matched / predicted if predicted else 0.0
+    recall = matched / truth if truth else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+class DetectionScore:
+    """Accumulates matched, predicted and ground truth box counts per label and IoU threshold."""
+
+    def __init__(self, labels, thresholds=DEFAULT_IOU_THRESHOLDS):
+        self.labels = list(labels)
+        self.thresholds = list(thresholds)
+        self.pages = 0
+        self._counts = np.zeros((len(self.labels), len(self.thresholds), 3), dtype=np.int64)
+
+    def add(self, predicted, truth):
+        """Scores one page; predicted and truth map labels to (N, 4) xyxy arrays."""
+        self.pages += 1
+        empty = np.empty((0, 4))
+        for label in self.labels:
+            self.add_counts(label, match_counts(predicted.get(label, empty), truth.get(label, empty), self.thresholds))
+
+    def add_counts(self, label, counts):
+        """Adds precomputed match_counts for label, e.g. cached from an earlier run on the same page."""
+        self._counts[self.labels.index(label)] += counts
+
+    def merge(self, other):
+        """Adds the counts of another score over the same labels and thresholds, e.g. from another worker."""
+        self.pages += other.pages
+        self._counts += other._counts
+        return self
+
+    def has_ground_truth(self, label):
+        """False if none of the scored pages had a ground truth box of label, so its scores mean nothing."""
+        return bool(self._counts[self.labels.index(label), 0, 2])
+
+    def f1(self, label=None, threshold=None):
+        """Micro F1 for one label, or averaged over the labels, at threshold (default: the first).
+
+        Labels without ground truth are left out of the average; None if no label is left.
+        """
+        j = self.thresholds.index(threshold) if threshold is not None else 0
+        labels = [label] if label is not None else self.labels
+        rows = [self.labels.index(label) for label in labels if self.has_ground_truth(label)]
+        if not rows:
+            return None
+        return float(np.mean([precision_recall_f1(*self._counts[i, j])[2] for i in rows]))
+
+    def as_dict(self):
+        result = {}
+        for i, label in enumerate(self.labels):
+            result[label] = {}
+            for j, threshold in enumerate(self.thresholds):
+                matched, predicted, truth = (int(value) for value in self._counts[i, j])
+                # Without ground truth boxes precision, recall and F1 are undefined rather than 0.
+                precision, recall, f1 = precision_recall_f1(matched, predicted, truth) if truth else (None,) * 3
+                result[label][str(threshold)] = {
+                    "precision": precision,
+                    "recall": recall,
+                    "f1": f1,
+                    "matched": matched,
+                    "predicted": predicted,
+                    "truth": truth
+                }
+        return result
+
+
+def classical_detector(params=None):
+    """Adapts cv_panel to the detector interface: a list of RGB pages in, one {label: boxes} dict per page out."""
+    import cv2
+
+    from src.Components.cv_panel import detect_boxes
+
+    params = params or {}
+
+    def detect(images):
+        results = []
+        for image in images:
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            panels, speech_bubbles = detect_boxes(image, gray, params)
+            results.append({
+                CLASSICAL_LABELS["panels"]: ba.boxes_to_array(panels),
+                CLASSICAL_LABELS["speech_bubbles"]: ba.boxes_to_array(speech_bubbles)
+            })
+        return results
+
+    detect.labels = list(CLASSICAL_LABELS.values())
+    return detect
+
+
+def model_detector(model):
+    """Adapts a ComicReader model (anything with detect_objects_batch) to the detector interface."""
+
+    def detect(images):
+        return [
+            {label: ba.xyxy_to_array(page_result.get(key, [])) for key, label in MODEL_LABELS.items()}
+            for page_result in model.detect_objects_batch(images)
+        ]
+
+    detect.labels = list(MODEL_LABELS.values())
+    return detect
@@ -1,6 +1,4 @@
-import cv2
 import numpy as np
-from PIL import Image
 
 
 def x1y1x2y2_to_xywh(bbox):
@@ -13,12 +11,16 @@ def x1y1x2y2_to_xywh(bbox):
     }
 
 def read_image(path_to_image):
+    from PIL import Image
+
     with open(path_to_image, "rb") as file:
         image = Image.open(file).convert("L").convert("RGB")
         image = np.array(image)
     return image
 
 def draw_bounding_box(image, bbox, color, thickness=2, number=None, type=None):
+    import cv2
+
     x = int(bbox['x'])
     y = int(bbox['y'])
     w = int(bbox['width'])
@@ -146,3 +148,74 @@ def is_bbox_overlapping(bbox_1, bbox_2):
                 y1_top <= y2_top and y1_bottom >= y2_bottom)
 
     return overlap or contains
+
+
+class LazyImage:
+    """Image attribute that falls back to calling <name>_loader() while no image has been assigned.
+
+    Lets pages and crops be rendered on demand, e.g. from a PdfPageSource, without keeping the
+    rendered arrays alive on the object.
+    """
+
+    def __set_name__(self, owner, name):
+        self.attribute = f"_{name}"
+        self.loader_attribute = f"{name}_loader"
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        image = getattr(instance, self.attribute, None)
+        if image is None:
+            loader = getattr(instance, self.loader_attribute, None)
+            if loader is not None:
+                return loader()
+        return image
+
+    def __set__(self, instance, value):
+        setattr(instance, self.attribute, value)
+
+
+def compose_horizontal(images, height=None, max_height=None, mode='pad', background=255, rgb_to_bgr=False):
+    """Places images side by side in one preallocated uint8 buffer.
+
+    The row height is height, or the tallest image. With mode='pad' smaller images are top-aligned
+    on the background and only taller ones are scaled down; with mode='rescale' every image is
+    scaled to the row height. max_height caps the row height for downscaled previews. Images are
+    written straight into the buffer (channel order reversed on the fly for rgb_to_bgr), so no
+    per-image copies are made when no scaling is needed.
+    """
+    if mode not in ('rescale', 'pad'):
+        raise ValueError(f"Unknown mode {mode}")
+    if not images:
+        return None
+
+    row_height = int(height or max(image.shape[0] for image in images))
+    if max_height is not None:
+        row_height = min(row_height, int(max_height))
+
+    sizes = []
+    for image in images:
+        image_height, image_width = image.shape[:2]
+        scale = row_height / image_height if mode == 'rescale' or image_height > row_height else 1.0
+        sizes.append((max(1, round(image_height * scale)), max(1, round(image_width * scale))))
+
+    output = np.full((row_height, sum(width for _, width in sizes), 3), background, dtype=np.uint8)
+
+    x = 0
+    for image, (target_height, target_width) in zip(images, sizes):
+        if image.shape[:2] != (target_height, target_width):
+            import cv2
+
+            image = cv2.resize(image, (target_width, target_height), interpolation=cv2.INTER_AREA)
+
+        if image.ndim == 2:
+            image = image[:, :, None]
+        if image.shape[2] > 3:
+            image = image[:, :, :3]
+        if rgb_to_bgr and image.shape[2] == 3:
+            image = image[:, :, ::-1]
+
+        output[:target_height, x:x + target_width] = image
+        x += target_width
+
+    return output
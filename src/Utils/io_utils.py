@@ -1,17 +1,12 @@
-from PIL import Image
-import numpy as np
-import fitz
+import hashlib
 import xml.etree.ElementTree as eT
 import xml.sax.saxutils as saxutils
 
 from xml.dom import minidom
 import pathlib
 import tempfile
-import pyttsx3
-from gtts import gTTS
 import os
 
-from src.Utils.image_utils import image_from_bbox
 
 def escape_text(text, reverse=False):
     if text is None: return text
@@ -53,6 +48,10 @@ def escape_text(text, reverse=False):
 
 
 def convert_pdf_to_image(pdf_path: str):
+    import fitz
+    import numpy as np
+    from PIL import Image
+
     pdf = fitz.open(pdf_path)
 
     rgb_arrays = []
@@ -84,6 +83,9 @@ def save_script_as_txt(filepath, script):
 
 
 def save_script_as_mp3(filepath, script):
+    import pyttsx3
+
+    #from gtts import gTTS
     #tts = gTTS(text=script, lang='en')
     #tts.save(filepath)
     engine = pyttsx3.init()
@@ -95,6 +97,8 @@ def save_script_as_mp3(filepath, script):
 
 
 def read_xml_from_pdf(pdf_path: str):
+    import fitz
+
     doc = fitz.open(pdf_path)
 
     if doc.embfile_count() <= 0:
@@ -105,6 +109,8 @@ def read_xml_from_pdf(pdf_path: str):
 
 # TODO: Add error handling if embedding already exists
 def add_annotation_to_pdf(pdf_path: str, xml_content: str, new_pdf_path: str):
+    import fitz
+
     doc = fitz.open(pdf_path)
 
     with tempfile.NamedTemporaryFile(delete=False, suffix=".xml") as temp_xml_file:
@@ -212,14 +218,12 @@ def parse_page_pair(page_pair_elem):
 
 
 # TODO: add image data
-def parse_comic(xml_content):
-    from src.Classes.comic import Comic
-
-    root = eT.fromstring(xml_content)
-    name = root.find('Name').text
-    page_pairs = [parse_page_pair(pp) for pp in root.find('PagePairs')]
+def parse_comic(xml_content, lazy=False):
+    from src.Utils.xml_stream import load_comic
 
-    return Comic(name, page_pairs)
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode('utf-8')
+    return load_comic(xml_content, lazy=lazy)
 
 def str_to_bool(s):
     if isinstance(s, str):
@@ -232,42 +236,61 @@ def str_to_bool(s):
 
 
 #TODO: add Taggs again?
-def add_image_data(comic, file_path: str):
-    pages = convert_pdf_to_image(file_path)
+def add_image_data(comic, file_path: str, cache_size: int = None):
+    """Binds the pages to the PDF; pages render on first access and only cache_size of them stay decoded."""
+    from src.Utils.page_source import PdfPageSource, attach_page_source, DEFAULT_CACHE_SIZE
+
+    source = PdfPageSource(file_path, cache_size or DEFAULT_CACHE_SIZE)
     counter = 0
     for page_pair in comic.page_pairs:
+        for page in page_pair:
+            if page is not None:
+                attach_page_source(page, source, counter)
+                counter += 1
+    return source
 
-        left_page, right_page = page_pair
-
-        if left_page is not None:
-            left_page.page_image = pages[counter]
-            for panel in left_page.panels:
+def export_as_xml(export_path,comic):
+    if export_path:
+        from src.Utils.xml_stream import save_comic
 
-                panel.image = image_from_bbox(left_page.page_image, panel.bounding_box)
+        save_comic(comic, export_path, indent="  ", xml_declaration=True)
 
-                for speech_bubble in panel.speech_bubbles:
-                    speech_bubble.image = image_from_bbox(left_page.page_image, speech_bubble.bounding_box)
-                for entity in panel.entities:
-                    entity.image = image_from_bbox(left_page.page_image, entity.bounding_box)
-            counter += 1
+        print("Export Successful", "The XML was exported successfully")
+    else:
+        print("Error", "Error while trying to export, please try again")
 
-        if right_page is not None:
-            right_page.page_image = pages[counter]
-            for panel in right_page.panels:
-                panel.image = image_from_bbox(right_page.page_image, panel.bounding_box)
 
-                for speech_bubble in panel.speech_bubbles:
-                    speech_bubble.image = image_from_bbox(right_page.page_image, speech_bubble.bounding_box)
-                for entity in panel.entities:
-                    entity.image = image_from_bbox(right_page.page_image, entity.bounding_box)
-            counter += 1
+def file_digest(path):
+    """sha256 hex digest of the file at path, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-def export_as_xml(export_path,comic):
-    if export_path:
-        xml = comic.to_xml()
-        xml_str = prettify_xml(xml)
-        save_xml_to_file(export_path, xml_str)
 
-        print("Export Successful", "The XML was exported successfully")
-    else:
-        print("Error", "Error while trying to export, please try again")
\ No newline at end of file
+def _umask():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    # Fallback without /proc; briefly changes the process umask.
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def match_file_mode(temp_path, path):
+    """Gives temp_path the mode of the file at path, or 0o666 minus the umask if there is none yet.
+
+    tempfile.mkstemp creates files readable by their owner only and os.replace keeps that mode, so
+    atomic writes call this before replacing path.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~_umask()
+    os.chmod(temp_path, mode)
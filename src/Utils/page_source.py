@@ -0,0 +1,82 @@
+import threading
+from collections import OrderedDict
+from functools import partial
+
+import numpy as np
+
+from src.Utils.image_utils import image_from_bbox
+
+DEFAULT_CACHE_SIZE = 8
+
+
+class PdfPageSource:
+    """Renders PDF pages through fitz on first access and keeps the last cache_size pages decoded.
+
+    Rendered pages are read-only so that one cached array can be shared; copy before drawing on it.
+    """
+
+    def __init__(self, pdf_path: str, cache_size: int = DEFAULT_CACHE_SIZE):
+        import fitz
+
+        self.pdf_path = pdf_path
+        self.cache_size = max(1, cache_size)
+        self.hits = 0
+        self.misses = 0
+        self._document = fitz.open(pdf_path)
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._document)
+
+    def _render(self, page_number):
+        pixmap = self._document.load_page(page_number).get_pixmap()
+        image = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+        return image[:, :, :3] if pixmap.n > 3 else image
+
+    def page_image(self, page_number: int):
+        with self._lock:
+            image = self._pages.get(page_number)
+            if image is not None:
+                self._pages.move_to_end(page_number)
+                self.hits += 1
+                return image
+
+            self.misses += 1
+            image = self._render(page_number)
+            self._pages[page_number] = image
+            while len(self._pages) > self.cache_size:
+                self._pages.popitem(last=False)
+            return image
+
+    def crop(self, page_number: int, bbox):
+        return image_from_bbox(self.page_image(page_number), bbox)
+
+    def cached_pages(self):
+        with self._lock:
+            return list(self._pages)
+
+    def close(self):
+        with self._lock:
+            self._pages.clear()
+            self._document.close()
+
+
+def attach_page_source(page, source, page_number):
+    """Points the page and all of its panels, speech bubbles and entities at page page_number of source.
+
+    Crops are recomputed from the current bounding boxes every time they are read; the loaders look
+    the box up on their owner, so a bounding_box that is replaced later is picked up as well.
+    """
+    page.page_image = None
+    page.page_image_loader = partial(source.page_image, page_number)
+
+    for panel in page.panels:
+        panel.image = None
+        panel.image_loader = lambda panel=panel: source.crop(page_number, panel.bounding_box)
+        for speech_bubble in panel.speech_bubbles:
+            speech_bubble.image = None
+            speech_bubble.image_loader = lambda speech_bubble=speech_bubble: source.crop(page_number, speech_bubble.bounding_box)
+        for entity in panel.entities:
+            entity.image = None
+            entity.image_loader = lambda entity=entity: source.crop(page_number, entity.bounding_box)
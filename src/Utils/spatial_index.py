@@ -0,0 +1,103 @@
+import numpy as np
+
+
+class GridIndex:
+    """Uniform grid over (N, 4) x1, y1, x2, y2 boxes for candidate pruning and hit-testing.
+
+    Every box is registered in each cell it touches; the cell contents are kept in one CSR layout
+    (cell_starts / cell_boxes), so a query only looks at the boxes in the cells it covers.
+    """
+
+    def __init__(self, boxes, cell_size=None):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        count = len(self.boxes)
+
+        if count == 0:
+            self.origin = np.zeros(2)
+            self.cell_size = 1.0
+            self.shape = (1, 1)
+            self.cell_starts = np.zeros(2, dtype=np.intp)
+            self.cell_boxes = np.zeros(0, dtype=np.intp)
+            return
+
+        if cell_size is None:
+            sides = np.sqrt(np.clip((self.boxes[:, 2] - self.boxes[:, 0]) * (self.boxes[:, 3] - self.boxes[:, 1]), 1, None))
+            cell_size = float(np.median(sides))
+        self.cell_size = max(float(cell_size), 1.0)
+        self.origin = self.boxes[:, :2].min(axis=0)
+        extent = self.boxes[:, 2:].max(axis=0) - self.origin
+        self.shape = (int(extent[1] // self.cell_size) + 1, int(extent[0] // self.cell_size) + 1)
+
+        cell_ids, box_ids = self._covered_cells(self.boxes)
+        order = np.argsort(cell_ids, kind='stable')
+        self.cell_boxes = box_ids[order]
+        self.cell_starts = np.searchsorted(cell_ids[order], np.arange(self.shape[0] * self.shape[1] + 1))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _cell_ranges(self, boxes):
+        rows, columns = self.shape
+        low = np.floor((boxes[:, :2] - self.origin) / self.cell_size).astype(np.intp)
+        high = np.floor((boxes[:, 2:] - self.origin) / self.cell_size).astype(np.intp)
+        inside = (high[:, 0] >= 0) & (high[:, 1] >= 0) & (low[:, 0] < columns) & (low[:, 1] < rows)
+        low[:, 0] = np.clip(low[:, 0], 0, columns - 1)
+        low[:, 1] = np.clip(low[:, 1], 0, rows - 1)
+        high[:, 0] = np.clip(high[:, 0], 0, columns - 1)
+        high[:, 1] = np.clip(high[:, 1], 0, rows - 1)
+        return low, high, inside
+
+    def _covered_cells(self, boxes):
+        """Returns (cell_id, box_index) for every cell each box touches."""
+        low, high, inside = self._cell_ranges(boxes)
+        widths = np.where(inside, high[:, 0] - low[:, 0] + 1, 0)
+        counts = widths * np.where(inside, high[:, 1] - low[:, 1] + 1, 0)
+
+        box_ids = np.repeat(np.arange(len(boxes)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        row_widths = np.repeat(widths, counts)
+        cell_x = np.repeat(low[:, 0], counts) + local % np.maximum(row_widths, 1)
+        cell_y = np.repeat(low[:, 1], counts) + local // np.maximum(row_widths, 1)
+        return cell_y * self.shape[1] + cell_x, box_ids
+
+    def query_pairs(self, boxes):
+        """Returns (rows, cols): every query box index paired with every indexed box that intersects it."""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        empty = np.zeros(0, dtype=np.intp)
+        if len(self.boxes) == 0 or len(boxes) == 0:
+            return empty, empty
+
+        cell_ids, query_ids = self._covered_cells(boxes)
+        starts = self.cell_starts[cell_ids]
+        counts = self.cell_starts[cell_ids + 1] - starts
+
+        rows = np.repeat(query_ids, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cols = self.cell_boxes[np.repeat(starts, counts) + offsets]
+
+        keys = np.unique(rows * len(self.boxes) + cols)
+        rows, cols = keys // len(self.boxes), keys % len(self.boxes)
+
+        a, b = boxes[rows], self.boxes[cols]
+        intersects = (np.minimum(a[:, 2], b[:, 2]) > np.maximum(a[:, 0], b[:, 0])) & \
+                     (np.minimum(a[:, 3], b[:, 3]) > np.maximum(a[:, 1], b[:, 1]))
+        return rows[intersects], cols[intersects]
+
+    def query(self, box):
+        """Indices of the indexed boxes that intersect box, in ascending order."""
+        return self.query_pairs(np.asarray(box, dtype=np.float64).reshape(1, 4))[1]
+
+    def query_point(self, x, y):
+        """Indices of the indexed boxes that contain the point, in ascending order."""
+        if len(self.boxes) == 0:
+            return np.zeros(0, dtype=np.intp)
+        column = int((x - self.origin[0]) // self.cell_size)
+        row = int((y - self.origin[1]) // self.cell_size)
+        if not (0 <= row < self.shape[0] and 0 <= column < self.shape[1]):
+            return np.zeros(0, dtype=np.intp)
+
+        cell = row * self.shape[1] + column
+        candidates = self.cell_boxes[self.cell_starts[cell]:self.cell_starts[cell + 1]]
+        boxes = self.boxes[candidates]
+        hit = (boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3])
+        return np.sort(candidates[hit])
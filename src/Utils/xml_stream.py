@@ -0,0 +1,447 @@
+import io
+import mmap
+import re
+import xml.etree.ElementTree as eT
+import xml.sax.saxutils as saxutils
+from collections.abc import Sequence
+
+import numpy as np
+
+from src.Classes.comic import Comic
+from src.Classes.entity import Entity
+from src.Classes.page import Page, PageType
+from src.Classes.page_store import CompactPage
+from src.Classes.panel import Panel
+from src.Classes.speech_bubble import SpeechBubble
+from src.Utils import box_association as ba
+from src.Utils import image_utils as iu
+from src.Utils import io_utils
+
+XML_DECLARATION = b"<?xml version='1.0' encoding='utf-8'?>\n"
+
+
+class _StreamWriter:
+    """Writes the container tags of the annotation format directly and serializes leaves with ElementTree.
+
+    Indentation follows eT.indent, so the output is byte-identical to eT.tostring of the
+    (optionally eT.indent-ed) Comic.to_xml() tree.
+    """
+
+    def __init__(self, file, indent=None):
+        self.file = file
+        self.indent = indent
+
+    def _newline(self, level):
+        if self.indent is not None:
+            self.file.write(("\n" + self.indent * level).encode('utf-8'))
+
+    def start(self, tag, level):
+        if level > 0:
+            self._newline(level)
+        self.file.write(f"<{tag}>".encode('utf-8'))
+
+    def end(self, tag, level):
+        self._newline(level)
+        self.file.write(f"</{tag}>".encode('utf-8'))
+
+    def empty(self, tag, level):
+        self._newline(level)
+        self.file.write(f"<{tag} />".encode('utf-8'))
+
+    def leaf(self, tag, text, level):
+        element = eT.Element(tag)
+        element.text = text
+        self.element(element, level)
+
+    def element(self, element, level):
+        self._newline(level)
+        if self.indent is not None:
+            eT.indent(element, space=self.indent, level=level)
+        self.file.write(eT.tostring(element, encoding='utf-8'))
+
+
+def write_page(writer, page, level):
+    writer.start('Page', level)
+    writer.leaf('Index', str(page.page_index), level + 1)
+    writer.leaf('Type', page.page_type.name, level + 1)
+
+    if not page.panels:
+        writer.empty('Panels', level + 1)
+    else:
+        writer.start('Panels', level + 1)
+        for panel in page.panels:
+            writer.element(panel.to_xml(), level + 2)
+        writer.end('Panels', level + 1)
+
+    writer.end('Page', level)
+
+
+def write_comic(comic, file, indent=None, xml_declaration=False):
+    """Streams comic as annotation XML into the binary file handle.
+
+    Only one Panel subtree is held in memory at a time. Without indent the bytes equal
+    eT.tostring(comic.to_xml(), encoding='utf-8'), which is what parse_comic reads.
+    """
+    writer = _StreamWriter(file, indent)
+    if xml_declaration:
+        file.write(XML_DECLARATION)
+
+    writer.start('Comic', 0)
+    writer.leaf('Name', comic.name, 1)
+
+    if not comic.page_pairs:
+        writer.empty('PagePairs', 1)
+    else:
+        writer.start('PagePairs', 1)
+        for left_page, right_page in comic.page_pairs:
+            if left_page is None and right_page is None:
+                writer.empty('PagePair', 2)
+                continue
+
+            writer.start('PagePair', 2)
+            for tag, page in (('LeftPage', left_page), ('RightPage', right_page)):
+                if page is not None:
+                    writer.start(tag, 3)
+                    write_page(writer, page, 4)
+                    writer.end(tag, 3)
+            writer.end('PagePair', 2)
+        writer.end('PagePairs', 1)
+
+    writer.end('Comic', 0)
+    if indent is not None:
+        file.write(b"\n")
+
+
+def save_comic(comic, filepath, indent=None, xml_declaration=False):
+    with open(filepath, 'wb') as file:
+        write_comic(comic, file, indent=indent, xml_declaration=xml_declaration)
+
+
+BOUNDING_BOX_FLOAT_KEYS = ('x', 'y', 'width', 'height', 'confidence')
+PAGE_PAIR_PATTERN = re.compile(rb'<PagePair>.*?</PagePair>|<PagePair\s*/>', re.DOTALL)
+NAME_PATTERN = re.compile(rb'<Name>(.*?)</Name>|<Name\s*/>', re.DOTALL)
+
+
+def parse_bounding_box(text):
+    """Single pass version of io_utils.parse_bounding_box."""
+    bbox = {}
+    for part in text.split(','):
+        key, _, value = part.partition(':')
+        if key in BOUNDING_BOX_FLOAT_KEYS:
+            try:
+                bbox[key] = float(value) if value else 0.0
+            except ValueError as e:
+                raise ValueError(f"Invalid value for {key}: {value}") from e
+        else:
+            bbox[key] = value
+    return bbox
+
+
+def _children(element):
+    return {child.tag: child for child in element}
+
+
+def build_speech_bubble(element):
+    children = _children(element)
+    speech_bubble = SpeechBubble(
+        type=children['Type'].text,
+        text=io_utils.escape_text(children['Text'].text, reverse=True),
+        bounding_box=parse_bounding_box(children['BoundingBox'].text)
+    )
+    speech_bubble.speaker_id = children['Speaker_Id'].text
+    return speech_bubble
+
+
+def build_entity(element):
+    children = _children(element)
+    entity = Entity(bounding_box=parse_bounding_box(children['BoundingBox'].text))
+    entity.named_entity_id = int(io_utils.escape_text(children['Named_Entity_Id'].text))
+    entity.tags = [(tag.find('Label').text, float(tag.find('Value').text)) for tag in children['Tags']]
+    entity.starting_tag = io_utils.str_to_bool(children['Active_Tag'].text)
+    return entity
+
+
+def build_panel(element):
+    children = _children(element)
+    panel = Panel(
+        description=children['Description'].text,
+        bounding_box=parse_bounding_box(children['BoundingBox'].text),
+        speech_bubbles=[build_speech_bubble(sb) for sb in children['SpeechBubbles']],
+    )
+    panel.scene_id = int(children['Scene_Id'].text)
+    panel.starting_tag = io_utils.str_to_bool(children['Starting_Tag'].text)
+    panel.entities = [build_entity(en) for en in children['Entities']]
+    return panel
+
+
+def build_page(element, panels=None, compact=False):
+    children = _children(element)
+    if panels is None:
+        panels = [build_panel(panel) for panel in children['Panels']]
+    page = Page(
+        page_index=int(children['Index'].text),
+        page_type=PageType[children['Type'].text.upper()],
+        panels=panels
+    )
+    return CompactPage.from_page(page) if compact else page
+
+
+def build_page_pair(element, compact=False):
+    children = _children(element)
+    left = children.get('LeftPage')
+    right = children.get('RightPage')
+    left_page = build_page(left.find('Page'), compact=compact) if left is not None and len(left) else None
+    right_page = build_page(right.find('Page'), compact=compact) if right is not None and len(right) else None
+    return left_page, right_page
+
+
+def iter_page_pairs(source, compact=False):
+    """Yields ('name', str) once and then ('pair', (left_page, right_page)) per PagePair, built with iterparse.
+
+    Panels are turned into objects as their elements close, and every finished element is cleared
+    and detached from its parent, so the parsed tree never grows beyond the current page. With
+    compact=True every page is converted to a CompactPage as soon as it is complete.
+    """
+    stack = []
+    panels = []
+    pages = {}
+
+    for event, element in eT.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        tag = element.tag
+
+        if tag == 'Name' and parent is not None and parent.tag == 'Comic':
+            yield 'name', element.text
+        elif tag == 'Panel' and parent is not None and parent.tag == 'Panels':
+            panels.append(build_panel(element))
+            parent.remove(element)
+        elif tag == 'Page':
+            pages[parent.tag] = build_page(element, panels, compact)
+            panels = []
+            element.clear()
+        elif tag == 'PagePair':
+            yield 'pair', (pages.get('LeftPage'), pages.get('RightPage'))
+            pages = {}
+            parent.remove(element)
+
+
+class LazyPagePairs(Sequence):
+    """Page pairs of an annotation file that are only parsed when they are accessed.
+
+    Opening the file only scans for the PagePair byte ranges; each pair is parsed on first access
+    and then kept.
+    """
+
+    def __init__(self, data, spans, compact=False):
+        self._data = data
+        self._spans = spans
+        self._compact = compact
+        self._pairs = [None] * len(spans)
+
+    def __len__(self):
+        return len(self._spans)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if self._pairs[index] is None:
+            start, end = self._spans[index]
+            self._pairs[index] = build_page_pair(eT.fromstring(self._data[start:end]), self._compact)
+        return self._pairs[index]
+
+    def loaded_count(self):
+        return sum(pair is not None for pair in self._pairs)
+
+    def materialize(self):
+        return [self[i] for i in range(len(self))]
+
+
+def _read_source(source):
+    if isinstance(source, (bytes, bytearray)):
+        return source
+    if isinstance(source, str):
+        with open(source, 'rb') as file:
+            try:
+                return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return b''
+    return source.read()
+
+
+def load_comic(source, lazy=False, compact=False):
+    """Loads an annotation XML from a path, binary file object or bytes.
+
+    With lazy=True the returned Comic's page_pairs is a LazyPagePairs and pages are only parsed
+    when accessed. With compact=True pages are CompactPages, which keep their boxes in NumPy
+    columns and need a fraction of the memory for large corpora.
+    """
+    if lazy:
+        data = _read_source(source)
+        match = NAME_PATTERN.search(data)
+        name = saxutils.unescape(match.group(1).decode('utf-8')) if match and match.group(1) is not None else None
+        spans = [m.span() for m in PAGE_PAIR_PATTERN.finditer(data)]
+        return Comic(name, LazyPagePairs(data, spans, compact))
+
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    name = None
+    page_pairs = []
+    for kind, value in iter_page_pairs(source, compact):
+        if kind == 'name':
+            name = value
+        else:
+            page_pairs.append(value)
+    return Comic(name, page_pairs)
+
+
+CVAT_PANEL_LABEL = 'panel'
+CVAT_TEXT_LABEL = 'text'
+CVAT_CHARACTER_LABEL = 'character'
+CVAT_SPEAKER_LINK_LABEL = 'link_sbsc'
+CVAT_CHARACTER_ID_LABEL = 'charids'
+
+
+def _parse_points(text):
+    return np.array([[float(v) for v in point.split(',')] for point in text.split(';')], dtype=np.float64)
+
+
+def iter_cvat_images(source):
+    """Yields one dict per <image> of a CVAT for images 1.1 export.
+
+    Each dict has name, width, height, boxes ({label: (N, 4) x1, y1, x2, y2 array}) and
+    shapes ({label: [(K, 2) point arrays]}) for polylines, points and polygons.
+    """
+    stack = []
+    for event, element in eT.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            continue
+
+        stack.pop()
+        if element.tag != 'image':
+            continue
+
+        boxes = {}
+        shapes = {}
+        for child in element:
+            label = child.get('label')
+            if child.tag == 'box':
+                boxes.setdefault(label, []).append([float(child.get(key)) for key in ('xtl', 'ytl', 'xbr', 'ybr')])
+            elif child.tag in ('polyline', 'points', 'polygon'):
+                shapes.setdefault(label, []).append(_parse_points(child.get('points')))
+
+        yield {
+            'name': element.get('name'),
+            'width': int(float(element.get('width'))),
+            'height': int(float(element.get('height'))),
+            'boxes': {label: ba.xyxy_to_array(values) for label, values in boxes.items()},
+            'shapes': shapes
+        }
+
+        element.clear()
+        if stack:
+            stack[-1].remove(element)
+
+
+def _containing_box(boxes, point):
+    """Index of the smallest box containing point, or -1."""
+    if len(boxes) == 0:
+        return -1
+    x, y = point
+    inside = (boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3])
+    if not inside.any():
+        return -1
+    candidates = np.flatnonzero(inside)
+    return candidates[ba.areas(boxes[candidates]).argmin()]
+
+
+def _character_identities(characters, charid_shapes):
+    """Union-find over characters joined by charids point groups; returns one cluster id per character."""
+    parents = list(range(len(characters)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for points in charid_shapes:
+        members = [i for i in (_containing_box(characters, point) for point in points) if i >= 0]
+        for member in members[1:]:
+            parents[find(member)] = find(members[0])
+
+    cluster_ids = {}
+    return [cluster_ids.setdefault(find(i), len(cluster_ids)) for i in range(len(characters))]
+
+
+def build_cvat_page(image, page_index):
+    """Turns one iter_cvat_images record into a Page.
+
+    Texts and characters go to the panel that covers the largest share of them; speaker links set
+    the speech bubble's speaker and charids groups set the named entity ids.
+    """
+    empty = np.zeros((0, 4))
+    panel_boxes = image['boxes'].get(CVAT_PANEL_LABEL, empty)
+    text_boxes = image['boxes'].get(CVAT_TEXT_LABEL, empty)
+    character_boxes = image['boxes'].get(CVAT_CHARACTER_LABEL, empty)
+
+    panel_boxes = panel_boxes[ba.reading_order(panel_boxes)]
+    panels = [Panel('', iu.x1y1x2y2_to_xywh(box)) for box in panel_boxes.tolist()]
+    page = Page(page_index=page_index, page_type=PageType.SINGLE, panels=panels,
+                height=image['height'], width=image['width'])
+    panel_index = page.get_panel_index()
+
+    def assign(boxes):
+        rows, cols = panel_index.query_pairs(boxes)
+        scores = ba.pair_overlap(boxes, panel_index.boxes, rows, cols)
+        return ba.assign_pairs_to_best(rows, cols, scores, len(boxes))
+
+    identities = _character_identities(character_boxes, image['shapes'].get(CVAT_CHARACTER_ID_LABEL, []))
+    entities = []
+    for box, panel_id, identity in zip(character_boxes.tolist(), assign(character_boxes), identities):
+        entity = Entity(iu.x1y1x2y2_to_xywh(box))
+        entity.named_entity_id = identity
+        entities.append(entity)
+        if panel_id >= 0:
+            panels[panel_id].entities.append(entity)
+
+    speech_bubbles = []
+    for box, panel_id in zip(text_boxes.tolist(), assign(text_boxes)):
+        speech_bubble = SpeechBubble('dialogue', '', iu.x1y1x2y2_to_xywh(box))
+        speech_bubbles.append(speech_bubble)
+        if panel_id >= 0:
+            panels[panel_id].speech_bubbles.append(speech_bubble)
+
+    for points in image['shapes'].get(CVAT_SPEAKER_LINK_LABEL, []):
+        ends = (points[0], points[-1])
+        texts = [_containing_box(text_boxes, point) for point in ends]
+        characters = [_containing_box(character_boxes, point) for point in ends]
+        for text_id, character_id in ((texts[0], characters[1]), (texts[1], characters[0])):
+            if text_id >= 0 and character_id >= 0:
+                speech_bubbles[text_id].speaker_id = entities[character_id].named_entity_id
+                speech_bubbles[text_id].speaker.append(entities[character_id])
+                break
+
+    return page
+
+
+def load_cvat(source):
+    """Reads a CVAT export such as Data/c100-val.xml into one Comic per image folder.
+
+    Comics are named after the folder prefix of the image names and keep the export order.
+    """
+    pages_by_comic = {}
+    for image in iter_cvat_images(source):
+        comic_name, _, _ = image['name'].rpartition('/')
+        pages = pages_by_comic.setdefault(comic_name, [])
+        pages.append(build_cvat_page(image, len(pages) + 1))
+
+    return [Comic.from_pages(name, pages) for name, pages in pages_by_comic.items()]